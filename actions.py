@@ -0,0 +1,140 @@
+import numpy as np
+
+from game.enums_and_config import ActionType, game_player_configs
+from game.sampler import get_team_sampler
+from game.teams import NO_TEAM, get_team_encoding
+
+"""
+Action decoding tables shared by AvalonEnv and AvalonVecEnv.
+
+The action is MultiDiscrete([number of team selection options, 3, 3]), i.e. [team, no-op/approve/reject, no-op/pass/fail].
+Only the entry of the current action type is used by the game. A team of the wrong size, a no-op for the
+current action type, or a non no-op for a different action type is penalized by the environment.
+
+The team entry is the index of the team among the teams of all the quest sizes (see game.teams). With the factored
+team actions it's the index among the teams of the current quest size instead, so the team entry only has as many
+options as the largest quest size has teams, and an entry is of the wrong size only if it's beyond the number of
+teams of the current size.
+"""
+
+NO_CHOICE = -1
+# Approve/reject and pass/fail entries of the action -> value passed to the game
+CHOICE_VALUES = (None, True, False)
+CHOICE_CODES = np.array([NO_CHOICE, 1, 0], dtype=np.int8)
+
+
+class ActionTables:
+    """
+    Decode tables and legal action masks for a player count, built once. Use get_action_tables to get the
+    (shared) instance for a player count.
+    """
+    def __init__(self, num_players, factored=False):
+        """
+        :param factored: Factored team actions, see the module docs.
+        """
+        sampler = get_team_sampler(num_players)
+        self.num_players = num_players
+        self.factored = factored
+        self.encoding = get_team_encoding(num_players)
+        # Team index -> team bit mask / team size
+        self.team_masks = sampler.team_masks
+        self.team_sizes = sampler.team_sizes
+        self._team_sizes = self.team_sizes.tolist()
+        num_team_entries = self.encoding.max_count if factored else self.encoding.num_teams
+        self.nvec = (num_team_entries, len(CHOICE_VALUES), len(CHOICE_VALUES))
+        # Quest size -> number of teams / index of the first team, as arrays for the vectorized decoding
+        self._size_counts = np.zeros(max(self.encoding.sizes) + 1, dtype=np.int64)
+        self._size_offsets = np.zeros(max(self.encoding.sizes) + 1, dtype=np.int64)
+        for size in self.encoding.sizes:
+            self._size_counts[size] = self.encoding.counts[size]
+            self._size_offsets[size] = self.encoding.offsets[size]
+        self._entries = np.arange(num_team_entries)
+
+        # Masks are concatenated per entry of the action, like the MultiDiscrete nvec.
+        self._masks = {}
+        for team_size in set(game_player_configs[num_players].quest_size):
+            for action_type in ActionType:
+                mask = np.concatenate([
+                    self._team_entry_mask(team_size) if action_type is ActionType.TEAM_SELECTION
+                    else np.ones(num_team_entries, dtype=bool),
+                    self._choice_mask(action_type is ActionType.TEAM_APPROVAL),
+                    self._choice_mask(action_type is ActionType.QUEST_VOTE),
+                ])
+                mask.flags.writeable = False
+                self._masks[(action_type, team_size)] = mask
+
+    def _team_entry_mask(self, team_size):
+        if self.factored:
+            return self._entries < self.encoding.counts[team_size]
+        return self.team_sizes == team_size
+
+    @staticmethod
+    def _choice_mask(current):
+        # For the current action type a no-op is penalized, for the others anything but a no-op is.
+        return CHOICE_CODES != NO_CHOICE if current else CHOICE_CODES == NO_CHOICE
+
+    def decode(self, action, action_type, team_size):
+        """
+        Value of the action that can be passed to the game, or None if the action isn't relevant
+        for the action type.
+        """
+        value = action[action_type.value]
+        if action_type is ActionType.TEAM_SELECTION:
+            index = self.team_index(value, team_size)
+            if index == NO_TEAM:
+                return None
+            return self.encoding.team(index)
+        return CHOICE_VALUES[value]
+
+    def team_index(self, entry, team_size):
+        """
+        Index of the team of the team entry of an action (see game.teams), NO_TEAM if it's of the wrong size.
+        """
+        if self.factored:
+            if entry >= self.encoding.counts[team_size]:
+                return NO_TEAM
+            return self.encoding.offsets[team_size] + entry
+        return entry if self._team_sizes[entry] == team_size else NO_TEAM
+
+    def team_indices(self, entries, team_sizes):
+        """
+        Vectorized team_index, for arrays of team entries and team sizes. Decode the teams with
+        self.encoding.unrank_batch, or index team_masks with them.
+        """
+        entries, team_sizes = np.asarray(entries, dtype=np.int64), np.asarray(team_sizes, dtype=np.int64)
+        if self.factored:
+            return np.where(entries < self._size_counts[team_sizes], self._size_offsets[team_sizes] + entries, NO_TEAM)
+        return np.where(self.team_sizes[entries] == team_sizes, entries, NO_TEAM)
+
+    def legal_action_mask(self, action_type, team_size):
+        """
+        Boolean mask of the actions that aren't penalized, concatenated per entry of the action (read-only).
+        """
+        return self._masks[(action_type, team_size)]
+
+    def legal_action_masks(self, action_types, team_sizes):
+        """
+        Vectorized legal_action_mask, for arrays of action type values and team sizes.
+        """
+        action_types = np.asarray(action_types)[:, None]
+        team_sizes = np.asarray(team_sizes, dtype=np.int64)[:, None]
+        if self.factored:
+            legal_teams = self._entries < self._size_counts[team_sizes]
+        else:
+            legal_teams = self.team_sizes == team_sizes
+        team = np.where(action_types == ActionType.TEAM_SELECTION.value, legal_teams, True)
+        approval = np.where(action_types == ActionType.TEAM_APPROVAL.value, CHOICE_CODES != NO_CHOICE,
+                            CHOICE_CODES == NO_CHOICE)
+        vote = np.where(action_types == ActionType.QUEST_VOTE.value, CHOICE_CODES != NO_CHOICE,
+                        CHOICE_CODES == NO_CHOICE)
+        return np.concatenate([team, approval, vote], axis=1)
+
+
+_tables = {}
+
+
+def get_action_tables(num_players, factored=False):
+    key = (num_players, factored)
+    if key not in _tables:
+        _tables[key] = ActionTables(num_players, factored)
+    return _tables[key]
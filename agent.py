@@ -2,6 +2,8 @@ from collections import defaultdict
 import numpy as np
 import random
 
+from q_table import DenseQTable
+
 
 def float_dd():
     return defaultdict(float)
@@ -50,6 +52,9 @@ class RandomAgent(Agent):
     def predict(self, obs, info):
         return self.env.action_space.sample()
 
+    def predict_batch(self, observations, infos):
+        return [self.env.action_space.sample() for _ in infos]
+
 
 class QTableAgent(Agent):
     """
@@ -80,16 +85,23 @@ class QTableAgent(Agent):
             },
         }
     }
+
+    With dense=True, the q-table of every character type is a DenseQTable instead, which supports the
+    same q_table[char_type][state][action] access but stores the values in float32 arrays.
     """
-    def __init__(self, alpha=0.1, gamma=0.9, epsilon=0.2, **kwargs):
+    def __init__(self, alpha=0.1, gamma=0.9, epsilon=0.2, dense=False, track_changes=False, **kwargs):
         super(QTableAgent, self).__init__(**kwargs)
         self.q_table = {}
         self.epsilon = epsilon
         self.alpha = alpha
         self.gamma = gamma
+        self.dense = dense
+        # (char_type, state, action) entries updated since the last clear, used for the incremental checkpoints.
+        self.changed_entries = set() if track_changes else None
 
-    @staticmethod
-    def _init_q_table_for_char_type():
+    def _init_q_table_for_char_type(self):
+        if self.dense:
+            return DenseQTable(self.env.observation_space.nvec, self.env.action_space.nvec)
         # Default value of 0 for every state-action pair
         return defaultdict(float_dd)
 
@@ -114,10 +126,19 @@ class QTableAgent(Agent):
             # Updating the q_values as per bellman equation
             action_taken = tuple(action_taken)
             old_obs = tuple(info['prev_obs'])
-            old_value = q_table[old_obs][action_taken]
-            next_max = max(q_table[new_obs].values()) if len(q_table[new_obs].values()) > 0 else 0.0
+            if self.dense:
+                old_value = q_table.get_value(old_obs, action_taken)
+                next_max = q_table.max_value(new_obs)
+            else:
+                old_value = q_table[old_obs][action_taken]
+                next_max = max(q_table[new_obs].values()) if len(q_table[new_obs].values()) > 0 else 0.0
             new_value = (1 - self.alpha) * old_value + self.alpha * (reward + self.gamma * next_max)
-            q_table[old_obs][action_taken] = new_value
+            if self.dense:
+                q_table.set_value(old_obs, action_taken, new_value)
+            else:
+                q_table[old_obs][action_taken] = new_value
+            if self.changed_entries is not None:
+                self.changed_entries.add((info['char_type'], old_obs, action_taken))
 
         return self.predict(new_obs, info, False)
 
@@ -135,9 +156,38 @@ class QTableAgent(Agent):
         #random_action = self._sample(info['num_players'], info['quest_team_size'])
         if not direct and random_val < self.epsilon:
             action = random_action  # Explore action space
+        elif self.dense:
+            action = list(q_table.greedy_action(obs, default=random_action))  # Exploit learned values
         else:
             q_vals = q_table[tuple(obs)]
             action = max(q_vals, key=q_vals.get, default=random_action)  # Exploit learned values
             #action = (np.array(action[0]), action[1], action[2])
             action = list(action)
         return action
+
+    def predict_batch(self, observations, infos):
+        """
+        Greedy actions for a batch of observations, same as calling predict (with direct=True) on every row.
+        """
+        actions = []
+        for obs, info in zip(np.asarray(observations).tolist(), infos):
+            if info is None:
+                actions.append(self.env.action_space.sample())
+                continue
+            if self.dense:
+                actions.append(self.get_q_table(info['char_type']).greedy_action(obs, default=None)
+                               or self.env.action_space.sample())
+                continue
+            q_vals = self.get_q_table(info['char_type'])[tuple(obs)]
+            if q_vals:
+                actions.append(list(max(q_vals, key=q_vals.get)))  # Exploit learned values
+            else:
+                actions.append(self.env.action_space.sample())
+        return actions
+
+    def memory_usage(self):
+        """
+        Memory usage of the dense q-tables per character type, see DenseQTable.memory_usage.
+        """
+        assert self.dense, "Only reported for the dense q-tables"
+        return {char_type: q_table.memory_usage() for char_type, q_table in self.q_table.items()}
@@ -0,0 +1,156 @@
+"""
+Throughput benchmark suite for AvalonEnv.
+
+Measures the agent steps per second and episodes per second of the training loop (agent + env), and the latency
+percentiles of env.step alone, for every player count, with autoplay on and off, majority_rule on and off, and
+with a random agent and a (learning) Q-table agent.
+
+The results are saved as JSON, and compared against a baseline JSON (e.g. the results saved before a change in
+game/quest.py or in environment.py). A configuration is flagged when its throughput is lower, or its median / p90
+latency higher, than the baseline by more than the threshold. The script exits with a non zero status if any
+configuration is flagged.
+
+Usage,
+
+$ python -m benchmarks.env_throughput --output before.json
+$ python -m benchmarks.env_throughput --output after.json --baseline before.json
+$ python -m benchmarks.env_throughput --players 5 7 --duration 0.5  # A subset, shorter runs
+"""
+import argparse
+import itertools
+import json
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+
+from agent import QTableAgent, RandomAgent
+from environment import AvalonEnv
+from game.enums_and_config import game_player_configs
+
+AGENTS = {
+    'random': RandomAgent,
+    'q_table': QTableAgent,
+}
+# Metric -> whether higher is better
+METRICS = {
+    'steps_per_sec': True,
+    'episodes_per_sec': True,
+    'step_latency_p50_us': False,
+    'step_latency_p90_us': False,
+    'step_latency_p99_us': False,
+}
+# The p99 latency is too noisy to be flagged
+COMPARED_METRICS = ('steps_per_sec', 'episodes_per_sec', 'step_latency_p50_us', 'step_latency_p90_us')
+
+
+def config_name(num_players, autoplay, majority_rule, agent):
+    return f'players={num_players},autoplay={autoplay},majority_rule={majority_rule},agent={agent}'
+
+
+def benchmark(num_players, autoplay, majority_rule, agent, duration=1.0, seed=0):
+    """
+    Runs whole episodes of the training loop of q_learning_trial.train for about `duration` seconds.
+    """
+    env = AvalonEnv(num_players, enable_logs=False, autoplay=autoplay, majority_rule=majority_rule)
+    env.seed(seed)
+    random.seed(seed)
+    np.random.seed(seed)
+    agent = AGENTS[agent](env=env)
+
+    latencies = []
+    steps = episodes = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        obs, info = env.reset(external=False)
+        info['prev_obs'] = None
+        reward = 0
+        done = False
+        while not done:
+            action = agent.get_next_action(obs, reward, info)
+            prev_obs = obs
+            step_start = time.perf_counter_ns()
+            obs, reward, done, info = env.step(action)
+            latencies.append(time.perf_counter_ns() - step_start)
+            info['prev_obs'] = prev_obs
+            steps += 1
+        episodes += 1
+    elapsed = time.perf_counter() - start
+
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) / 1000
+    return {
+        'steps_per_sec': steps / elapsed,
+        'episodes_per_sec': episodes / elapsed,
+        'step_latency_p50_us': p50,
+        'step_latency_p90_us': p90,
+        'step_latency_p99_us': p99,
+        'steps': steps,
+        'episodes': episodes,
+    }
+
+
+def run_suite(players, duration):
+    results = {}
+    for num_players, autoplay, majority_rule, agent in itertools.product(players, (False, True), (True, False), AGENTS):
+        name = config_name(num_players, autoplay, majority_rule, agent)
+        results[name] = benchmark(num_players, autoplay, majority_rule, agent, duration)
+        result = results[name]
+        print(f'{name:<60}  {result["steps_per_sec"]:>10,.0f} steps/s  {result["episodes_per_sec"]:>8,.1f} episodes/s  '
+              f'p50 {result["step_latency_p50_us"]:>7.1f}us  p99 {result["step_latency_p99_us"]:>7.1f}us')
+    return {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'duration': duration,
+        },
+        'results': results,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    :return: (config name, metric, baseline value, value, relative change) of the regressions beyond the threshold.
+    """
+    regressions = []
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            continue
+        for metric in COMPARED_METRICS:
+            before, after = baseline['results'][name][metric], result[metric]
+            change = (after - before) / before
+            worse = -change if METRICS[metric] else change
+            if worse > threshold:
+                regressions.append((name, metric, before, after, change))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='AvalonEnv throughput benchmark suite')
+    parser.add_argument('--players', type=int, nargs='+', default=sorted(game_player_configs),
+                        help='Player counts to benchmark')
+    parser.add_argument('--duration', type=float, default=1.0, help='Seconds per configuration')
+    parser.add_argument('--output', help='Save the results into this JSON file')
+    parser.add_argument('--baseline', help='Compare the results against this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='Relative change flagged as a regression (0.15 is 15%% slower)')
+    args = parser.parse_args()
+
+    results = run_suite(args.players, args.duration)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        print()
+        if not regressions:
+            print(f'No regression beyond {args.threshold:.0%} against {args.baseline}')
+        for name, metric, before, after, change in regressions:
+            print(f'REGRESSION {name} {metric}: {before:,.1f} -> {after:,.1f} ({change:+.1%})')
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,53 @@
+"""
+Throughput scaling and convergence of q_learning_trial.train_hogwild against the single process train().
+
+Every configuration trains a new agent for the same number of episodes, and is evaluated on the same
+evaluation episodes afterwards.
+
+Usage,
+
+$ python -m benchmarks.hogwild
+"""
+import contextlib
+import io
+import os
+import time
+
+import numpy as np
+
+from agent import QTableAgent
+from environment import AvalonEnv
+from evaluation import evaluate
+import q_learning_trial
+
+
+def run(num_workers, lock_free=True, num_players=5, num_episodes=20000, num_eval_episodes=2000, seed=0):
+    env = AvalonEnv(num_players, enable_logs=False)
+    env.seed(seed)
+    agent = QTableAgent(env=env, dense=True)
+    start = time.perf_counter()
+    # Only the callback at the start (the callbacks print their evaluations)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if num_workers is None:
+            q_learning_trial.train(num_episodes, env, agent, callback_every=num_episodes)
+        else:
+            q_learning_trial.train_hogwild(num_episodes, env, agent, num_workers=num_workers, lock_free=lock_free,
+                                           callback_every=num_episodes, seed=seed)
+    elapsed = time.perf_counter() - start
+    rewards, _, _ = evaluate(agent.predict_batch, env.get_config(), num_eval_episodes, seed=seed + 1)
+    return num_episodes / elapsed, np.mean(rewards)
+
+
+if __name__ == "__main__":
+    print('trainer           workers   episodes/sec   speedup   eval reward')
+    single, reward = run(None)
+    print(f'{"train":<16}  {1:>7}  {single:>13,.0f}  {1:>7.2f}x  {reward:>12.3f}')
+    for lock_free in (True, False):
+        name = 'hogwild' if lock_free else 'striped locks'
+        workers = 1
+        while True:
+            result, reward = run(workers, lock_free)
+            print(f'{name:<16}  {workers:>7}  {result:>13,.0f}  {result / single:>7.2f}x  {reward:>12.3f}')
+            if workers >= os.cpu_count():
+                break
+            workers = min(2 * workers, os.cpu_count())
@@ -0,0 +1,62 @@
+"""
+Benchmark for the learned opponents of an OpponentPool (see opponents.py).
+
+A dense QTableAgent (trained for a bit with BatchedQLearning) plays all the seats but the agent's, in batches of
+envs of different sizes. A batch of one env is the same as a predict call per seat and move, the larger batches
+share every inference between the envs. Reports the agent steps and learned seat moves per second, and the moves per
+inference.
+
+Usage,
+
+$ python -m benchmarks.opponents
+$ python -m benchmarks.opponents --players 7 --batches 1 64 256
+"""
+import argparse
+import time
+
+from agent import QTableAgent
+from environment import AvalonEnv
+from opponents import OpponentPool
+from vec_q_learning import BatchedQLearning
+
+
+def trained_agent(num_players, seed=0):
+    agent = QTableAgent(env=AvalonEnv(num_players, enable_logs=False), dense=True)
+    BatchedQLearning(agent, num_envs=256, seed=seed).learn(200)
+    agent.env.seed(seed)
+    return agent
+
+
+def benchmark(agent, num_players, num_envs, duration=2.0, seed=0):
+    learned_seats = tuple(range(1, num_players))
+    envs = [AvalonEnv(num_players, enable_logs=False, learned_seats=learned_seats) for _ in range(num_envs)]
+    for idx, env in enumerate(envs):
+        env.seed(seed + idx)
+        env.reset()
+    pool = OpponentPool({seat: agent for seat in learned_seats})
+
+    steps = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        # The agent plays at random, only the learned seats are measured
+        actions = [env.action_space.sample() for env in envs]
+        for env, (obs, reward, done, info) in zip(envs, pool.step(envs, actions)):
+            if done:
+                env.reset()
+        steps += num_envs
+    elapsed = time.perf_counter() - start
+    return steps / elapsed, pool.num_moves / elapsed, pool.num_moves / max(pool.num_inferences, 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Learned opponents throughput')
+    parser.add_argument('--players', type=int, default=5)
+    parser.add_argument('--batches', type=int, nargs='+', default=[1, 16, 64, 256], help='Numbers of envs per batch')
+    parser.add_argument('--duration', type=float, default=2.0, help='Seconds per batch size')
+    args = parser.parse_args()
+
+    agent = trained_agent(args.players)
+    print('envs    agent steps/sec    learned moves/sec    moves/inference')
+    for num_envs in args.batches:
+        steps_per_sec, moves_per_sec, moves_per_inference = benchmark(agent, args.players, num_envs, args.duration)
+        print(f'{num_envs:<6}  {steps_per_sec:>15,.0f}  {moves_per_sec:>19,.0f}  {moves_per_inference:>17.1f}')
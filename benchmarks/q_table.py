@@ -0,0 +1,67 @@
+"""
+Microbenchmark for the greedy action and max q-value lookups of QTableAgent, per player count.
+
+Compares the dict backend (a scan over the tried actions of the state), a scan over the dense row, and the
+cached max / argmax of DenseQTable, on states where a good part of the actions were tried.
+
+Usage,
+
+$ python -m benchmarks.q_table
+"""
+from collections import defaultdict
+import timeit
+
+import numpy as np
+
+from environment import AvalonEnv
+from game.enums_and_config import game_player_configs
+from q_table import DenseQTable
+
+
+def benchmark(num_players, num_states=64, tried_fraction=0.5, number=20000, seed=0):
+    env = AvalonEnv(num_players, enable_logs=False)
+    rng = np.random.default_rng(seed)
+    dense = DenseQTable(env.observation_space.nvec, env.action_space.nvec)
+    table = defaultdict(lambda: defaultdict(float))
+
+    states = [tuple(int(v) for v in rng.integers(env.observation_space.nvec)) for _ in range(num_states)]
+    num_tried = int(dense.num_actions * tried_fraction)
+    for state in states:
+        for action_idx in rng.choice(dense.num_actions, num_tried, replace=False):
+            action = dense.action_from_index(int(action_idx))
+            value = float(rng.normal())
+            table[state][action] = value
+            dense.set_value(state, action, value)
+
+    keys = [dense.state_key(state) for state in states]
+    rows = [dense._row_values(dense._rows[key]) for key in keys]
+    position = iter(range(10 ** 12))
+
+    def dict_lookup():
+        q_vals = table[states[next(position) % num_states]]
+        return max(q_vals.values()), max(q_vals, key=q_vals.get)
+
+    def dense_scan():
+        values = rows[next(position) % num_states]
+        return np.nanmax(values), np.nanargmax(values)
+
+    def dense_cached():
+        key = keys[next(position) % num_states]
+        return dense.max_value(key), dense.greedy_action(key)
+
+    def ops_per_second(fn):
+        return number / timeit.timeit(fn, number=number)
+
+    return num_tried, {
+        'dict': ops_per_second(dict_lookup),
+        'dense_scan': ops_per_second(dense_scan),
+        'dense_cached': ops_per_second(dense_cached),
+    }
+
+
+if __name__ == "__main__":
+    print('players  tried actions           dict     dense scan   dense cached   (lookups/sec)')
+    for num_players in game_player_configs:
+        num_tried, result = benchmark(num_players)
+        print(f'{num_players:>7}  {num_tried:>13}  {result["dict"]:>13,.0f}  {result["dense_scan"]:>13,.0f}  '
+              f'{result["dense_cached"]:>13,.0f}   {result["dense_cached"] / result["dict"]:.1f}x')
@@ -0,0 +1,38 @@
+"""
+Benchmark for the scaling of SharedMemoryVecEnv with the number of worker processes.
+
+Usage,
+
+$ python -m benchmarks.shm_vec_env
+"""
+import os
+import time
+
+import numpy as np
+
+from shm_vec_env import SharedMemoryVecEnv
+
+
+def steps_per_second(num_workers, num_envs=64, num_steps=200, num_players=5):
+    env = SharedMemoryVecEnv(num_envs, dict(num_players=num_players, enable_logs=False), num_workers=num_workers, seed=0)
+    env.reset()
+    actions = np.array([[env.action_space.sample() for _ in range(num_envs)] for _ in range(num_steps)])
+    start = time.perf_counter()
+    for action in actions:
+        env.step(action)
+    elapsed = time.perf_counter() - start
+    env.close()
+    return num_envs * num_steps / elapsed
+
+
+if __name__ == "__main__":
+    workers = 1
+    print('workers      steps/sec    speedup')
+    while True:
+        result = steps_per_second(workers)
+        if workers == 1:
+            single = result
+        print(f'{workers:>7}  {result:>13,.0f}  {result / single:>8.2f}x')
+        if workers >= os.cpu_count():
+            break
+        workers = min(2 * workers, os.cpu_count())
@@ -0,0 +1,41 @@
+"""
+Benchmark for branching the game, i.e. AvalonGame.snapshot / restore and AvalonEnv.clone.
+
+Usage,
+
+$ python -m benchmarks.snapshot
+"""
+import timeit
+
+from environment import AvalonEnv
+from game.enums_and_config import game_player_configs
+
+
+def benchmark(num_players, number=20000):
+    """
+    Operations per second for snapshot, restore and clone at the given player count.
+    """
+    env = AvalonEnv(num_players, enable_logs=False)
+    env.reset()
+    game = env.game
+    snapshot = game.snapshot()
+    state_only = game.snapshot(include_rng=False)
+
+    def ops_per_second(fn, n=number):
+        return n / timeit.timeit(fn, number=n)
+
+    return {
+        'snapshot': ops_per_second(lambda: game.snapshot(include_rng=False)),
+        'snapshot_with_rng': ops_per_second(lambda: game.snapshot()),
+        'restore': ops_per_second(lambda: game.restore(state_only)),
+        'restore_with_rng': ops_per_second(lambda: game.restore(snapshot)),
+        'env_clone': ops_per_second(env.clone, number // 10),
+    }
+
+
+if __name__ == "__main__":
+    results = {n: benchmark(n) for n in game_player_configs}
+    columns = list(results[min(results)].keys())
+    print('players  ' + '  '.join(f'{c:>18}' for c in columns) + '   (ops/sec)')
+    for num_players, result in results.items():
+        print(f'{num_players:>7}  ' + '  '.join(f'{result[c]:>18,.0f}' for c in columns))
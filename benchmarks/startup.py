@@ -0,0 +1,93 @@
+"""
+Startup benchmark.
+
+Measures the time to import the main modules in a fresh interpreter (and which heavy packages each of them pulls in),
+and the latency from starting a worker process to its first AvalonEnv step, with the spawn and forkserver start
+methods used by SharedMemoryVecEnv / train_hogwild.
+
+Usage,
+
+$ python -m benchmarks.startup
+$ python -m benchmarks.startup --repeats 10 --players 5 11
+"""
+import argparse
+import multiprocessing
+import statistics
+import subprocess
+import sys
+import time
+
+from environment import AvalonEnv
+
+MODULES = ('game.avalon', 'environment', 'vec_env', 'q_learning_trial', 'shm_worker', 'baseline_trial')
+HEAVY_PACKAGES = ('numpy', 'gym', 'tensorflow', 'stable_baselines')
+
+_IMPORT_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(elapsed, ','.join(name for name in {packages!r} if name in sys.modules))
+'''
+
+
+def import_time(module, repeats):
+    """
+    :return: Median seconds to import the module in a new interpreter, and the heavy packages it imported.
+    """
+    times = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', _IMPORT_SCRIPT.format(module=module, packages=HEAVY_PACKAGES)],
+                                capture_output=True, text=True, check=True).stdout.split()
+        times.append(float(output[0]))
+    return statistics.median(times), output[1] if len(output) > 1 else ''
+
+
+def _first_step(remote, env_kwargs):
+    env = AvalonEnv(**env_kwargs)
+    env.seed(0)
+    env.reset()
+    env.step(env.action_space.sample())
+    remote.send(None)
+    remote.close()
+
+
+def spawn_latency(start_method, env_kwargs, repeats):
+    """
+    :return: Median seconds from Process.start() to the first env.step done by the worker.
+    """
+    ctx = multiprocessing.get_context(start_method)
+    latencies = []
+    for _ in range(repeats):
+        remote, work_remote = ctx.Pipe()
+        start = time.perf_counter()
+        process = ctx.Process(target=_first_step, args=(work_remote, env_kwargs), daemon=True)
+        process.start()
+        remote.recv()
+        latencies.append(time.perf_counter() - start)
+        process.join()
+    return statistics.median(latencies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Import time and worker startup latency')
+    parser.add_argument('--repeats', type=int, default=5, help='Runs per measurement, the median is reported')
+    parser.add_argument('--players', type=int, nargs='+', default=[5])
+    args = parser.parse_args()
+
+    print('Import time (fresh interpreter)')
+    for module in MODULES:
+        try:
+            elapsed, packages = import_time(module, args.repeats)
+        except subprocess.CalledProcessError:
+            print(f'  {module:<20} import failed')
+            continue
+        print(f'  {module:<20} {elapsed * 1000:>8.1f} ms  imports: {packages or "-"}')
+
+    print('Worker spawn to first step')
+    start_methods = [method for method in ('spawn', 'forkserver') if method in multiprocessing.get_all_start_methods()]
+    for num_players in args.players:
+        env_kwargs = dict(num_players=num_players, enable_logs=False)
+        for start_method in start_methods:
+            latency = spawn_latency(start_method, env_kwargs, args.repeats)
+            print(f'  players={num_players:<3} {start_method:<11} {latency * 1000:>8.1f} ms')
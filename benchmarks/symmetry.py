@@ -0,0 +1,30 @@
+"""
+Size of the q-tables and reward of the greedy agent, with and without the canonical seat order (symmetry.py),
+after the same number of (batched) Q-learning updates.
+
+Usage,
+
+$ python -m benchmarks.symmetry
+"""
+import numpy as np
+
+from agent import QTableAgent
+from environment import AvalonEnv
+from evaluation import evaluate
+from vec_q_learning import BatchedQLearning
+
+
+def run(num_players, canonical_seats, num_steps=500, num_eval_episodes=2000, seed=0):
+    env = AvalonEnv(num_players, enable_logs=False, canonical_seats=canonical_seats)
+    agent = QTableAgent(env=env, dense=True)
+    BatchedQLearning(agent, seed=seed).learn(num_steps)
+    rewards, _, _ = evaluate(agent.predict_batch, env.get_config(), num_eval_episodes, seed=seed + 1)
+    return sum(len(q_table) for q_table in agent.q_table.values()), np.mean(rewards)
+
+
+if __name__ == "__main__":
+    print('players  canonical       states   eval reward')
+    for num_players in (5, 6, 7):
+        for canonical_seats in (False, True):
+            states, reward = run(num_players, canonical_seats)
+            print(f'{num_players:>7}  {str(canonical_seats):>9}  {states:>11,}  {reward:>12.3f}')
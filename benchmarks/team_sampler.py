@@ -0,0 +1,49 @@
+"""
+Compares the speed of the TeamSampler with the original team picking (np.random.choice without replacement), for a
+few weight configurations taken from the bot heuristics. That it follows the same distribution is tested in
+tests/test_team_sampler.py.
+
+Usage,
+
+$ python -m benchmarks.team_sampler
+"""
+import timeit
+
+import numpy as np
+
+from game.rng import BufferedRandom
+from game.sampler import get_team_sampler
+
+# (weights, team size) pairs, as made by Player.pick_quest_team
+CASES = [
+    ([500, 100, 100, 100, 100], 2),  # Good leader, fresh game
+    ([400, 100, 400, 100, 100], 3),  # Evil leader
+    ([500, 150, -50, 25, 200, 100, 100], 3),  # Good leader, after a few quests
+    ([100, 400, 100, 400, 100, 400, 100, 100, 100, 100], 5),
+]
+
+
+def original_pick(weights, team_size):
+    weights = [w if w > 0 else 0.1 for w in weights]
+    p = [w / sum(weights) for w in weights]
+    return tuple(np.random.choice(range(len(weights)), team_size, False, p))
+
+
+def run_speed_comparison(number=20000, batch_size=1024):
+    rng = BufferedRandom(0)
+    for weights, team_size in CASES:
+        sampler = get_team_sampler(len(weights))
+        batch_weights = np.tile(np.array(weights, dtype=np.float64), (batch_size, 1))
+        team_sizes = np.full(batch_size, team_size)
+
+        original = number / timeit.timeit(lambda: original_pick(weights, team_size), number=number)
+        single = number / timeit.timeit(lambda: sampler.sample(weights, team_size, rng), number=number)
+        batch = batch_size * (number // 100) / timeit.timeit(
+            lambda: sampler.sample_batch(batch_weights, team_sizes, rng.generator.random(batch_weights.shape)),
+            number=number // 100)
+        print(f'{len(weights)} players, team of {team_size}: original {original:,.0f}/s, '
+              f'single {single:,.0f}/s, batch {batch:,.0f}/s')
+
+
+if __name__ == "__main__":
+    run_speed_comparison()
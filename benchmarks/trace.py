@@ -0,0 +1,31 @@
+"""
+Benchmark for the cost of the event tracing, env steps per second without a trace and with one.
+
+Usage,
+
+$ python -m benchmarks.trace
+"""
+import time
+
+from environment import AvalonEnv
+from game.enums_and_config import game_player_configs
+
+
+def steps_per_second(num_players, trace, num_steps=20000):
+    env = AvalonEnv(num_players, enable_logs=False, trace=trace)
+    env.seed(0)
+    env.reset()
+    actions = [env.action_space.sample() for _ in range(num_steps)]
+    start = time.perf_counter()
+    for action in actions:
+        _, _, done, _ = env.step(action)
+        if done:
+            env.reset()
+    return num_steps / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    print('players        no trace           trace   (steps/sec)')
+    for num_players in game_player_configs:
+        print(f'{num_players:>7}  {steps_per_second(num_players, False):>14,.0f}  '
+              f'{steps_per_second(num_players, True):>14,.0f}')
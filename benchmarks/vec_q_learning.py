@@ -0,0 +1,53 @@
+"""
+Benchmark for the Q-learning updates per second, of the per-step loop of q_learning_trial.train (with both q-table
+backends) and of BatchedQLearning (per number of concurrent games).
+
+Usage,
+
+$ python -m benchmarks.vec_q_learning
+"""
+import time
+
+from agent import QTableAgent
+from environment import AvalonEnv
+from vec_q_learning import BatchedQLearning
+
+
+def serial_updates_per_second(num_players, dense, duration=5.0):
+    env = AvalonEnv(num_players, enable_logs=False)
+    agent = QTableAgent(env=env, dense=dense)
+    steps = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        # Same loop as in q_learning_trial.train
+        obs, info = env.reset(external=False)
+        info['prev_obs'] = None
+        reward = 0
+        done = False
+        while not done:
+            action = agent.get_next_action(obs, reward, info)
+            prev_obs = obs
+            obs, reward, done, info = env.step(action)
+            info['prev_obs'] = prev_obs
+            steps += 1
+    return steps / (time.perf_counter() - start)
+
+
+def batched_updates_per_second(num_players, num_envs, num_updates=500000, seed=0):
+    agent = QTableAgent(env=AvalonEnv(num_players, enable_logs=False), dense=True)
+    trainer = BatchedQLearning(agent, num_envs=num_envs, seed=seed)
+    start = time.perf_counter()
+    trainer.learn(max(num_updates // num_envs, 1))
+    return trainer.num_updates / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    num_players = 5
+    print('trainer                 updates/sec    speedup')
+    baseline = serial_updates_per_second(num_players, dense=False)
+    print(f'{"serial (dict)":<20}  {baseline:>13,.0f}  {1:>8.1f}x')
+    result = serial_updates_per_second(num_players, dense=True)
+    print(f'{"serial (dense)":<20}  {result:>13,.0f}  {result / baseline:>8.1f}x')
+    for num_envs in (64, 256, 1024, 4096):
+        result = batched_updates_per_second(num_players, num_envs)
+        print(f'{"batched, " + str(num_envs) + " envs":<20}  {result:>13,.0f}  {result / baseline:>8.1f}x')
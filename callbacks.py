@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+import tensorflow as tf
+from stable_baselines.common.callbacks import BaseCallback
+from stable_baselines.results_plotter import load_results, ts2xy
+
+from evaluation import evaluate, model_predictor
+
+
+class CustomCallback(BaseCallback):
+    """
+    The callback class. A callback can be configured to execute on different events and
+    at certain timestep intervals while training the agent.
+    """
+    def __init__(self, check_freq, log_dir, num_eval_episodes, env_kwargs, target_reward=None, verbose=1):
+        """
+
+        :param check_freq: The frequency at which this callback should be triggered.
+        :param log_dir: Directory to save the model and other data
+        :param num_eval_episodes: Number of episodes for evaluation.
+        :param env_kwargs: Kwargs of the AvalonEnvs to evaluate on.
+        :param target_reward: If passed, the training stops if the target_reward is reached.
+        :param verbose: If verbose is 1, print internal logs (if any).
+        """
+        super(CustomCallback, self).__init__(verbose)
+        self.check_freq = check_freq
+        self.log_dir = log_dir
+        self.num_eval_episodes = num_eval_episodes
+        self.env_kwargs = env_kwargs
+        self.save_path = os.path.join(log_dir, 'best_model')
+        self.best_mean_reward = -np.inf
+        self.target_reward = target_reward
+
+    def _init_callback(self):
+        """
+        This function is called when the callback class is initialized.
+        """
+        # Create folders if needed
+        if self.save_path is not None:
+            os.makedirs(self.save_path, exist_ok=True)
+
+        if self.log_dir is not None:
+            os.makedirs(self.log_dir, exist_ok=True)
+
+    def plot_scalar_on_tb(self, tag, value):
+        """
+        Helper function to create tensorboard graphs.
+        :param tag: Name of the graph
+        :param value: Value to plot
+        """
+        summary = tf.Summary(value=[tf.Summary.Value(tag='evaluation_metric/' + tag, simple_value=value)])
+        self.locals['writer'].add_summary(summary, self.num_timesteps)
+
+    def _on_step(self):
+        """
+        This function is called after every env.step during training.
+        """
+        # Execute the callback logic based on check_freq
+        if self.n_calls % self.check_freq == 0:
+            # Retrieve historic training reward
+            x, y = ts2xy(load_results(self.log_dir), 'timesteps')
+            if len(x) > 0:
+                # Mean training reward over the last n episodes
+                mean_reward = np.mean(y[-self.num_eval_episodes:])
+                print(f"Number of time steps: {self.num_timesteps}")
+                print(f"Best mean reward so far: {self.best_mean_reward:.2f} - Running mean reward average: {mean_reward:.2f}")
+
+                # Reward after evaluating on a new environment for num_eval_episodes
+                eval_rewards, eval_penalties, eval_agent_results = evaluate(
+                    model_predictor(self.model), self.env_kwargs, self.num_eval_episodes)
+                mean_eval_reward, std_eval_reward = np.mean(eval_rewards), np.std(eval_rewards)
+
+                # Plot these rewards to tensorboard
+                self.plot_scalar_on_tb(tag='mean_evaluation_reward', value=mean_eval_reward)
+                self.plot_scalar_on_tb(tag='std_evaluation_rewards', value=std_eval_reward)
+                self.plot_scalar_on_tb(tag='mean_evaluation_penalties', value=np.mean(eval_penalties))
+                self.plot_scalar_on_tb(tag='std_evaluation_rewards', value=np.std(eval_penalties))
+
+                # Calculate win percentage and plot them.
+                for char_type, game_results in eval_agent_results.items():
+                    total_games = len(game_results)
+                    total_wins = np.sum(game_results)
+                    win_percent = total_wins / total_games * 100
+                    self.plot_scalar_on_tb(tag=f'{char_type.name}_win_percentage', value=win_percent)
+                    print(f'Agent won {win_percent}% games out of {total_games} games while taking {char_type.name} role.')
+
+                # New best model, saving it
+                if mean_reward > self.best_mean_reward:
+                    self.best_mean_reward = mean_reward
+                    # Saving best model
+                    print(f"Saving new best model to {self.save_path}")
+                    self.model.save(self.save_path)
+
+                # Target achieved, quit training by returning False.
+                if self.target_reward and mean_eval_reward > self.target_reward:
+                    print(f"Achieved reward of {mean_eval_reward}, halting training")
+                    print(f"Saving new best model to {self.save_path}")
+                    self.model.save(self.save_path)
+                    return False
+
+        return True
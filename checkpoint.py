@@ -0,0 +1,257 @@
+import json
+import os
+import re
+
+import numpy as np
+
+from game.enums_and_config import CharacterType
+from q_table import DenseQTable
+
+"""
+On disk format of the QTableAgent q-tables.
+
+A checkpoint is a directory with,
+
+- meta.json: the generation of the snapshot, the observation size and the action space nvec.
+- A snapshot of the q-table of every char type (by name) in a CSR like layout, all plain .npy files which
+  QTableCheckpoint memory maps read-only,
+    <NAME>.<generation>.states.npy   sorted observations, as raw bytes (see DenseQTable.state_key)
+    <NAME>.<generation>.offsets.npy  the entries of the state i are offsets[i]:offsets[i + 1] of the next two arrays
+    <NAME>.<generation>.actions.npy  mixed-radix action indices, sorted within a state
+    <NAME>.<generation>.values.npy   float32 q-values
+- delta.<generation>.log: append-only log of the entries changed since the snapshot, as raw entry_dtype records.
+  The latest record of an entry wins.
+
+Writing a snapshot bumps the generation: the files of the new generation are written (and fsynced) next to the
+ones of the current generation, then meta.json is replaced to point at the new generation, and only then the files
+of the older generations are removed. So a crash leaves either the old or the new generation readable as a whole,
+never a checkpoint mixing the files of two generations.
+"""
+
+META_FILE = 'meta.json'
+TABLE_FILES = ('states', 'offsets', 'actions', 'values')
+
+
+def entry_dtype(obs_size):
+    return np.dtype([('char_type', 'i1'), ('state', f'V{obs_size}'), ('action', '<i4'), ('value', '<f4')])
+
+
+def _delta_path(directory, generation):
+    return os.path.join(directory, f'delta.{generation}.log')
+
+
+def _table_path(directory, generation, char_type, name):
+    return os.path.join(directory, f'{char_type.name}.{generation}.{name}.npy')
+
+
+def _file_generation(file_name):
+    """
+    The generation of a snapshot or delta log file of a checkpoint, None for the other files.
+    """
+    match = re.fullmatch(r'(?:[A-Z_]+\.(\d+)\.(?:{})\.npy)|(?:delta\.(\d+)\.log)'.format('|'.join(TABLE_FILES)),
+                         file_name)
+    if match is None:
+        return None
+    return int(match.group(1) or match.group(2))
+
+
+def _write_durably(path, write):
+    """
+    Write the file with write(f) and fsync it, so it's on disk before the files written after it.
+    """
+    with open(path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _read_meta(directory):
+    with open(os.path.join(directory, META_FILE)) as f:
+        return json.load(f)
+
+
+def _table_entries(table, action_nvec):
+    """
+    (state bytes, action index, q-value) of all the entries of a q-table of either backend.
+    """
+    if isinstance(table, DenseQTable):
+        for key, row in table._rows.items():
+            values = table._row_values(row)
+            for action_idx in np.flatnonzero(~np.isnan(values)).tolist():
+                yield key, action_idx, float(values[action_idx])
+    else:
+        for obs, q_vals in table.items():
+            key = DenseQTable.state_key(obs)
+            for action, value in q_vals.items():
+                yield key, int(np.ravel_multi_index(action, action_nvec)), value
+
+
+def _entry_value(table, obs, action):
+    if isinstance(table, DenseQTable):
+        return table.get_value(obs, action)
+    return table[obs][action]
+
+
+def write_snapshot(directory, agent):
+    """
+    Write a full snapshot of the agent's q-tables, starting a new generation of the checkpoint.
+    """
+    os.makedirs(directory, exist_ok=True)
+    action_nvec = [int(n) for n in agent.env.action_space.nvec]
+    obs_size = len(agent.env.observation_space.nvec)
+    generation = _read_meta(directory)['generation'] + 1 if os.path.exists(os.path.join(directory, META_FILE)) else 0
+
+    for char_type in CharacterType:
+        entries = {}
+        if char_type in agent.q_table:
+            for key, action_idx, value in _table_entries(agent.q_table[char_type], action_nvec):
+                entries.setdefault(key, []).append((action_idx, value))
+        states = sorted(entries)
+        offsets = np.zeros(len(states) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(entries[key]) for key in states])
+        actions = np.empty(offsets[-1], dtype=np.int32)
+        values = np.empty(offsets[-1], dtype=np.float32)
+        for idx, key in enumerate(states):
+            state_entries = sorted(entries[key])
+            actions[offsets[idx]:offsets[idx + 1]] = [action_idx for action_idx, _ in state_entries]
+            values[offsets[idx]:offsets[idx + 1]] = [value for _, value in state_entries]
+
+        arrays = {'states': np.array(states, dtype=f'V{obs_size}'), 'offsets': offsets, 'actions': actions,
+                  'values': values}
+        for name in TABLE_FILES:
+            _write_durably(_table_path(directory, generation, char_type, name),
+                           lambda f: np.save(f, arrays[name]))
+    _write_durably(_delta_path(directory, generation), lambda f: None)
+    _fsync_directory(directory)
+
+    # The new generation is complete on disk, point meta.json at it
+    meta = {'generation': generation, 'obs_size': obs_size, 'action_nvec': action_nvec}
+    _write_durably(os.path.join(directory, META_FILE + '.tmp'), lambda f: f.write(json.dumps(meta).encode()))
+    os.replace(os.path.join(directory, META_FILE + '.tmp'), os.path.join(directory, META_FILE))
+    _fsync_directory(directory)
+
+    # Also removes the files left over by a crash after a previous flip
+    for file_name in os.listdir(directory):
+        file_generation = _file_generation(file_name)
+        if file_generation is not None and file_generation != generation:
+            os.remove(os.path.join(directory, file_name))
+
+
+def append_delta(directory, agent, changed_entries):
+    """
+    Append the current values of the changed entries, (char_type, obs, action) triples, to the delta log.
+    """
+    meta = _read_meta(directory)
+    records = np.empty(len(changed_entries), dtype=entry_dtype(meta['obs_size']))
+    for idx, (char_type, obs, action) in enumerate(changed_entries):
+        records[idx] = (char_type.value, DenseQTable.state_key(obs),
+                        np.ravel_multi_index(action, meta['action_nvec']),
+                        _entry_value(agent.q_table[char_type], obs, action))
+    with open(_delta_path(directory, meta['generation']), 'ab') as f:
+        records.tofile(f)
+
+
+class QTableCheckpoint:
+    """
+    Read-only access to a checkpoint, the snapshot is memory mapped and the delta log is read in memory.
+    """
+    def __init__(self, directory, mmap_mode='r'):
+        meta = _read_meta(directory)
+        self.generation = meta['generation']
+        self.obs_size = meta['obs_size']
+        self.action_nvec = tuple(meta['action_nvec'])
+        self.tables = {char_type: {name: np.load(_table_path(directory, self.generation, char_type, name),
+                                                 mmap_mode=mmap_mode)
+                                   for name in TABLE_FILES}
+                       for char_type in CharacterType}
+
+        dtype = entry_dtype(self.obs_size)
+        path = _delta_path(directory, self.generation)
+        # A partially written last record (if the writer crashed) is ignored.
+        records = np.fromfile(path, dtype=dtype, count=os.path.getsize(path) // dtype.itemsize)
+        self.delta = {}
+        for char_type, state, action_idx, value in records.tolist():
+            self.delta[(CharacterType(char_type), state, action_idx)] = value
+
+    def get(self, char_type, obs, action, default=None):
+        """
+        The q-value of the entry, default if it isn't in the checkpoint.
+        """
+        key = DenseQTable.state_key(obs)
+        action_idx = int(np.ravel_multi_index(action, self.action_nvec))
+        if (char_type, key, action_idx) in self.delta:
+            return self.delta[(char_type, key, action_idx)]
+
+        table = self.tables[char_type]
+        state_idx = int(np.searchsorted(table['states'], np.void(key)))
+        if state_idx == len(table['states']) or table['states'][state_idx].tobytes() != key:
+            return default
+        start, stop = table['offsets'][state_idx], table['offsets'][state_idx + 1]
+        position = start + int(np.searchsorted(table['actions'][start:stop], action_idx))
+        if position == stop or table['actions'][position] != action_idx:
+            return default
+        return float(table['values'][position])
+
+    def entries(self, char_type):
+        """
+        All the (state bytes, action index, q-value) entries of the char type, with the delta log applied.
+        """
+        table = self.tables[char_type]
+        entries = {}
+        offsets = table['offsets']
+        actions, values = table['actions'], table['values']
+        for state_idx, state in enumerate(table['states']):
+            key = state.tobytes()
+            for position in range(offsets[state_idx], offsets[state_idx + 1]):
+                entries[(key, int(actions[position]))] = float(values[position])
+        for (delta_char_type, key, action_idx), value in self.delta.items():
+            if delta_char_type is char_type:
+                entries[(key, action_idx)] = value
+        return entries
+
+    def load_into(self, agent):
+        """
+        Rebuild the agent's q-tables (of its backend) from the checkpoint.
+        """
+        agent.q_table = {}
+        for char_type in CharacterType:
+            entries = self.entries(char_type)
+            if not entries:
+                continue
+            q_table = agent.get_q_table(char_type)
+            for (key, action_idx), value in entries.items():
+                action = tuple(int(v) for v in np.unravel_index(action_idx, self.action_nvec))
+                if agent.dense:
+                    q_table.set_value(key, action, value)
+                else:
+                    q_table[tuple(key)][action] = value
+
+
+class QTableCheckpointer:
+    """
+    Periodic checkpoints of a QTableAgent created with track_changes=True. Every checkpoint appends the entries
+    changed since the previous one to the delta log, except for every `snapshot_every`-th one (and the first one)
+    which writes a full snapshot instead.
+    """
+    def __init__(self, directory, agent, snapshot_every=10):
+        assert agent.changed_entries is not None, "The agent has to track the changed entries"
+        self.directory = directory
+        self.agent = agent
+        self.snapshot_every = snapshot_every
+        self.num_checkpoints = 0
+
+    def checkpoint(self):
+        if self.num_checkpoints % self.snapshot_every == 0:
+            write_snapshot(self.directory, self.agent)
+        else:
+            append_delta(self.directory, self.agent, list(self.agent.changed_entries))
+        self.agent.changed_entries.clear()
+        self.num_checkpoints += 1
@@ -1,9 +1,18 @@
+import copy
+import time
+
 import gym
 from gym.spaces import Tuple, Discrete, MultiBinary, MultiDiscrete
 import numpy as np
 
-from game.enums_and_config import ActionType, PlayerVisibility, Team, team_selection_move_map
+from actions import get_action_tables
+from game.enums_and_config import ActionType, PlayerVisibility, Team
 from game.avalon import AvalonGame
+from game.profiling import StepProfiler
+from game.rng import BufferedRandom
+from game.trace import EventTrace
+from observation import ObservationBuilder
+from symmetry import SeatCanonicalizer
 
 """
 Game state space
@@ -38,20 +47,71 @@ Blackjack https://github.com/openai/gym/blob/master/gym/envs/toy_text/blackjack.
 class AvalonEnv(gym.Env):
     metadata = {'render.modes': ['human']}
 
-    def __init__(self, num_players, enable_logs, autoplay=False, enable_penalties=True, majority_rule=True):
+    def __init__(self, num_players, enable_logs, autoplay=False, enable_penalties=True, majority_rule=True,
+                 incremental_obs=False, copy_obs=True, action_mask_in_info=False, fast_forward=False,
+                 trace=False, canonical_seats=False, profile=False, factored_actions=False, bot_policy=None,
+                 learned_seats=()):
         """
         :param num_players: Number of players to set up the game for. Passed as an arg to game initialization.
         :param enable_logs: Pass enable_logs as True to debug and see step by step game state changes.
         :param autoplay: When autoplay is true, all the agent actions are nullified and the game is played automatically as per heuristics
                          present in the Player class.
+        :param incremental_obs: Build the observations into a preallocated buffer which is updated only as much as needed
+                                (see ObservationBuilder). The observations are the same either way.
+        :param copy_obs: Only used with incremental_obs. If False, step and reset return the buffer itself and reuse
+                         the info dict, so both are overwritten by the next step. Copy them if you need to keep them.
+        :param action_mask_in_info: Add the legal_action_mask for the next step to the info as 'action_mask'.
+        :param fast_forward: Play the bot turns between two agent decisions with AvalonGame.fast_forward, which decides
+                             whole approval and voting rounds at once. The game follows the same distribution, but
+                             renders only once per step and doesn't consume the random numbers in the same way.
+        :param trace: Record the game events into an EventTrace, available as `trace`. Read it with trace.lines()
+                      or trace.dump(), it keeps the events of the last few games.
+        :param canonical_seats: Observe the other seats in the canonical order of SeatCanonicalizer (see symmetry.py),
+                                the team selection entry of the actions is then in the same order, and so is
+                                info['prev_action'].
+        :param profile: Time the phases of every step and count the bot moves, feedbacks and random draws per step
+                        (see game.profiling), read the aggregates with stats().
+        :param factored_actions: The team entry of the action is the index of the team among the teams of the current
+                                 quest size, see actions.py. Not supported with canonical_seats.
+        :param bot_policy: BotPolicy of the bots (see game.policy), the HeuristicPolicy by default. Also decides the
+                           agent's moves which are left to the heuristics (autoplay, no-op actions).
+        :param learned_seats: Seats (besides the agent's seat 0) played by learned opponents. The game stops on their
+                              turns as well, and an OpponentPool (see opponents.py) decides their moves in batches
+                              across many envs through begin_step / play_learned_seat / end_step. With a plain step,
+                              their moves are left to the bot_policy.
         """
         super(AvalonEnv, self).__init__()
         self.enable_logs = enable_logs
         self.autoplay = autoplay
         self.enable_penalties = enable_penalties
         self.majority_rule =  majority_rule
+        self.incremental_obs = incremental_obs
+        self.copy_obs = copy_obs
+        self.action_mask_in_info = action_mask_in_info
+        self.fast_forward = fast_forward
+        self.trace = EventTrace() if trace else None
+        self.profiler = StepProfiler() if profile else None
+        self.bot_policy = bot_policy
+        assert all(0 < seat < num_players for seat in learned_seats), "Seat 0 is the agent's"
+        self.learned_seats = tuple(learned_seats)
+        # Learned seat whose move is pending in the current step, see begin_step
+        self.pending_seat = None
+        self._step_action = None
+        self._step_feedback = None
+        self.canonical_seats = canonical_seats
+        self.canonicalizer = SeatCanonicalizer(num_players) if canonical_seats else None
+        # Canonical seat -> seat of the game, for the current observation
+        self._seat_perm = None
+        self.observation_builder = None
+        self._info = {}
 
         self.num_players = num_players
+        assert not (canonical_seats and factored_actions), "canonical_seats maps the unfactored team actions only"
+        self.factored_actions = factored_actions
+        self.action_tables = get_action_tables(num_players, factored_actions)
+        # All the randomness of the game comes from here, see seed.
+        self.rng = BufferedRandom()
+        self.game = None
         self._initialize_game(num_players, enable_logs)
 
 
@@ -76,7 +136,7 @@ class AvalonEnv(gym.Env):
         """
 
         # Use MultiDiscrete action and observation spaces instead
-        self.action_space = MultiDiscrete([len(team_selection_move_map[self.num_players]), 3, 3])
+        self.action_space = MultiDiscrete(self.action_tables.nvec)
         
         # Player visibilites, action type, current quest, proposal number, current leader
         obs_space = [len(PlayerVisibility)] * self.num_players
@@ -87,10 +147,21 @@ class AvalonEnv(gym.Env):
         )
 
     def _initialize_game(self, num_players, enable_logs):
-        self.game = AvalonGame(num_players, enable_logs=enable_logs, majority_rule=self.majority_rule)
+        if self.game is None:
+            self.game = AvalonGame(num_players, enable_logs=enable_logs, majority_rule=self.majority_rule, rng=self.rng,
+                                   trace=self.trace, profiler=self.profiler, policy=self.bot_policy,
+                                   external_seats=(0,) + self.learned_seats)
+        else:
+            # Reuse the game objects, only the (compact) game state needs to be reset.
+            self.game.reset()
         self.player_types = tuple(p.char_type.value for p in self.game.players)
         self.agent = list(filter(lambda x: x.player_id == 0, self.game.players))[0]  # Agent is the player with ID 0
-        # Useful for computing the reward for winning / losing a quest
+        if self.incremental_obs:
+            if self.observation_builder is None or self.observation_builder.game is not self.game:
+                self.observation_builder = ObservationBuilder(self.game, self.agent)
+            self.observation_builder.reset()
+        self.pending_seat = None
+        # Winners of the finished quests, useful for computing the reward for winning / losing a quest
         self.quests_history = []
         self.quest_reward_count = 0
 
@@ -99,15 +170,17 @@ class AvalonEnv(gym.Env):
         The method that creates the observation and info object for the environment.
         It uses feedback received from the game to do so.
         """
+        if self.incremental_obs:
+            return self._build_observation_incrementally(feedback, prev_action, penalties)
+
         visibilities = []
 
         for player in self.game.players:
             # Is the player in current team?
             in_team = player in feedback.current_team
-            total_missions = len(player.mission_history)
             # How many passed and failed missions is the player part of?
-            passed_missions = sum(player.mission_history)
-            failed_missions = total_missions - passed_missions
+            passed_missions = player.missions_passed
+            failed_missions = player.missions_failed
             if self.agent.team is Team.EVIL:
                 # Evil agent has full visibility about the player's team
                 visibilities.append(PlayerVisibility[(player.team, in_team, passed_missions, failed_missions)])
@@ -149,9 +222,33 @@ class AvalonEnv(gym.Env):
             'agent_team': self.agent.team,
             'num_penalties': penalties
         }
+        if self.action_mask_in_info:
+            info['action_mask'] = self.legal_action_mask()
 
         return obs, info
 
+    def _build_observation_incrementally(self, feedback, prev_action, penalties):
+        """
+        Same as _convert_game_feedback_to_observation, but using the preallocated buffers.
+        """
+        obs = self.observation_builder.update(feedback)
+        info = self._info
+        if self.copy_obs:
+            obs = obs.copy()
+            info = {}
+
+        info['next_action'] = feedback.action_type
+        info['char_type'] = self.agent.char_type
+        info['prev_action'] = prev_action
+        info['num_players'] = self.game.num_players
+        info['quest_team_size'] = feedback.quest_team_size
+        info['game_winner'] = feedback.game_winner
+        info['agent_team'] = self.agent.team
+        info['num_penalties'] = penalties
+        if self.action_mask_in_info:
+            info['action_mask'] = self.legal_action_mask()
+        return obs, info
+
     def step(self, action):
         """
         Executes an action in the game, and returns the reward and next observation.
@@ -160,15 +257,116 @@ class AvalonEnv(gym.Env):
         """
         # Disabling because tuple values aren't supported by contains in MultiBinary spcaes.
         # assert self.action_space.contains(action)
+        if self.profiler is not None:
+            return self._profiled_step(action)
+        self._play_bot_seats(self.begin_step(action))
+        return self.end_step()
+
+    def begin_step(self, action):
+        """
+        First part of step, plays the agent's action and the bot moves up to the next decision of the agent or of a
+        learned seat. Then the pending learned seats are played with play_learned_seat, one at a time, and the step
+        is completed with end_step, which returns what step returns.
+
+        :return: The learned seat whose move is pending, None if it's the agent's turn or the game is over.
+        """
+        return self._play_bots(self._play_agent(action))
+
+    def play_learned_seat(self, choice):
+        """
+        Plays the move of the pending learned seat, and the bot moves up to the next decision.
+
+        :param choice: Value of the move for the game (see ActionTables.decode), the team as player ids or the
+                       approval / vote. Like for the agent, None (and a rejection or a fail, see
+                       Quest.make_team_approval_move) leaves the move to the bot_policy.
+        :return: The next pending learned seat, see begin_step.
+        """
+        game = self.game
+        return self._play_bots(game.run(game.players[self.pending_seat], override_choice=choice))
+
+    def end_step(self):
+        """
+        Last part of step, once all the learned seats were played.
+        """
+        return self._step_observation(*self._step_reward())
+
+    """
+    Phases of a step, timed separately by _profiled_step.
+    """
+    def _play_agent(self, action):
         action_type = self.game.current_quest.current_action_type
-        agent_action_feedback = self._take_action(action, action_type)
-        feedback = self._get_agent_feedback(agent_action_feedback)
-        reward, penalties = self.compute_reward(feedback, action, action_type)
+        env_action = action
+        if self.canonicalizer is not None:
+            env_action = self.canonicalizer.to_env_actions([action], self._seat_perm[None])[0]
+        self._step_action = (action, env_action, action_type)
+        return self._take_action(env_action, action_type)
+
+    def _play_bots(self, feedback):
+        """
+        Plays the bot moves from the feedback on, and returns the learned seat whose move is pending, if any.
+        """
+        feedback = self._get_agent_feedback(feedback)
+        self._step_feedback = feedback
+        self.pending_seat = None
+        if self.learned_seats and feedback.action_required:
+            player = self.game.current_player
+            if player is not self.agent:
+                self.pending_seat = player.player_id
+        return self.pending_seat
+
+    def _play_bot_seats(self, seat):
+        """
+        Without an OpponentPool, the learned seats are played by the bot policy.
+        """
+        while seat is not None:
+            seat = self.play_learned_seat(None)
+
+    def _step_reward(self):
+        assert self.pending_seat is None, "The move of a learned seat is pending"
+        _, env_action, action_type = self._step_action
+        return self.compute_reward(self._step_feedback, env_action, action_type)
+
+    def _step_observation(self, reward, penalties):
+        action = self._step_action[0]
+        feedback = self._step_feedback
         obs, info = self._convert_game_feedback_to_observation(feedback, action, penalties)
+        obs = self._canonicalize(obs)
         done = feedback.game_winner is not None
 
         return obs, reward, done, info
 
+    def _profiled_step(self, action):
+        """
+        Same as step, recording the time spent in every phase and the counts into the profiler.
+        """
+        profiler, clock = self.profiler, time.perf_counter_ns
+        feedbacks, draws = profiler.feedbacks, self.rng.drawn
+
+        start = clock()
+        action_type = self.game.current_quest.current_action_type
+        feedback = self._play_agent(action)
+        action_taken = clock()
+        moves = profiler.moves
+        self._play_bot_seats(self._play_bots(feedback))
+        bots_played = clock()
+        bot_moves = profiler.moves - moves
+        reward, penalties = self._step_reward()
+        rewarded = clock()
+        result = self._step_observation(reward, penalties)
+        observed = clock()
+
+        profiler.record_step(action_type, (action_taken - start, bots_played - action_taken, rewarded - bots_played,
+                                           observed - rewarded),
+                             bot_moves, profiler.feedbacks - feedbacks, self.rng.drawn - draws)
+        return result
+
+    def stats(self):
+        """
+        Aggregates of the profiled steps (see StepProfiler.stats), the env has to be created with profile=True.
+        """
+        assert self.profiler is not None, "Create the env with profile=True"
+        return self.profiler.stats()
+
     def compute_reward(self, feedback, action, action_type):
         """
         Compute reward for the action taken.
@@ -186,8 +384,8 @@ class AvalonEnv(gym.Env):
 
         # Reward for winning / losing the quests
         if self.quest_reward_count < len(self.quests_history):
-            last_quest = self.quests_history[-1]
-            if last_quest.quest_winner == self.agent.team:
+            last_quest_winner = self.quests_history[-1]
+            if last_quest_winner == self.agent.team:
                 reward += 1
             else:
                 reward -= 1
@@ -220,15 +418,69 @@ class AvalonEnv(gym.Env):
 
         return reward, num_penalties
 
+    def seed(self, seed=None):
+        """
+        Seed the random stream of the environment. Every environment has its own stream, so the
+        runs are reproducible for a given seed no matter how the environments are run in parallel.
+        """
+        self.rng.seed(seed)
+        self.action_space.seed(seed)
+        return [seed]
+
     def reset(self, external=True):
+        start = time.perf_counter_ns() if self.profiler is not None else 0
         # Reset all the stuff
         self._initialize_game(self.num_players, self.enable_logs)
         feedback = self._get_agent_feedback()
         obs, info = self._convert_game_feedback_to_observation(feedback, None, 0)
+        obs = self._canonicalize(obs)
+        if self.profiler is not None:
+            self.profiler.record_reset(time.perf_counter_ns() - start)
         if external:
             return obs
         return obs, info
 
+    def get_config(self):
+        """
+        Kwargs (besides enable_logs) to create a new env playing the same kind of games, with the same observations
+        and actions. The options which change neither aren't included, nor are the learned_seats (played by the bot
+        policy unless the env is stepped by an OpponentPool). The bot_policy is included if one was passed, so the
+        envs created from the config (evaluation, replay, the worker processes) play against the same bots. It's then
+        an object, which has to be picklable for the worker processes.
+        """
+        config = dict(num_players=self.num_players, autoplay=self.autoplay, enable_penalties=self.enable_penalties,
+                      majority_rule=self.majority_rule, fast_forward=self.fast_forward,
+                      canonical_seats=self.canonical_seats, factored_actions=self.factored_actions)
+        if self.bot_policy is not None:
+            config['bot_policy'] = self.bot_policy
+        return config
+
+    def _canonicalize(self, obs):
+        if self.canonicalizer is None:
+            return obs
+        canonical, perms = self.canonicalizer.canonicalize(np.asarray(obs)[None])
+        self._seat_perm = perms[0]
+        return canonical[0]
+
+    def clone(self):
+        """
+        A copy of the environment (at the current step) that can be played independently,
+        useful for search and rollout based planning. Only the compact game state is copied.
+        """
+        env = copy.copy(self)
+        env.game = self.game.clone()
+        env.rng = env.game.rng
+        # The copy doesn't record into the trace (or the profiler) of this environment
+        env.trace = env.game.trace
+        env.profiler = None
+        env.agent = env.game.players[self.agent.player_id]
+        env.quests_history = list(self.quests_history)
+        env._info = {}
+        if self.incremental_obs:
+            env.observation_builder = ObservationBuilder(env.game, env.agent)
+            env.observation_builder.reset()
+        return env
+
     def render(self, mode='human'):
         if self.enable_logs:
             print(self.game)
@@ -238,43 +490,54 @@ class AvalonEnv(gym.Env):
         Runs the game until there's an event relevant for the agent, and then
         returns the feedback.
         """
+        if self.fast_forward:
+            return self._fast_forward_to_agent_feedback(prev_feedback)
+
         feedback = prev_feedback if prev_feedback is not None else self.game.run()
         while not(feedback.action_required or feedback.game_winner):
             self.render()
             if feedback.initiate_new_quest:
                 assert feedback.quest_winner
-                self.quests_history.append(self.game.current_quest)
+                self.quests_history.append(feedback.quest_winner)
                 self.game.initialize_new_quest()
             feedback = self.game.run()
         return feedback
 
+    def _fast_forward_to_agent_feedback(self, prev_feedback=None):
+        """
+        Same as _get_agent_feedback, but all the bot moves are made in a single AvalonGame.fast_forward call.
+        """
+        game = self.game
+        if prev_feedback is not None:
+            if prev_feedback.action_required or prev_feedback.game_winner:
+                return prev_feedback
+            if prev_feedback.initiate_new_quest:
+                assert prev_feedback.quest_winner
+                self.quests_history.append(prev_feedback.quest_winner)
+                game.initialize_new_quest()
+
+        feedback = game.fast_forward()
+        # A quest concluded by the bots (which doesn't end the game) is there in the scores only.
+        if not feedback.game_winner and len(self.quests_history) < game.good_team_wins + game.evil_team_wins:
+            self.quests_history.append(game.last_quest_winner)
+        self.render()
+        return feedback
+
     def _get_relevant_value_for_action(self, action, action_type):
         """
         A method that translates the action conforming to self.action_space
         to a corresponding value that can be passed to the game.
+        See ActionTables for the precompiled decoding tables.
         """
-        action_value_map = {
-            ActionType.TEAM_SELECTION: team_selection_move_map[self.num_players],  # The vector value should
-            ActionType.TEAM_APPROVAL: {
-                0: None,
-                1: True,
-                2: False
-            },
-            ActionType.QUEST_VOTE: {
-                0: None,
-                1: True,
-                2: False
-            }
-        }
-
-        relevant_action = action_value_map[action_type][action[action_type.value]]
+        return self.action_tables.decode(action, action_type, self.game.current_quest.team_size)
 
-        if action_type is ActionType.TEAM_SELECTION:
-            # relevant_action = (action[action_type.value].nonzero())[0]
-            if len(relevant_action) != self.game.current_quest.team_size:
-                relevant_action = None
-
-        return relevant_action
+    def legal_action_mask(self):
+        """
+        Boolean mask of the actions that won't be penalized in the current step, concatenated per entry
+        of the action (like self.action_space.nvec). Read-only.
+        """
+        quest = self.game.current_quest
+        return self.action_tables.legal_action_mask(quest.current_action_type, quest.team_size)
 
     def _take_action(self, action, action_type):
         """
@@ -0,0 +1,108 @@
+from collections import defaultdict
+from multiprocessing import Pool
+
+import numpy as np
+
+from environment import AvalonEnv
+
+"""
+Batched evaluation of agents and models.
+
+evaluate plays `num_episodes` episodes over `num_envs` AvalonEnvs at the same time. On every step the observations
+of all the active games are stacked, and the actions for all of them come from a single predict_batch call.
+The episodes can also be split over a process pool.
+
+predict_batch is a function (observations, infos) -> actions, where observations is a (batch, obs size) array and
+infos the list of the last infos of the games (None at the start of an episode, like in the serial loops).
+QTableAgent.predict_batch and model_predictor(model) for the stable-baselines models are such functions.
+"""
+
+
+def model_predictor(model, deterministic=True):
+    """
+    predict_batch for a (non recurrent) stable-baselines model, which predicts batches of observations natively.
+    """
+    def predict_batch(observations, infos):
+        actions, _ = model.predict(observations, deterministic=deterministic)
+        return actions
+    return predict_batch
+
+
+def _evaluate(predict_batch, env_kwargs, num_episodes, num_envs, seed, env_class):
+    env_kwargs = dict(env_kwargs, enable_logs=False)
+    envs = [env_class(**env_kwargs) for _ in range(min(num_envs, num_episodes))]
+    if seed is not None:
+        for idx, env in enumerate(envs):
+            env.seed(seed + idx)
+
+    rewards, penalties = [], []
+    agent_game_results = defaultdict(list)
+
+    observations = np.array([env.reset() for env in envs])
+    infos = [None] * len(envs)
+    episode_rewards = np.zeros(len(envs))
+    episode_penalties = np.zeros(len(envs), dtype=np.int64)
+    started = len(envs)
+    active = list(range(len(envs)))
+
+    while active:
+        actions = predict_batch(observations[active], [infos[idx] for idx in active])
+        still_active = []
+        for idx, action in zip(active, actions):
+            obs, reward, done, info = envs[idx].step(action)
+            episode_rewards[idx] += reward
+            episode_penalties[idx] += info['num_penalties']
+            infos[idx] = info
+
+            if done:  # game over
+                agent_game_results[info['char_type']].append(info['game_winner'] == info['agent_team'])
+                rewards.append(episode_rewards[idx])
+                penalties.append(episode_penalties[idx])
+                episode_rewards[idx] = episode_penalties[idx] = 0
+                if started == num_episodes:
+                    continue
+                started += 1
+                obs = envs[idx].reset()
+                infos[idx] = None
+            observations[idx] = obs
+            still_active.append(idx)
+        active = still_active
+
+    return rewards, penalties, agent_game_results
+
+
+def _evaluate_chunk(args):
+    return _evaluate(*args)
+
+
+def evaluate(predict_batch, env_kwargs, num_episodes, num_envs=32, processes=1, seed=None, env_class=AvalonEnv):
+    """
+    Evaluate the agent (or model) by running `num_episodes` episodes on new environment instances.
+
+    :param predict_batch: Function (observations, infos) -> actions, see the module docs.
+    :param env_kwargs: Kwargs of the envs, see AvalonEnv.get_config. The logs are always disabled.
+    :param num_episodes: Number of episodes to play.
+    :param num_envs: Number of games played at the same time (per process).
+    :param processes: Number of processes to split the episodes over, predict_batch needs to be picklable for more
+                      than one (a bound method of an agent is, a model_predictor isn't).
+    :param seed: If passed, the env i (of the process p) is seeded with seed + p * num_envs + i.
+    :return: Rewards and penalties of every episode, and the results (win or not) of the agent per char_type.
+    """
+    if processes == 1:
+        return _evaluate(predict_batch, env_kwargs, num_episodes, num_envs, seed, env_class)
+
+    splits = np.diff(np.linspace(0, num_episodes, processes + 1).astype(int))
+    chunks = [(predict_batch, env_kwargs, int(episodes), num_envs,
+               None if seed is None else seed + process * num_envs, env_class)
+              for process, episodes in enumerate(splits) if episodes > 0]
+    with Pool(len(chunks)) as pool:
+        results = pool.map(_evaluate_chunk, chunks)
+
+    rewards, penalties = [], []
+    agent_game_results = defaultdict(list)
+    for chunk_rewards, chunk_penalties, chunk_results in results:
+        rewards += chunk_rewards
+        penalties += chunk_penalties
+        for char_type, game_results in chunk_results.items():
+            agent_game_results[char_type] += game_results
+    return rewards, penalties, agent_game_results
@@ -2,11 +2,17 @@
 This is the module that pieces together various components of the game (Quests, Players)
 and serves as an interface to take actions in the game.
 """
-import random
+from collections import namedtuple
+
+import numpy as np
 
 from game.enums_and_config import ActionType, CharacterType, Team, MAX_QUESTS, game_player_configs
 from game.player import Player
 from game.quest import Quest
+from game.rng import BufferedRandom
+from game.trace import EventTrace, EventType
+from game.state import GameState, StateField, CURRENT_PLAYER, GOOD_WINS, EVIL_WINS, WINNER, LAST_QUEST_WINNER, \
+    NO_PLAYER
 
 
 class GameFeedback:
@@ -16,6 +22,9 @@ class GameFeedback:
 
     It's a plain object with no functions.
     """
+    __slots__ = ('action_type', 'action_required', 'game_winner', 'quest_winner', 'quest_number', 'quest_team_size',
+                 'proposal_number', 'leader', 'evil_wins', 'initiate_new_quest', 'current_team')
+
     def __init__(self, game, action_required=False, initiate_new_quest=False):
         quest = game.current_quest
         self.action_type = quest.current_action_type
@@ -28,6 +37,8 @@ class GameFeedback:
         self.leader = quest.current_leader
         self.evil_wins = game.evil_team_wins
         self.initiate_new_quest = initiate_new_quest
+        if game.profiler is not None:
+            game.profiler.feedbacks += 1
 
         # self.current_team = [0] * game.num_players
         # for player in quest.current_team:
@@ -36,18 +47,58 @@ class GameFeedback:
         self.current_team = quest.current_team
 
 
+# A copy of the game state and the state of the random number generator, see AvalonGame.snapshot.
+GameSnapshot = namedtuple('GameSnapshot', ['state', 'rng_state'])
+
+
 class AvalonGame:
     """
     The main game class.
+
+    The whole state of the game is kept in a compact GameState, the players and
+    the current quest are views over it.
     """
-    def __init__(self, num_players, max_quests=MAX_QUESTS, max_proposals_allowed=5, enable_logs=True, majority_rule=True):
+    good_team_wins = StateField(GOOD_WINS)
+    evil_team_wins = StateField(EVIL_WINS)
+    winner = StateField(WINNER, Team)
+    last_quest_winner = StateField(LAST_QUEST_WINNER, Team)
+
+    def __init__(self, num_players, max_quests=MAX_QUESTS, max_proposals_allowed=5, enable_logs=True, majority_rule=True,
+                 snapshot=None, rng=None, trace=None, profiler=None, policy=None, external_seats=(0,)):
         """
         Setting up logic for the game goes here. Number of players are configurable.
+
+        :param enable_logs: Print the game events as they happen. Unless a trace is passed, it records them into
+                            a new EventTrace which echoes them.
+
+        :param snapshot: If passed, the game starts from the snapshot instead of a new game.
+        :param rng: BufferedRandom to draw all the random numbers of the game from. A new unseeded one is
+                    created if not passed.
+        :param trace: EventTrace to record the game events into (see game.trace). Nothing is recorded if it's None
+                      and enable_logs is False.
+        :param profiler: StepProfiler to count the moves and the feedbacks into (see game.profiling).
+        :param policy: BotPolicy deciding the bot moves (see game.policy), HeuristicPolicy by default.
+        :param external_seats: Seats whose moves are decided outside of the game, run stops with action_required on
+                               their turns. The agent's seat 0 by default, learned opponents add theirs (see
+                               opponents.py).
         """
+        self.rng = rng if rng is not None else BufferedRandom()
         self.enable_logs = enable_logs
+        if trace is None and enable_logs:
+            trace = EventTrace(echo=True)
+        self.trace = trace
+        self.profiler = profiler
         self.majority_rule = majority_rule
         self.num_players = num_players
-        self.players = self.initialize_players()
+        self.external_seats = tuple(external_seats)
+
+        self.state = GameState(num_players)
+        self._data = self.state.data
+        self._scalars = self.state.layout.scalars
+        self.players = [Player(player_id, self.state, self.rng, external=player_id in self.external_seats)
+                        for player_id in range(num_players)]
+        self.current_quest = Quest(self.state, self.players, trace=trace, majority_rule=majority_rule, policy=policy)
+        self.policy = self.current_quest.policy
 
         self.max_quests = max_quests
         self.max_proposals_allowed = max_proposals_allowed
@@ -55,32 +106,76 @@ class AvalonGame:
         self.win_target = max_quests // 2 + 1
         self.quest_sizes = game_player_configs[num_players].quest_size
 
-        self.current_quest = None
-        self.current_player = None
-        self.initialize_new_quest()
+        if snapshot is None:
+            self.reset()
+        else:
+            self.restore(snapshot, restore_rng=False)
 
+    def reset(self):
+        """
+        Start a new game, reusing the state and the players.
+        """
+        self.initialize_players()
+        self.current_quest.initialize(quest_num=0, team_size=self.quest_sizes[0], leader=0)
+        self.current_player = self.players[0]
         self.good_team_wins = 0
         self.evil_team_wins = 0
-
         self.winner = None
+        self.last_quest_winner = None
+
+        if self.trace is not None:
+            self.trace.record(EventType.GAME_START, 0, 0, value=self.num_players)
+            for player in self.players:
+                self.trace.record(EventType.ROLE, 0, 0, player.player_id, player.char_type.value)
+
+    def snapshot(self, include_rng=True):
+        """
+        Cheap copy of the game, meant for search agents that need to branch the game.
+        Only the compact state array (and optionally the RNG state) is copied.
+        """
+        rng_state = self.rng.get_state() if include_rng else None
+        return GameSnapshot(self._data[:], rng_state)
+
+    def restore(self, snapshot, restore_rng=True):
+        """
+        Bring the game back to the snapshot. The players and the quest views stay valid.
+        """
+        self._data[:] = snapshot.state
+        self.current_quest.clear_decisions()
+        if restore_rng and snapshot.rng_state is not None:
+            self.rng.set_state(snapshot.rng_state)
+
+    def clone(self, rng=None):
+        """
+        An independent copy of the game, starting from the current state.
+
+        :param rng: BufferedRandom for the copy. By default the copy continues from the same random stream.
+        """
+        if rng is None:
+            rng = BufferedRandom(block_size=self.rng.block_size)
+            rng.set_state(self.rng.get_state())
+        return AvalonGame(self.num_players, max_quests=self.max_quests, max_proposals_allowed=self.max_proposals_allowed,
+                          enable_logs=self.enable_logs, majority_rule=self.majority_rule,
+                          snapshot=self.snapshot(include_rng=False), rng=rng, policy=self.policy,
+                          external_seats=self.external_seats)
+
+    @property
+    def current_player(self):
+        player_id = self._data[self._scalars + CURRENT_PLAYER]
+        return None if player_id == NO_PLAYER else self.players[player_id]
+
+    @current_player.setter
+    def current_player(self, player):
+        self._data[self._scalars + CURRENT_PLAYER] = NO_PLAYER if player is None else player.player_id
 
     def initialize_new_quest(self):
         """
         This function should be called before starting any new quest in the game.
         """
-        quest_num = 0
-        leader = 0
-        if self.current_quest is not None:
-            quest_num = self.current_quest.id + 1
-            leader = self.current_quest.current_leader
-
-        self.current_quest = Quest(quest_num=quest_num,
-                                   team_size=self.quest_sizes[quest_num],
-                                   players=self.players,
-                                   leader=leader,
-                                   enable_logs=self.enable_logs,
-                                   majority_rule=self.majority_rule)
-        self.current_player = self.current_quest.current_leader
+        quest = self.current_quest
+        quest_num = quest.id + 1
+        quest.initialize(quest_num=quest_num, team_size=self.quest_sizes[quest_num], leader=quest.current_leader)
+        self.current_player = self.players[quest.current_leader]
 
     def __str__(self):
         """
@@ -95,29 +190,30 @@ class AvalonGame:
 
     def initialize_players(self):
         """
-        Assigns player types based on the number of players and game_player_configs.
+        Assigns player types based on the number of players and game_player_configs,
+        and clears the mission histories.
         """
         # Random sampling for random assignment of character types
-        player_order = random.sample(range(self.num_players), self.num_players)
+        player_order = self.rng.uniforms(self.num_players).argsort().argsort()
         good_count, evil_count = game_player_configs[self.num_players].team_split
 
         assert good_count + evil_count == self.num_players
 
-        players = []
+        layout = self.state.layout
         for player_id, order in enumerate(player_order):
             if order + 1 <= good_count:
-                player = Player(player_id, CharacterType.SERVANT)
+                char_type = CharacterType.SERVANT
             else:
-                player = Player(player_id, CharacterType.MINION)
-            players.append(player)
-
-        return players
+                char_type = CharacterType.MINION
+            self._data[layout.roles + player_id] = char_type.value
+            self._data[layout.passed + player_id] = 0
+            self._data[layout.failed + player_id] = 0
 
     def run(self, agent_player=None, override_choice=None):
         """
         The driving logic of the game.
 
-        The game step runs on its own unless the current player is an agent.
+        The game step runs on its own unless the current player is an agent (one of the external_seats).
         In that case the run method will return a feedback indicating a desired action,
         and the next step is to call the run method again by passing `agent_player` and
         `override_choice` arguments.
@@ -135,16 +231,23 @@ class AvalonGame:
         if quest.current_action_type == ActionType.TEAM_SELECTION:
             if quest.current_proposal_number - 1 == self.max_proposals_allowed:
                 self.winner = Team.EVIL
+                self._record_game_end()
             else:
                 quest.make_team_selection_move(self.current_player, override_choice=override_choice)
+                if self.profiler is not None:
+                    self.profiler.moves += 1
             return GameFeedback(self)
 
         elif quest.current_action_type == ActionType.TEAM_APPROVAL:
             quest.make_team_approval_move(self.current_player, override_choice=override_choice)
+            if self.profiler is not None:
+                self.profiler.moves += 1
             return GameFeedback(self)
 
         elif quest.current_action_type == ActionType.QUEST_VOTE:
             winner = quest.make_quest_vote_move(self.current_player, override_choice=override_choice)
+            if self.profiler is not None:
+                self.profiler.moves += 1
             if winner:
                 self.update_scores(winner)
                 # self.initialize_new_quest()
@@ -154,10 +257,64 @@ class AvalonGame:
 
         raise Exception(f"Game entered in some unknown path for action type {quest.current_action_type}")
 
+    def fast_forward(self):
+        """
+        Plays the bot moves until it's the agent's turn (or a learned seat's, see external_seats) or the game is over,
+        and returns a single feedback.
+
+        Unlike calling run in a loop, the pending bot moves of a team approval or quest voting round (up to the
+        agent's turn) are decided with a single vectorized draw, no feedback is created for them, and the new
+        quests are initialized right here. The events are still traced (and logged) for every move.
+        """
+        quest = self.current_quest
+        while self.winner is None:
+            if quest.current_action_type == ActionType.TEAM_SELECTION:
+                # A single move by the leader
+                feedback = self.run()
+                if feedback.action_required:
+                    return feedback
+                continue
+
+            bots, agent_next = quest.pending_bot_turns()
+            if bots:
+                if self.profiler is not None:
+                    self.profiler.moves += len(bots)
+                probabilities = quest.round_probabilities()
+                responses = self._decide([probabilities[player.player_id] for player in bots])
+                if quest.current_action_type == ActionType.TEAM_APPROVAL:
+                    quest.make_team_approval_moves(bots, responses)
+                else:
+                    winner = quest.make_quest_vote_moves(bots, responses)
+                    if winner:
+                        self.update_scores(winner)
+                        if self.winner is None:
+                            self.initialize_new_quest()
+                        continue
+
+            if agent_next:
+                self.current_player = quest.get_next_player()
+                return GameFeedback(self, action_required=True)
+
+        return GameFeedback(self)
+
+    def _decide(self, probabilities):
+        """
+        Bernoulli draws for all the probabilities at once.
+        """
+        return (self.rng.uniforms(len(probabilities)) < np.array(probabilities)).tolist()
+
     def update_scores(self, winner):
+        self.last_quest_winner = winner
         self.good_team_wins += winner == Team.GOOD
         self.evil_team_wins += winner == Team.EVIL
         if self.good_team_wins == self.win_target:
             self.winner = Team.GOOD
         elif self.evil_team_wins == self.win_target:
             self.winner = Team.EVIL
+        if self.winner is not None:
+            self._record_game_end()
+
+    def _record_game_end(self):
+        if self.trace is not None:
+            quest = self.current_quest
+            self.trace.record(EventType.GAME_END, quest.id, quest.current_proposal_number, value=self.winner.value)
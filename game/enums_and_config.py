@@ -1,5 +1,6 @@
 from collections import namedtuple
 from enum import Enum
+from functools import lru_cache
 from itertools import product, combinations
 
 
@@ -43,13 +44,24 @@ class Team(Enum):
     UNKNOWN = 3
 
 
-PlayerVisibility = {}
 win_target = MAX_QUESTS // 2 + 2
 
-# Which, Part of current team or not, Failed , Passed mission
-combos = product(list(Team), [True, False], range(win_target), range(win_target))
-for idx, combo in enumerate(combos):
-    PlayerVisibility[combo] = idx
+
+@lru_cache(maxsize=None)
+def get_player_visibility():
+    """
+    (team, part of the current team or not, passed missions, failed missions) -> visibility index.
+    Built on first use, the game itself doesn't need it.
+    """
+    combos = product(list(Team), [True, False], range(win_target), range(win_target))
+    return {combo: idx for idx, combo in enumerate(combos)}
+
+
+def __getattr__(name):
+    # PlayerVisibility is only generated when it's first imported
+    if name == 'PlayerVisibility':
+        return get_player_visibility()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def generate_combinations(n, c):
@@ -77,8 +89,16 @@ def generate_team_selection_combinations(n_players, config):
             all_combos += generate_combinations(n_players, size)
     return all_combos
 
-team_selection_move_map = {}
+class _TeamSelectionMoveMap(dict):
+    """
+    The list of the teams of a player count is only generated when it's first accessed. The game and the environments
+    don't need them, the teams are encoded arithmetically (see game.teams).
+    """
+    def __missing__(self, n_players):
+        if n_players not in game_player_configs:
+            raise KeyError(n_players)
+        self[n_players] = generate_team_selection_combinations(n_players, game_player_configs[n_players])
+        return self[n_players]
+
 
-# Pre-load the team_selection_maps for all the game configurations available.
-for n_players, config in game_player_configs.items():
-    team_selection_move_map[n_players] = generate_team_selection_combinations(n_players, config)
+team_selection_move_map = _TeamSelectionMoveMap()
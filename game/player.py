@@ -1,169 +1,118 @@
-import numpy as np
-
 from game.enums_and_config import CharacterType, Team
+from game.sampler import get_team_sampler
 
-"""
-Good player strategies,
-
-Source: https://www.quora.com/What-are-some-rookie-mistakes-in-the-Avalon-game
 
-Rookie mistakes
-- Good players overuse approval vote: if you are good and don't have a special role, probabilistically speaking only up to 2 out of the 7 proposals 
-  (including your own) you hear around the table do not have any bad guys sneaked in. f generic good players are too happy to approve proposed missions, 
-  then they'll send too many bad teams on quests and lose the game by default.
-"""
+CHAR_TYPES = {c.value: c for c in CharacterType}
+CHAR_TYPE_TEAMS = {CharacterType.SERVANT.value: Team.GOOD, CharacterType.MINION.value: Team.EVIL}
 
 
 class Player:
-    def __init__(self, player_id, char_type):
+    """
+    A view over the player related part of the GameState.
+    The moves are decided by the bot policy of the game (see game.policy), with the random numbers drawn from `rng`,
+    the BufferedRandom of the game.
+    """
+    __slots__ = ('player_id', '_data', '_role', '_passed', '_failed', '_rng', '_external')
+
+    def __init__(self, player_id, state, rng, external=False):
         self.player_id = player_id
-        self.char_type = char_type
-        if char_type == CharacterType.MINION:
-            self.team = Team.EVIL
-        else:
-            self.team = Team.GOOD
+        self._rng = rng
+        self._external = external
+        self._data = state.data
+        layout = state.layout
+        self._role = layout.roles + player_id
+        self._passed = layout.passed + player_id
+        self._failed = layout.failed + player_id
+
+    @property
+    def char_type(self):
+        return CHAR_TYPES[self._data[self._role]]
+
+    @property
+    def team(self):
+        return CHAR_TYPE_TEAMS[self._data[self._role]]
+
+    @property
+    def missions_passed(self):
+        """
+        Number of passed missions the player was a part of.
+        """
+        return self._data[self._passed]
+
+    @property
+    def missions_failed(self):
+        """
+        Number of failed missions the player was a part of.
+        """
+        return self._data[self._failed]
 
-        self.mission_history = []
+    def record_mission(self, success):
+        if success:
+            self._data[self._passed] += 1
+        else:
+            self._data[self._failed] += 1
 
     def __str__(self):
-        return f'Player {self.player_id} ({self.char_type} {self.mission_history})'
+        return f'Player {self.player_id} ({self.char_type} passed {self.missions_passed} failed {self.missions_failed})'
 
     # Action
     def approve_or_reject_quest_team(self, quest):
         """
-        Heuristics based function to decide whether the player should approve
-        or reject the team.
-
-        Some heuristics incorporated are,
-
-        Good orientation player,
-        - More likely to reject a person who has been a part of a failed quest before.
-        - More likely to approve is the team involves himself (as he knows he has good orientation)
-
-        Bad orientation player,
-        - More likely to approve if the team involves a team-mate who is known to be evil.
-        - More likely to approve if the team involves himself (as he know he has bad orientation and can sabotage)
-        - More likely to reject if the team consists of just the good players.
+        Decide whether the player approves or rejects the current team, with the probability given by the bot policy
+        of the game (see game.policy).
 
-        :return: True or False depending on the decision taken based on the heuristics.
+        :return: True or False depending on the decision taken by the policy.
         """
-        good_self_approve_bias = 0.9
-        good_approve_bias = 0.8
-        suspicion_factor = 0.2
-        evil_approve_bias = 0.9
-
-        majority_size = (quest.team_size + 1) // 2
-
-        if self.team is Team.EVIL:
-            evils_in_team = 0
-            for player in quest.current_team:
-                if player.team is Team.EVIL:
-                    evils_in_team += 1
-
-            if (evils_in_team >= majority_size) or (evils_in_team and not quest.majority_rule):
-                # If evils know they're in majority, they'll approve
-                # with some bluff factor.
-                p = evil_approve_bias
-            else:
-                # Else they'll reject with some bluff factor
-                p = (1 - evil_approve_bias)
-
-        if self.team is Team.GOOD:
-            if self in quest.current_team:
-                p = good_self_approve_bias
-            else:
-                p = good_approve_bias
-
-            for player in quest.current_team:
-                # If the  player is know to be a part of failed mission
-                # decrease the likelihood of team approval.
-                if False in player.mission_history:
-                    p -= suspicion_factor
-
-            # Add lower bound
-            p = max([suspicion_factor, p])
-
-        return self.decide_with_probability(p)
-
-    def success_or_fail(self):
-        """
-        Heuristics based function to decide whether the player should pass or fail the quest.
-
-        Some heuristics used are,
-
-        For Good orientation,
-        - Always pass the mission
+        return self.decide_with_probability(quest.round_probabilities()[self.player_id])
 
-        For Bad orientation
-        - More likely to fail the mission.
-
-        :return:  True or False depending on the decision taken based on the heuristics.
+    def success_or_fail(self, quest):
         """
-        p = 1.0
-        evil_mission_fail_prob = 0.9
-        if self.team is Team.EVIL:
-           p = 1 - evil_mission_fail_prob
+        Decide whether the player passes or fails the quest, with the probability given by the bot policy of the game.
 
-        return self.decide_with_probability(p)
+        :return: True or False depending on the decision taken by the policy.
+        """
+        return self.decide_with_probability(quest.round_probabilities()[self.player_id])
 
     def pick_quest_team(self, quest):
         """
-        Heuristics based function to decide whether the player should pass or fail the quest.
-
-        Some heuristics used are
+        Pick the team, weighting the players with the weights given by the bot policy of the game.
 
-        For Good orientation,
-        - More likely to pick itself or those who have been part of a successful mission already.
-
-        For Bad orientation
-        - More likely to pick itself any of its team members.
-
-        :return:  True or False depending on the decision taken based on the heuristics.
+        :return: The picked player ids.
         """
-        options = range(quest.num_players)
-        weights = [100] * quest.num_players
-
-        if self.team is Team.EVIL:
-            for pid, player in enumerate(quest.quest_players):
-                if player.team is Team.EVIL:
-                    weights[pid] += 300  # More weight to evil players
-
-        if self.team is Team.GOOD:
-            for pid, player in enumerate(quest.quest_players):
-                # The good player doesn't know who is good and evil, so use history
-                for mission_success in player.mission_history:
-                    if mission_success:
-                        weights[pid] += 50
-                    else:
-                        weights[pid] -= 75
-
-            weights[self.player_id] = 500
-
-        player_ids = self.weighted_exclusive_choice(options, quest.team_size, weights)
+        player_ids, _ = get_team_sampler(quest.num_players).sample(quest.team_weights(self), quest.team_size,
+                                                                   self._rng)
         return player_ids
 
-    @staticmethod
-    def weighted_exclusive_choice(options, num_picks, weights):
+    def weighted_exclusive_choice(self, options, num_picks, weights):
         """
         Make exclusive num_choices based on the weights provided.
+        Every pick is made proportional to the weights of the options not picked yet.
+
+        This is the reference implementation, the heuristics use the faster TeamSampler, which
+        follows the same distribution.
         """
+        options = list(options)
         weights = [w if w > 0 else 0.1 for w in weights]
-        weights_sum = sum(weights)
-        if weights_sum != 1.0:
-            # Normalize the weights
-            weights = [w / weights_sum for w in weights]
-        return np.random.choice(options, num_picks, False, weights)
-
-    @staticmethod
-    def decide_with_probability(p):
+        picks = []
+        for _ in range(num_picks):
+            target = self._rng.uniform() * sum(weights)
+            idx = 0
+            while idx < len(weights) - 1 and target >= weights[idx]:
+                target -= weights[idx]
+                idx += 1
+            picks.append(options.pop(idx))
+            weights.pop(idx)
+        return picks
+
+    def decide_with_probability(self, p):
         """
         Bernoulli's distribution
         """
-        return np.random.binomial(1, p) == 1
+        return self._rng.bernoulli(p)
 
     def is_agent(self):
-        # For now, player with ID 0 is the agent.
-        return self.player_id == 0
+        # The moves of the agent (seat 0) and of the learned seats are decided outside of the game.
+        return self._external
 
     @staticmethod
     def players_string(players_list):
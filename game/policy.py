@@ -0,0 +1,232 @@
+"""
+Bot policies.
+
+A BotPolicy decides the moves of the bots, for all the players of a round and for a batch of games at once, from
+array inputs (one row per game):
+
+- evil: (batch, num_players) bool, the true roles. The evil players know each other, a good player only knows
+  itself, so the decisions of a good seat should only depend on its own column.
+- passed, failed: (batch, num_players) number of passed / failed missions every player was a part of.
+- team_masks: (batch,) bit masks of the players in the current team, team_sizes: (batch,) size of the team.
+- leaders: (batch,) seat picking the team.
+
+The policies only return probabilities and weights, the random numbers are drawn by the games (AvalonGame draws from
+its BufferedRandom, AvalonVecEnv from its Generator), so a policy holds no random state and can be shared by any
+number of games.
+
+The batch methods are what AvalonVecEnv uses, with all its games at once. AvalonGame plays a single game, for which
+NumPy calls cost more than they save, so it uses the game_* methods instead, with plain lists (one per round of
+approvals or votes, see Quest.round_probabilities, and one per team selection). By default they make a batch of the
+one game, a policy can override them with a faster pure Python version, like HeuristicPolicy does.
+"""
+import numpy as np
+
+
+def team_members(team_masks, num_players):
+    """
+    (batch, num_players) bool, whether every player is in the team.
+    """
+    return (np.asarray(team_masks, dtype=np.int64)[:, None] & (1 << np.arange(num_players))) != 0
+
+
+def _team_mask(team):
+    return sum(1 << pid for pid in team)
+
+
+class BotPolicy:
+    """
+    Interface of the bot policies, see the module docs for the inputs.
+    """
+    def approval_probabilities(self, evil, passed, failed, team_masks, team_sizes, majority_rule):
+        """
+        :param majority_rule: Whether the quest fails only if half or more of the team fails it, or on a single fail.
+        :return: (batch, num_players) probability of every seat to approve the team.
+        """
+        raise NotImplementedError
+
+    def pass_probabilities(self, evil, passed, failed, team_masks, team_sizes):
+        """
+        :return: (batch, num_players) probability of every seat to pass the quest, if it's in the team.
+        """
+        raise NotImplementedError
+
+    def team_weights(self, evil, passed, failed, leaders):
+        """
+        :return: (batch, num_players) weights of the players for the leader's pick. The team is drawn one player at a
+                 time proportional to the weights of the players not picked yet (see game.sampler), non positive
+                 weights are replaced by MIN_WEIGHT.
+        """
+        raise NotImplementedError
+
+    """
+    Single game versions, with lists of the players instead of (1, num_players) arrays, and the team as the list of
+    its player ids.
+    """
+    def game_approval_probabilities(self, evil, passed, failed, team, team_size, majority_rule):
+        return self.approval_probabilities(np.array([evil]), np.array([passed]), np.array([failed]),
+                                           np.array([_team_mask(team)]), np.array([team_size]), majority_rule)[0].tolist()
+
+    def game_pass_probabilities(self, evil, passed, failed, team, team_size):
+        return self.pass_probabilities(np.array([evil]), np.array([passed]), np.array([failed]),
+                                       np.array([_team_mask(team)]), np.array([team_size]))[0].tolist()
+
+    def game_team_weights(self, evil, passed, failed, leader):
+        return self.team_weights(np.array([evil]), np.array([passed]), np.array([failed]), np.array([leader]))[0].tolist()
+
+
+class HeuristicPolicy(BotPolicy):
+    """
+    The default bots.
+
+    Team approval,
+    - Good players are more likely to approve a team they're a part of (as they know they're good), and less
+      likely to approve a team with players who were a part of failed quests before.
+    - Evil players approve (with some bluff) the teams with enough evil players to fail the quest, and reject
+      the other ones.
+
+    Quest voting,
+    - Good players always pass the quest, evil ones are likely to fail it.
+
+    Team selection,
+    - Good leaders pick themselves, and are more likely to pick the players who were a part of passed quests and
+      less likely those of failed ones.
+    - Evil leaders are more likely to pick the evil players (themselves included).
+
+    Good player strategies,
+
+    Source: https://www.quora.com/What-are-some-rookie-mistakes-in-the-Avalon-game
+
+    Rookie mistakes
+    - Good players overuse approval vote: if you are good and don't have a special role, probabilistically speaking
+      only up to 2 out of the 7 proposals (including your own) you hear around the table do not have any bad guys
+      sneaked in. If generic good players are too happy to approve proposed missions, then they'll send too many bad
+      teams on quests and lose the game by default.
+
+    Every parameter is either a single value or a sequence of one value per seat, for bots with different styles
+    at the same table.
+    """
+    def __init__(self, good_self_approve_bias=0.9, good_approve_bias=0.8, suspicion_factor=0.2, evil_approve_bias=0.9,
+                 evil_mission_fail_prob=0.9, base_weight=100, evil_ally_weight=300, passed_weight=50, failed_weight=75,
+                 self_weight=500):
+        """
+        :param good_self_approve_bias: Approval probability of a good player for a team it's a part of.
+        :param good_approve_bias: Approval probability of a good player for a team it isn't a part of.
+        :param suspicion_factor: Decrease of the approval probability of a good player for every team member who was
+                                 a part of a failed quest. It's also the lowest approval probability.
+        :param evil_approve_bias: Approval probability of an evil player for a team which can fail the quest, the
+                                  other teams are approved with 1 - evil_approve_bias.
+        :param evil_mission_fail_prob: Probability of an evil player to fail the quest.
+        :param base_weight: Weight of every player for the team selection.
+        :param evil_ally_weight: Added to the weights of the evil players by an evil leader.
+        :param passed_weight: Added to the weights by a good leader, per passed quest of the player.
+        :param failed_weight: Taken off the weights by a good leader, per failed quest of the player.
+        :param self_weight: Weight of a good leader for itself.
+        """
+        self.good_self_approve_bias = self._param(good_self_approve_bias)
+        self.good_approve_bias = self._param(good_approve_bias)
+        self.suspicion_factor = self._param(suspicion_factor)
+        self.evil_approve_bias = self._param(evil_approve_bias)
+        self.evil_mission_fail_prob = self._param(evil_mission_fail_prob)
+        self.base_weight = self._param(base_weight)
+        self.evil_ally_weight = self._param(evil_ally_weight)
+        self.passed_weight = self._param(passed_weight)
+        self.failed_weight = self._param(failed_weight)
+        self.self_weight = self._param(self_weight)
+
+    @staticmethod
+    def _param(value):
+        """
+        Scalars as floats (which also keeps the int8 counts of the games from overflowing), per seat values as arrays.
+        """
+        if np.ndim(value) == 0:
+            return float(value)
+        return np.asarray(value, dtype=np.float64)
+
+    @staticmethod
+    def _of_leaders(value, leaders):
+        """
+        The parameter of the leaders, as a column to broadcast over the players.
+        """
+        if np.ndim(value) == 0:
+            return value
+        return value[leaders][:, None]
+
+    def approval_probabilities(self, evil, passed, failed, team_masks, team_sizes, majority_rule):
+        in_team = team_members(team_masks, evil.shape[1])
+
+        evils_in_team = (in_team & evil).sum(axis=1)
+        majority_size = (np.asarray(team_sizes) + 1) // 2
+        evil_favoured = evils_in_team >= majority_size
+        if not majority_rule:
+            evil_favoured |= evils_in_team > 0
+        evil_p = np.where(evil_favoured[:, None], self.evil_approve_bias, 1 - self.evil_approve_bias)
+
+        suspicious = (in_team & (failed > 0)).sum(axis=1)
+        good_p = np.where(in_team, self.good_self_approve_bias, self.good_approve_bias)
+        good_p = np.maximum(good_p - self.suspicion_factor * suspicious[:, None], self.suspicion_factor)
+
+        return np.where(evil, evil_p, good_p)
+
+    def pass_probabilities(self, evil, passed, failed, team_masks, team_sizes):
+        return np.where(evil, 1 - self.evil_mission_fail_prob, 1.0)
+
+    def team_weights(self, evil, passed, failed, leaders):
+        leaders = np.asarray(leaders, dtype=np.int64)
+        rows = np.arange(len(leaders))
+        evil_leader = evil[rows, leaders]
+
+        # An evil leader knows the evil players
+        evil_weights = self._of_leaders(self.base_weight, leaders) + \
+            self._of_leaders(self.evil_ally_weight, leaders) * evil
+        # A good leader only knows the quest histories, and itself
+        good_weights = self._of_leaders(self.base_weight, leaders) + \
+            self._of_leaders(self.passed_weight, leaders) * passed - self._of_leaders(self.failed_weight, leaders) * failed
+        good_weights[rows, leaders] = np.broadcast_to(self.self_weight, evil.shape[1])[leaders]
+
+        return np.where(evil_leader[:, None], evil_weights, good_weights)
+
+    @staticmethod
+    def _of_seat(value, seat):
+        return value if isinstance(value, float) else value[seat]
+
+    def game_approval_probabilities(self, evil, passed, failed, team, team_size, majority_rule):
+        evils_in_team = 0
+        suspicious = 0
+        for pid in team:
+            evils_in_team += evil[pid]
+            suspicious += failed[pid] > 0
+        evil_favoured = evils_in_team >= (team_size + 1) // 2 or (evils_in_team and not majority_rule)
+
+        probabilities = []
+        for seat, seat_evil in enumerate(evil):
+            if seat_evil:
+                bias = self._of_seat(self.evil_approve_bias, seat)
+                p = bias if evil_favoured else 1 - bias
+            else:
+                if seat in team:
+                    p = self._of_seat(self.good_self_approve_bias, seat)
+                else:
+                    p = self._of_seat(self.good_approve_bias, seat)
+                suspicion_factor = self._of_seat(self.suspicion_factor, seat)
+                for _ in range(suspicious):
+                    p -= suspicion_factor
+                p = max(suspicion_factor, p)
+            probabilities.append(p)
+        return probabilities
+
+    def game_pass_probabilities(self, evil, passed, failed, team, team_size):
+        return [1 - self._of_seat(self.evil_mission_fail_prob, seat) if seat_evil else 1.0
+                for seat, seat_evil in enumerate(evil)]
+
+    def game_team_weights(self, evil, passed, failed, leader):
+        base_weight = self._of_seat(self.base_weight, leader)
+        if evil[leader]:
+            evil_ally_weight = self._of_seat(self.evil_ally_weight, leader)
+            return [base_weight + evil_ally_weight if player_evil else base_weight for player_evil in evil]
+
+        passed_weight = self._of_seat(self.passed_weight, leader)
+        failed_weight = self._of_seat(self.failed_weight, leader)
+        weights = [base_weight + passed_weight * player_passed - failed_weight * player_failed
+                   for player_passed, player_failed in zip(passed, failed)]
+        weights[leader] = self._of_seat(self.self_weight, leader)
+        return weights
@@ -0,0 +1,90 @@
+"""
+Per-phase profiling of the environment steps.
+
+An AvalonEnv created with profile=True times the phases of every step (see PHASES) with the monotonic
+nanosecond clock, per ActionType of the agent's move, and counts the bot moves, the GameFeedback objects and the
+random numbers drawn per agent step. AvalonGame counts the moves and the feedbacks into the same StepProfiler.
+Everything is accumulated into plain integer counters, the aggregates are computed only by stats().
+When profiling is disabled neither the env nor the game holds a profiler, so the only cost is a
+`profiler is not None` check per step, move and feedback.
+"""
+from game.enums_and_config import ActionType
+
+# Phases of AvalonEnv.step
+TAKE_ACTION = 0  # The agent's move, AvalonEnv._take_action
+BOT_MOVES = 1  # The bot moves until the agent's next decision, AvalonEnv._get_agent_feedback
+REWARD = 2  # AvalonEnv.compute_reward
+OBSERVATION = 3  # Observation and info, AvalonEnv._convert_game_feedback_to_observation
+PHASES = ('take_action', 'bot_moves', 'reward', 'observation')
+
+# Counters per action type
+STEPS = 0
+MOVES = 1
+FEEDBACKS = 2
+RNG_DRAWS = 3
+COUNTERS = ('steps', 'bot_moves', 'feedbacks', 'rng_draws')
+
+_ACTION_TYPES = list(ActionType)
+
+
+class StepProfiler:
+    """
+    Timers and counters of the steps, indexed by the value of the ActionType of the agent's move.
+    """
+    def __init__(self):
+        # Updated by the game
+        self.moves = 0
+        self.feedbacks = 0
+        self.clear()
+
+    def clear(self):
+        self.times = [[0] * len(PHASES) for _ in _ACTION_TYPES]
+        self.counts = [[0] * len(COUNTERS) for _ in _ACTION_TYPES]
+        self.resets = 0
+        self.reset_time = 0
+
+    def record_step(self, action_type, times, bot_moves, feedbacks, rng_draws):
+        """
+        :param times: Nanoseconds spent in every phase of the step.
+        """
+        phase_times = self.times[action_type.value]
+        for phase, elapsed in enumerate(times):
+            phase_times[phase] += elapsed
+        counts = self.counts[action_type.value]
+        counts[STEPS] += 1
+        counts[MOVES] += bot_moves
+        counts[FEEDBACKS] += feedbacks
+        counts[RNG_DRAWS] += rng_draws
+
+    def record_reset(self, elapsed):
+        self.resets += 1
+        self.reset_time += elapsed
+
+    @staticmethod
+    def _aggregate(times, counts):
+        steps = counts[STEPS]
+        total = sum(times)
+        result = {'steps': steps, 'total_s': total / 1e9, 'mean_step_us': total / steps / 1e3 if steps else 0.0}
+        for phase, elapsed in zip(PHASES, times):
+            result[phase] = {
+                'total_s': elapsed / 1e9,
+                'mean_us': elapsed / steps / 1e3 if steps else 0.0,
+                'share': elapsed / total if total else 0.0,
+            }
+        for name, count in zip(COUNTERS[1:], counts[1:]):
+            result[f'{name}_per_step'] = count / steps if steps else 0.0
+        return result
+
+    def stats(self):
+        """
+        Aggregates over all the steps, and per action type (by name) of the agent's move.
+        """
+        times = [sum(phase) for phase in zip(*self.times)]
+        counts = [sum(counter) for counter in zip(*self.counts)]
+        result = self._aggregate(times, counts)
+        result['resets'] = self.resets
+        result['mean_reset_us'] = self.reset_time / self.resets / 1e3 if self.resets else 0.0
+        result['by_action_type'] = {action_type.name: self._aggregate(self.times[action_type.value],
+                                                                      self.counts[action_type.value])
+                                    for action_type in _ACTION_TYPES}
+        return result
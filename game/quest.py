@@ -1,31 +1,79 @@
-from game.enums_and_config import ActionType, Team
+from game.enums_and_config import ActionType, CharacterType, Team
 from game.player import  Player
+from game.policy import HeuristicPolicy
+from game.state import StateField, QUEST, TEAM_SIZE, LEADER, PROPOSAL, ACTION_TYPE, TURN_CURSOR, APPROVALS, \
+    MISSION_FAILS, QUEST_WINNER, NO_PLAYER
+from game.trace import EventType
 
 import numpy as np
 
+MINION = CharacterType.MINION.value
+
 
 class Quest:
-    def __init__(self, quest_num, team_size, players, leader, enable_logs, majority_rule=True):
-        self.enable_logs = enable_logs
-        self.id = quest_num
-        self.team_size = team_size
+    """
+    A view over the quest related part of the GameState. A single Quest instance is reused
+    for all the quests of a game, see initialize.
+    """
+    id = StateField(QUEST)
+    team_size = StateField(TEAM_SIZE)
+    current_leader = StateField(LEADER)
+    current_proposal_number = StateField(PROPOSAL)
+    quest_team_approvals = StateField(APPROVALS)
+    mission_fails = StateField(MISSION_FAILS)
+    current_action_type = StateField(ACTION_TYPE, ActionType)
+    quest_winner = StateField(QUEST_WINNER, Team)
+    # Info for keeping track of whose turn is next.
+    turn_cursor = StateField(TURN_CURSOR)
+
+    def __init__(self, state, players, trace=None, majority_rule=True, policy=None):
+        """
+        :param trace: EventTrace to record the moves into, None to not record anything.
+        :param policy: BotPolicy deciding the moves of the players (see game.policy), HeuristicPolicy by default.
+        """
+        self.trace = trace
+        self.state = state
+        self._data = state.data
+        self._scalars = state.layout.scalars
         self.quest_players = players
         self.num_players = len(players)
+        self.majority_rule = majority_rule
+        self.policy = policy if policy is not None else HeuristicPolicy()
+
+        layout = state.layout
+        self._roles = slice(layout.roles, layout.roles + self.num_players)
+        self._passed = slice(layout.passed, layout.passed + self.num_players)
+        self._failed = slice(layout.failed, layout.failed + self.num_players)
+        # Decisions of the current round, see round_probabilities
+        self._probabilities = None
+
+    def initialize(self, quest_num, team_size, leader):
+        """
+        Set up the state for a new quest.
+        """
+        self.id = quest_num
+        self.team_size = team_size
         self.current_leader = leader
         self.current_proposal_number = 0
-        self.current_team = []
         self.quest_team_approvals = 0
         self.mission_fails = 0
+        self.quest_winner = None
+        self.initialize_team_selection_round()
 
-        self.majority_rule = majority_rule
+    @property
+    def current_team(self):
+        return [self.quest_players[pid] for pid in self.state.team_ids()]
 
-        # Info for keeping track of whose turn is next.
-        self.current_action_type = ActionType.TEAM_SELECTION
-        self.pending_turns = {
-            ActionType.TEAM_SELECTION: self.generate_team_selection_turns()
-        }
+    @current_team.setter
+    def current_team(self, players):
+        self.state.set_team([player.player_id for player in players])
 
-        self.quest_winner = None
+    @property
+    def pending_turns(self):
+        """
+        Players yet to take their turn in the current round.
+        """
+        return {self.current_action_type: self._round_turns()[self.turn_cursor:]}
 
     def __str__(self):
         quest_string = f"""
@@ -52,7 +100,70 @@ class Quest:
         return quest_string + player_turns_info
 
     def get_next_player(self):
-        return self.pending_turns[self.current_action_type].pop(0)
+        cursor = self.turn_cursor
+        self.turn_cursor = cursor + 1
+        action_type = self.current_action_type
+        if action_type == ActionType.TEAM_SELECTION:
+            # Starts from current leader, turns go in the circular fashion.
+            return self.quest_players[(self.current_leader + cursor) % self.num_players]
+        elif action_type == ActionType.TEAM_APPROVAL:
+            return self.quest_players[cursor]
+        return self.quest_players[self.state.team_ids()[cursor]]
+
+    def _round_turns(self):
+        """
+        All the turns of the current round, in order.
+        """
+        action_type = self.current_action_type
+        if action_type == ActionType.TEAM_SELECTION:
+            return [self.quest_players[(self.current_leader + i) % self.num_players] for i in
+                    range(self.num_players)]
+        elif action_type == ActionType.TEAM_APPROVAL:
+            return self.quest_players[::]
+        return self.current_team
+
+    def pending_bot_turns(self):
+        """
+        Pending turns of the current round up to the next turn of the agent, and whether the
+        agent's turn comes right after them.
+        """
+        bots = []
+        for player in self._round_turns()[self.turn_cursor:]:
+            if player.is_agent():
+                return bots, True
+            bots.append(player)
+        return bots, False
+
+    def round_probabilities(self):
+        """
+        Probability of every player to approve the team in a team approval round, or to pass the quest in a quest
+        voting round. The policy decides for all the players of the round at once, on the first move of the round.
+        """
+        if self._probabilities is None:
+            data = self._data
+            evil = [role == MINION for role in data[self._roles]]
+            team = self.state.team_ids()
+            if self.current_action_type == ActionType.TEAM_APPROVAL:
+                self._probabilities = self.policy.game_approval_probabilities(
+                    evil, data[self._passed], data[self._failed], team, self.team_size, self.majority_rule)
+            else:
+                self._probabilities = self.policy.game_pass_probabilities(
+                    evil, data[self._passed], data[self._failed], team, self.team_size)
+        return self._probabilities
+
+    def team_weights(self, leader):
+        """
+        Weights of the players for the team picked by the leader, decided by the policy.
+        """
+        data = self._data
+        return self.policy.game_team_weights([role == MINION for role in data[self._roles]], data[self._passed],
+                                             data[self._failed], leader.player_id)
+
+    def clear_decisions(self):
+        """
+        Should be called when the state is changed from the outside (e.g. restored), the policy decides again.
+        """
+        self._probabilities = None
 
     """
     Following are initialization functions for different rounds.
@@ -61,10 +172,9 @@ class Quest:
         """
         Method to initialize team selection round.
         """
-        self.current_team = []
+        self.state.clear_team()
         self.current_action_type = ActionType.TEAM_SELECTION
-        self.pending_turns = dict()
-        self.pending_turns[ActionType.TEAM_SELECTION] = self.generate_team_selection_turns()
+        self.turn_cursor = 0
 
     def initialize_team_approval_round(self):
         """
@@ -72,23 +182,16 @@ class Quest:
         """
         self.quest_team_approvals = 0
         self.current_action_type = ActionType.TEAM_APPROVAL
-        self.pending_turns = dict()
-        self.pending_turns[ActionType.TEAM_APPROVAL] = self.quest_players[::]
+        self.turn_cursor = 0
+        self._probabilities = None
 
     def initialize_quest_vote_round(self):
         """
         Method to initialize quest voting round.
         """
         self.current_action_type = ActionType.QUEST_VOTE
-        self.pending_turns = dict()
-        self.pending_turns[ActionType.QUEST_VOTE] = self.current_team[:]
-
-    def generate_team_selection_turns(self):
-        """
-        Starts from current leader, and generate turns in the circular fashion.
-        """
-        return [self.quest_players[(self.current_leader + i) % self.num_players] for i in
-                range(len(self.quest_players))]
+        self.turn_cursor = 0
+        self._probabilities = None
 
     """
     Following are the move methods for every round. Any move related logic should be added here 
@@ -104,12 +207,13 @@ class Quest:
         else:
             player_ids = player.pick_quest_team(self)
 
-        self.current_team = [self.quest_players[pid] for pid in player_ids]
-
-        if self.enable_logs: print(f"{player} picked the team {Player.players_string(self.current_team)}")
+        self.state.set_team(player_ids)
 
         self.current_leader = (self.current_leader + 1) % self.num_players
         self.current_proposal_number += 1
+
+        if self.trace is not None:
+            self._record(EventType.TEAM_PROPOSED, player.player_id, sum(1 << pid for pid in player_ids))
         self.initialize_team_approval_round()
 
     def make_team_approval_move(self, player, override_choice=None):
@@ -121,9 +225,23 @@ class Quest:
             response = player.approve_or_reject_quest_team(self)
         self.quest_team_approvals += response
 
-        if self.enable_logs: print(f'{player} {"Approved" if response else "Rejected"} the team')
+        if self.trace is not None: self._record(EventType.TEAM_VOTE, player.player_id, response)
+
+        if self.turn_cursor == self.num_players:
+            self.conclude_team_approval_results()
+
+    def make_team_approval_moves(self, players, responses):
+        """
+        Team approval moves of several players at once (in turn order), with the responses already decided.
+        """
+        self.turn_cursor += len(players)
+        self.quest_team_approvals += sum(responses)
+
+        if self.trace is not None:
+            for player, response in zip(players, responses):
+                self._record(EventType.TEAM_VOTE, player.player_id, response)
 
-        if not self.pending_turns[ActionType.TEAM_APPROVAL]:
+        if self.turn_cursor == self.num_players:
             self.conclude_team_approval_results()
 
     def conclude_team_approval_results(self):
@@ -131,11 +249,10 @@ class Quest:
         Helper method to decide if the proposed team is approved or not.
         """
         approved = 2 * self.quest_team_approvals > self.num_players
+        if self.trace is not None: self._record(EventType.TEAM_RESULT, value=approved)
         if approved:
-            if self.enable_logs: print("Current team is approved!")
             self.initialize_quest_vote_round()
         else:
-            if self.enable_logs: print("Team approval failed")
             self.initialize_team_selection_round()
 
     def make_quest_vote_move(self, player, override_choice=None):
@@ -144,9 +261,9 @@ class Quest:
         """
         response = override_choice
         if not response:
-            response = player.success_or_fail()
+            response = player.success_or_fail(self)
 
-        if self.enable_logs: print(f'{player} {"Passed" if response else "Failed"} the quest')
+        if self.trace is not None: self._record(EventType.QUEST_VOTE, player.player_id, response)
 
         self.mission_fails += response==False
 
@@ -155,29 +272,55 @@ class Quest:
 
         if response is False and self.majority_rule is False:
             # Mission failed
-            if self.enable_logs: print(f'Mission Failed due to {player}')
-            return self.conclude_quest(False)
+            return self.conclude_quest(False, saboteur=player)
 
-        if not self.pending_turns[ActionType.QUEST_VOTE]:
-            # if self.enable_logs: print(f'Mission Succeeded!')
+        if self.turn_cursor == self.team_size:
             if self.majority_rule:
                 return self.conclude_quest_majority()
             else:
                 return self.conclude_quest(True)
 
 
+    def make_quest_vote_moves(self, players, responses):
+        """
+        Quest voting moves of several players at once (in turn order), with the responses already decided.
+        Returns the quest winner if the quest is over.
+        """
+        sabotaged = not self.majority_rule and False in responses
+        if sabotaged:
+            # A single fail concludes the quest, the players after it don't get to vote.
+            voted = responses.index(False) + 1
+            players, responses = players[:voted], responses[:voted]
+
+        self.turn_cursor += len(players)
+        self.mission_fails += responses.count(False)
+
+        if self.trace is not None:
+            for player, response in zip(players, responses):
+                self._record(EventType.QUEST_VOTE, player.player_id, response)
+
+        if sabotaged:
+            return self.conclude_quest(False, saboteur=players[-1])
+
+        if self.turn_cursor == self.team_size:
+            if self.majority_rule:
+                return self.conclude_quest_majority()
+            else:
+                return self.conclude_quest(True)
+
     """
     Previous version method of concluding quest where a single 
     fail was enough to sabotage the mission.
     """
-    def conclude_quest(self, success):
+    def conclude_quest(self, success, saboteur=None):
         if success:
-            if self.enable_logs: print("Good team won the quest!")
             self.quest_winner = Team.GOOD
         else:
-            if self.enable_logs: print("Evil team won the quest!")
             self.quest_winner = Team.EVIL
 
+        if self.trace is not None:
+            self._record(EventType.QUEST_RESULT, NO_PLAYER if saboteur is None else saboteur.player_id,
+                         self.quest_winner.value)
         self.mission_fails = 0
         self._update_player_histories()
         return self.quest_winner
@@ -186,19 +329,22 @@ class Quest:
         # If half or more team members fail mission, then only it's a fail
         success = 2 * self.mission_fails < self.team_size
         if success:
-            if self.enable_logs: print("Good team won the quest!")
             self.quest_winner = Team.GOOD
         else:
-            if self.enable_logs: print("Evil team won the quest!")
             self.quest_winner = Team.EVIL
 
+        if self.trace is not None: self._record(EventType.QUEST_RESULT, value=self.quest_winner.value)
         self.mission_fails = 0
         self._update_player_histories()
         return self.quest_winner
 
+    def _record(self, event_type, player=NO_PLAYER, value=0):
+        self.trace.record(event_type, self.id, self.current_proposal_number, player, value)
+
     def _update_player_histories(self):
         """
         To keep track of the history of passed or failed mission for a player.
         """
+        success = self.quest_winner is Team.GOOD
         for player in self.current_team:
-            player.mission_history.append(self.quest_winner is Team.GOOD)
+            player.record_mission(success)
@@ -0,0 +1,89 @@
+"""
+Random number generation for the game.
+
+Every game (and every environment) owns a BufferedRandom, so parallel workers never share or
+duplicate random state, and a run is reproducible from its seed alone.
+"""
+import numpy as np
+
+
+class BufferedRandom:
+    """
+    Wrapper over np.random.Generator, which draws uniforms in blocks and serves them one by one.
+    Drawing a scalar out of NumPy is slow, while the bot heuristics need lots of single decisions.
+
+    The block is kept as a list of Python floats, which are faster to serve than the items of an array, but take
+    32 bytes each. Every game has its own BufferedRandom, so the block is kept short: a block of 128 is ~4KB per
+    game, and the stream is the same whatever the block size.
+    """
+    __slots__ = ('generator', 'block_size', '_buffer', '_pos', '_served')
+
+    def __init__(self, seed=None, block_size=128):
+        self.block_size = block_size
+        self.generator = None
+        self._buffer = []
+        self._pos = 0
+        # Uniforms served out of the previous buffers, see drawn
+        self._served = 0
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """
+        Re-seed in place, so that every object holding a reference to this one sees the new stream.
+        """
+        self.generator = np.random.default_rng(seed)
+        self._served += self._pos
+        self._buffer = []
+        self._pos = 0
+
+    def _refill(self):
+        # A fresh list every time (instead of filling in place) so that the states handed out by get_state stay valid.
+        self._served += self._pos
+        self._buffer = self.generator.random(self.block_size).tolist()
+        self._pos = 0
+
+    @property
+    def drawn(self):
+        """
+        Number of uniforms served so far, counted without any cost on the draws (for profiling). Restoring an
+        earlier state with set_state doesn't make it go back.
+        """
+        return self._served + self._pos
+
+    def uniform(self):
+        """
+        A single uniform sample from [0, 1).
+        """
+        if self._pos == len(self._buffer):
+            self._refill()
+        value = self._buffer[self._pos]
+        self._pos += 1
+        return value
+
+    def bernoulli(self, p):
+        """
+        True with probability p.
+        """
+        return self.uniform() < p
+
+    def uniforms(self, size):
+        """
+        `size` uniform samples from [0, 1) as an array.
+        """
+        values = np.empty(size)
+        for idx in range(size):
+            values[idx] = self.uniform()
+        return values
+
+    def get_state(self):
+        """
+        State that can be passed to set_state to continue from this point on. Cheap, nothing is copied
+        except for the state of the underlying bit generator.
+        """
+        return self.generator.bit_generator.state, self._buffer, self._pos
+
+    def set_state(self, state):
+        self._served += self._pos
+        bit_generator_state, self._buffer, self._pos = state
+        self._served -= self._pos
+        self.generator.bit_generator.state = bit_generator_state
@@ -0,0 +1,84 @@
+"""
+Weighted sampling of quest teams.
+
+The bots pick their teams one player at a time, proportional to the weights of the players not
+picked yet. The same distribution is obtained in one shot with the Gumbel-top-k trick, in its exponential race form:
+every player gets a key Exp(1) / weight and the k smallest keys (in order) are the picks. This is what TeamSampler
+does, both for a single team and for a batch of teams of many games at once.
+"""
+import math
+
+import numpy as np
+
+from game.teams import get_team_encoding
+
+NO_PLAYER = -1
+MIN_WEIGHT = 0.1  # Weights that aren't positive are replaced by this one
+
+
+class TeamSampler:
+    """
+    Samples teams for a given number of players, and maps them to their index (see game.teams).
+    Use get_team_sampler to get the (shared) instance for a player count.
+    """
+    def __init__(self, num_players):
+        self.num_players = num_players
+        encoding = get_team_encoding(num_players)
+        self.max_team_size = max(encoding.sizes)
+
+        # Index arrays over all the teams
+        self.team_masks, team_sizes = encoding.unrank_batch(np.arange(encoding.num_teams))
+        self.team_sizes = team_sizes.astype(np.int8)
+        self._player_bits = 1 << np.arange(num_players, dtype=np.int64)
+        in_team = (self.team_masks[:, None] & self._player_bits) != 0
+        # Players in increasing order, padded with NO_PLAYER
+        self.teams = np.full((encoding.num_teams, self.max_team_size), NO_PLAYER, dtype=np.int8)
+        self.teams[np.arange(self.max_team_size) < self.team_sizes[:, None]] = np.nonzero(in_team)[1]
+        # Bit mask of the players in the team -> index of the team
+        self.mask_to_index = encoding.rank_batch(np.arange(1 << num_players)).astype(np.int32)
+
+    def sample(self, weights, team_size, rng):
+        """
+        Sample a single team.
+
+        :param weights: Weight of every player.
+        :param team_size: Number of players to pick.
+        :param rng: BufferedRandom to draw the uniforms from.
+        :return: The picked player ids (in the order of picking), and the index of the team in the move map.
+        """
+        keys = []
+        for weight in weights:
+            # -log(1 - u) is an Exp(1) sample
+            keys.append(-math.log(1.0 - rng.uniform()) / (weight if weight > 0 else MIN_WEIGHT))
+        picks = sorted(range(self.num_players), key=keys.__getitem__)[:team_size]
+        mask = 0
+        for pid in picks:
+            mask |= 1 << pid
+        return picks, int(self.mask_to_index[mask])
+
+    def sample_batch(self, weights, team_sizes, uniforms):
+        """
+        Sample one team for every row in a single vectorized call.
+
+        :param weights: (batch, num_players) array of weights.
+        :param team_sizes: (batch,) array with the number of players to pick in every row.
+        :param uniforms: (batch, num_players) array of uniform samples from [0, 1).
+        :return: (batch, max_team_size) array of picked player ids (in the order of picking, padded with NO_PLAYER),
+                 and a (batch,) array with the indices of the teams in the move map.
+        """
+        weights = np.where(weights > 0, weights, MIN_WEIGHT)
+        keys = -np.log1p(-uniforms) / weights
+        picks = np.argsort(keys, axis=1)[:, :self.max_team_size]
+        picked = np.arange(self.max_team_size) < np.asarray(team_sizes)[:, None]
+        masks = np.where(picked, self._player_bits[picks], 0).sum(axis=1)
+        picks = np.where(picked, picks, NO_PLAYER).astype(np.int8)
+        return picks, self.mask_to_index[masks]
+
+
+_samplers = {}
+
+
+def get_team_sampler(num_players):
+    if num_players not in _samplers:
+        _samplers[num_players] = TeamSampler(num_players)
+    return _samplers[num_players]
@@ -0,0 +1,183 @@
+"""
+Compact representation of the game state.
+
+The whole state of a game lives in one small fixed size int8 array (see StateLayout for what goes where),
+and the AvalonGame, Quest and Player classes are thin views over it. Instead of mission history lists,
+every player just has a passed and a failed missions counter.
+"""
+from array import array
+from enum import Enum
+import gc
+import sys
+import types
+
+from game.enums_and_config import game_player_configs
+
+NO_PLAYER = -1
+
+# Scalar fields, stored after the per player blocks of the state.
+QUEST = 0
+TEAM_SIZE = 1
+LEADER = 2
+PROPOSAL = 3
+ACTION_TYPE = 4
+TURN_CURSOR = 5  # Number of turns already taken in the current round
+CURRENT_PLAYER = 6
+APPROVALS = 7
+MISSION_FAILS = 8
+QUEST_WINNER = 9
+GOOD_WINS = 10
+EVIL_WINS = 11
+WINNER = 12
+LAST_QUEST_WINNER = 13
+NUM_SCALARS = 14
+
+
+class StateLayout:
+    """
+    Offsets of the different blocks in the state array for a given number of players.
+
+    [roles (n) | passed missions (n) | failed missions (n) | current team (max team size) | scalars]
+
+    Roles are CharacterType values, the current team holds player ids in the order they were picked
+    (padded with NO_PLAYER).
+    """
+    __slots__ = ('num_players', 'max_team_size', 'roles', 'passed', 'failed', 'team', 'scalars', 'size')
+
+    def __init__(self, num_players):
+        self.num_players = num_players
+        self.max_team_size = max(game_player_configs[num_players].quest_size)
+        self.roles = 0
+        self.passed = num_players
+        self.failed = 2 * num_players
+        self.team = 3 * num_players
+        self.scalars = self.team + self.max_team_size
+        self.size = self.scalars + NUM_SCALARS
+
+
+_layouts = {}
+
+
+def get_layout(num_players):
+    if num_players not in _layouts:
+        _layouts[num_players] = StateLayout(num_players)
+    return _layouts[num_players]
+
+
+class GameState:
+    """
+    State of a single game.
+    """
+    __slots__ = ('layout', 'data')
+
+    def __init__(self, num_players):
+        self.layout = get_layout(num_players)
+        self.data = array('b', bytes(self.layout.size))
+        self.clear_team()
+
+    @property
+    def nbytes(self):
+        return self.layout.size
+
+    def clear_team(self):
+        start = self.layout.team
+        for idx in range(start, start + self.layout.max_team_size):
+            self.data[idx] = NO_PLAYER
+
+    def team_ids(self):
+        start = self.layout.team
+        ids = []
+        for idx in range(start, start + self.layout.max_team_size):
+            if self.data[idx] == NO_PLAYER:
+                break
+            ids.append(self.data[idx])
+        return ids
+
+    def set_team(self, player_ids):
+        self.clear_team()
+        start = self.layout.team
+        for offset, pid in enumerate(player_ids):
+            self.data[start + offset] = pid
+
+
+class StateField:
+    """
+    Descriptor exposing a scalar field of the state as an attribute of the view classes.
+    The views are expected to have `_data` (the state array) and `_scalars` (the scalars offset) attributes.
+
+    Enum fields are stored by value, and 0 stands for None for the enums which don't use it.
+    """
+    def __init__(self, index, enum=None):
+        self.index = index
+        self.decode = None
+        if enum is not None:
+            self.decode = [None] * (max(e.value for e in enum) + 1)
+            for e in enum:
+                self.decode[e.value] = e
+
+    def __get__(self, view, owner):
+        if view is None:
+            return self
+        value = view._data[view._scalars + self.index]
+        if self.decode is not None:
+            return self.decode[value]
+        return value
+
+    def __set__(self, view, value):
+        if self.decode is not None:
+            value = 0 if value is None else value.value
+        view._data[view._scalars + self.index] = value
+
+
+# Objects shared by all the games (or by the whole process), not counted by object_graph_size.
+_SHARED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, Enum, str, bool, type(None))
+
+
+def object_graph_size(root, exclude=()):
+    """
+    Bytes of the objects reachable from root, every object counted once with sys.getsizeof. The objects of exclude
+    (and what's only reachable through them) aren't counted, nor are the classes, functions, modules, enums, strings
+    and small ints, which are shared by all the games.
+    """
+    seen = {id(obj) for obj in exclude}
+    stack = [root]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SHARED_TYPES) or (type(obj) is int and -5 <= obj <= 256):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+        if hasattr(obj, '__dict__'):
+            # Not always a referent of the instance, see the managed dicts of Python 3.11+
+            stack.append(obj.__dict__)
+    return total
+
+
+def state_footprint():
+    """
+    Per game memory footprint in bytes for all the supported player counts,
+
+    - state_bytes: the raw state.
+    - container_bytes: the GameState and its array, without the views over it.
+    - game_bytes: the whole AvalonGame, i.e. the state, the Player and Quest views, the bot policy and the game
+      object itself, without its random stream.
+    - rng_bytes: the BufferedRandom of the game, with its block of random numbers.
+
+    The layouts and the configs, shared by all the games of a player count, aren't counted.
+    """
+    # Imported here as the game modules import this one
+    from game.avalon import AvalonGame
+
+    footprint = {}
+    for num_players in game_player_configs:
+        game = AvalonGame(num_players, enable_logs=False)
+        shared = (game.state.layout, game.quest_sizes)
+        footprint[num_players] = {
+            'state_bytes': game.state.nbytes,
+            'container_bytes': sys.getsizeof(game.state) + sys.getsizeof(game.state.data),
+            'game_bytes': object_graph_size(game, shared + (game.rng,)),
+            'rng_bytes': object_graph_size(game.rng, shared),
+        }
+    return footprint
@@ -0,0 +1,143 @@
+"""
+Combinatorial number system encoding of the quest teams.
+
+The team selection actions index all the teams of every quest size of a player count: the teams of the first quest
+size, in lexicographic order, then the teams of the next (new) quest size and so on, which is the order of
+team_selection_move_map. TeamEncoding computes the index of a team (as a bit mask of the players) and the team of an
+index arithmetically, with binomial coefficients, instead of going through the list of all the teams.
+
+Within a quest size of k players out of n, the lexicographic rank of a team c_1 < ... < c_k is
+C(n, k) - 1 - sum_i C(n - 1 - c_i, k + 1 - i), i.e. the mirrored colexicographic rank, so ranking takes O(k)
+lookups in a binomial table and unranking O(n).
+"""
+import numpy as np
+
+from game.enums_and_config import game_player_configs
+
+NO_TEAM = -1
+
+
+def _binomials(n):
+    """
+    (n + 1, n + 1) table of C(row, column), 0 for column > row.
+    """
+    table = np.zeros((n + 1, n + 1), dtype=np.int64)
+    table[:, 0] = 1
+    for row in range(1, n + 1):
+        table[row, 1:] = table[row - 1, 1:] + table[row - 1, :-1]
+    return table
+
+
+class TeamEncoding:
+    """
+    Index <-> team bit mask for a player count. Use get_team_encoding to get the (shared) instance.
+    """
+    def __init__(self, num_players):
+        self.num_players = num_players
+        self.binomials = _binomials(num_players)
+        self._binomials = self.binomials.tolist()
+        # Quest sizes in the order of their index ranges
+        self.sizes = list(dict.fromkeys(game_player_configs[num_players].quest_size))
+        self.counts = {size: self._binomials[num_players][size] for size in self.sizes}
+        self.offsets = {}
+        offset = 0
+        for size in self.sizes:
+            self.offsets[size] = offset
+            offset += self.counts[size]
+        self.num_teams = offset
+        self.max_count = max(self.counts.values())
+
+        self._starts = np.array([self.offsets[size] for size in self.sizes], dtype=np.int64)
+        self._size_array = np.array(self.sizes, dtype=np.int64)
+        self._players = np.arange(num_players, dtype=np.int64)
+
+    def index_range(self, size):
+        """
+        (start, stop) of the indices of the teams of the quest size.
+        """
+        return self.offsets[size], self.offsets[size] + self.counts[size]
+
+    def size(self, index):
+        for size in reversed(self.sizes):
+            if index >= self.offsets[size]:
+                return size
+
+    def rank(self, mask):
+        """
+        Index of the team given as a bit mask of the players, NO_TEAM if there's no quest of its size.
+        """
+        n = self.num_players
+        players = [pid for pid in range(n) if mask >> pid & 1]
+        k = len(players)
+        if k not in self.offsets:
+            return NO_TEAM
+        colex = 0
+        for i, pid in enumerate(players, 1):
+            colex += self._binomials[n - 1 - pid][k + 1 - i]
+        return self.offsets[k] + self.counts[k] - 1 - colex
+
+    def unrank(self, index):
+        """
+        Bit mask of the players of the team of the index.
+        """
+        return sum(1 << pid for pid in self.team(index))
+
+    def team(self, index):
+        """
+        Players of the team of the index, in increasing order (same as team_selection_move_map[n][index]).
+        """
+        n = self.num_players
+        k = self.size(index)
+        colex = self.counts[k] - 1 - (index - self.offsets[k])
+        team = []
+        # Greedy colexicographic unranking of the mirrored players, from the highest one down.
+        d = n - 1
+        for i in range(k, 0, -1):
+            while self._binomials[d][i] > colex:
+                d -= 1
+            colex -= self._binomials[d][i]
+            team.append(n - 1 - d)
+            d -= 1
+        return team
+
+    def rank_batch(self, masks):
+        """
+        Vectorized rank, for an array of bit masks.
+        """
+        n = self.num_players
+        bits = (np.asarray(masks, dtype=np.int64)[:, None] >> self._players) & 1
+        k = bits.sum(axis=1)
+        order = np.cumsum(bits, axis=1)  # i of the set bits
+        terms = self.binomials[n - 1 - self._players, np.clip(k[:, None] + 1 - order, 0, n)]
+        colex = (terms * bits).sum(axis=1)
+        size_idx = np.argmax(self._size_array == k[:, None], axis=1)
+        valid = (self._size_array == k[:, None]).any(axis=1)
+        counts = self.binomials[n, k]
+        return np.where(valid, self._starts[size_idx] + counts - 1 - colex, NO_TEAM)
+
+    def unrank_batch(self, indices):
+        """
+        Vectorized unrank, for an array of indices. Returns the bit masks and the sizes of the teams.
+        """
+        n = self.num_players
+        indices = np.asarray(indices, dtype=np.int64)
+        size_idx = np.searchsorted(self._starts, indices, side='right') - 1
+        k = self._size_array[size_idx]
+        colex = self.binomials[n, k] - 1 - (indices - self._starts[size_idx])
+        masks = np.zeros(len(indices), dtype=np.int64)
+        for i in range(int(k.max(initial=0)), 0, -1):
+            active = k >= i
+            # Highest d with C(d, i) <= colex
+            d = (self.binomials[:n, i][None, :] <= colex[:, None]).sum(axis=1) - 1
+            colex = np.where(active, colex - self.binomials[np.maximum(d, 0), i], colex)
+            masks |= np.where(active, 1 << (n - 1 - d), 0)
+        return masks, k
+
+
+_encodings = {}
+
+
+def get_team_encoding(num_players):
+    if num_players not in _encodings:
+        _encodings[num_players] = TeamEncoding(num_players)
+    return _encodings[num_players]
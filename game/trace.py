@@ -0,0 +1,135 @@
+"""
+Structured tracing of the game events.
+
+The game records typed events (see EventType) into a preallocated ring buffer as plain integers, nothing is
+formatted while the game runs. The events are turned into readable lines only when the trace is read or dumped.
+When tracing is disabled the game holds no trace at all, so the only cost is a `trace is not None` check.
+"""
+from array import array
+from collections import namedtuple
+from enum import Enum
+import sys
+
+from game.enums_and_config import CharacterType, Team
+
+NO_PLAYER = -1
+
+
+class EventType(Enum):
+    """
+    Different event types, and what the player and value of the event hold for them.
+    """
+    GAME_START = 0  # value: number of players
+    ROLE = 1  # player, value: CharacterType of the player
+    TEAM_PROPOSED = 2  # player: the leader, value: bit mask of the team
+    TEAM_VOTE = 3  # player, value: 1 if approved
+    TEAM_RESULT = 4  # value: 1 if approved
+    QUEST_VOTE = 5  # player, value: 1 if passed
+    QUEST_RESULT = 6  # player: the saboteur in the single fail mode, value: Team winning the quest
+    GAME_END = 7  # value: Team winning the game
+
+
+Event = namedtuple('Event', ['event_type', 'quest', 'proposal', 'player', 'value'])
+
+EVENT_SIZE = len(Event._fields)
+_EVENT_TYPES = list(EventType)
+
+
+class EventFormatter:
+    """
+    Turns events into log lines. Keeps track of the roles seen in the ROLE events,
+    so should be fed the events in order.
+    """
+    def __init__(self):
+        self.roles = {}
+
+    def player_string(self, player_id):
+        if player_id in self.roles:
+            return f'Player {player_id} ({self.roles[player_id]})'
+        return f'Player {player_id}'
+
+    def format(self, event):
+        event_type, value = event.event_type, event.value
+        if event_type is EventType.GAME_START:
+            self.roles = {}
+            return f'New game with {value} players'
+        if event_type is EventType.ROLE:
+            self.roles[event.player] = CharacterType(value)
+            return f'{self.player_string(event.player)} joined'
+        if event_type is EventType.TEAM_PROPOSED:
+            team = [pid for pid in range(value.bit_length()) if value >> pid & 1]
+            return f'{self.player_string(event.player)} picked the team ' \
+                   f'{", ".join(self.player_string(pid) for pid in team)}'
+        if event_type is EventType.TEAM_VOTE:
+            return f'{self.player_string(event.player)} {"Approved" if value else "Rejected"} the team'
+        if event_type is EventType.TEAM_RESULT:
+            return "Current team is approved!" if value else "Team approval failed"
+        if event_type is EventType.QUEST_VOTE:
+            return f'{self.player_string(event.player)} {"Passed" if value else "Failed"} the quest'
+        if event_type is EventType.QUEST_RESULT:
+            line = f'{"Good" if Team(value) is Team.GOOD else "Evil"} team won the quest!'
+            if event.player != NO_PLAYER:
+                line = f'Mission Failed due to {self.player_string(event.player)}\n{line}'
+            return line
+        return f'{"Good" if Team(value) is Team.GOOD else "Evil"} team won the game!'
+
+
+class EventTrace:
+    """
+    Ring buffer of the last `capacity` events, older events are overwritten.
+
+    :param capacity: Number of events to keep.
+    :param echo: Print every event as it's recorded, which is how the games log with enable_logs.
+    """
+    def __init__(self, capacity=4096, echo=False):
+        self.capacity = capacity
+        self.echo = echo
+        self._buffer = array('h', bytes(2 * EVENT_SIZE * capacity))
+        # Total number of events recorded, including the overwritten ones
+        self.count = 0
+        self._echo_formatter = EventFormatter()
+
+    def record(self, event_type, quest, proposal, player=NO_PLAYER, value=0):
+        buffer = self._buffer
+        offset = (self.count % self.capacity) * EVENT_SIZE
+        buffer[offset] = event_type.value
+        buffer[offset + 1] = quest
+        buffer[offset + 2] = proposal
+        buffer[offset + 3] = player
+        buffer[offset + 4] = value
+        self.count += 1
+        if self.echo:
+            print(self._echo_formatter.format(Event(event_type, quest, proposal, player, value)))
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def clear(self):
+        self.count = 0
+
+    def events(self):
+        """
+        The events in the buffer, oldest first.
+        """
+        buffer = self._buffer
+        start = self.count - len(self)
+        events = []
+        for idx in range(start, self.count):
+            offset = (idx % self.capacity) * EVENT_SIZE
+            events.append(Event(_EVENT_TYPES[buffer[offset]], *buffer[offset + 1:offset + EVENT_SIZE]))
+        return events
+
+    def lines(self):
+        """
+        The events in the buffer as log lines, oldest first.
+        """
+        formatter = EventFormatter()
+        return [formatter.format(event) for event in self.events()]
+
+    def dump(self, file=None):
+        """
+        Write the log lines to the file (stdout by default).
+        """
+        file = file if file is not None else sys.stdout
+        for line in self.lines():
+            print(line, file=file)
@@ -0,0 +1,104 @@
+import numpy as np
+
+from game.enums_and_config import PlayerVisibility, Team
+
+"""
+Observation encoding helpers shared by AvalonEnv and AvalonVecEnv.
+
+The observation is [visibility of every player, action type, quest number, proposal number, leader], see
+AvalonEnv._convert_game_feedback_to_observation for how the visibilities are defined.
+"""
+
+
+def _visibility_table():
+    """
+    PlayerVisibility as a (team, in_team, passed, failed) indexed array, where team is the index in list(Team).
+    """
+    teams = list(Team)
+    win_target = max(combo[2] for combo in PlayerVisibility) + 1
+    table = np.zeros((len(teams), 2, win_target, win_target), dtype=np.int64)
+    for (team, in_team, passed, failed), idx in PlayerVisibility.items():
+        table[teams.index(team), int(in_team), passed, failed] = idx
+    return table
+
+
+VISIBILITY_TABLE = _visibility_table()
+
+
+class ObservationBuilder:
+    """
+    Builds the observations of an AvalonEnv into a preallocated buffer.
+
+    The player visibilities are recomputed only when the current team or the quest results change,
+    otherwise only the last four (scalar) entries of the buffer are updated. The encoding is the same as the one
+    of AvalonEnv._convert_game_feedback_to_observation.
+    """
+    def __init__(self, game, agent):
+        self.game = game
+        self.agent = agent
+        self.num_players = game.num_players
+        self.buffer = np.zeros(self.num_players + 4, dtype=np.int64)
+
+        layout = game.state.layout
+        self._data = game.state.data
+        self._team = range(layout.team, layout.team + layout.max_team_size)
+        self._passed = layout.passed
+        self._failed = layout.failed
+        self._visibility = VISIBILITY_TABLE.tolist()
+
+        self._team_indices = None
+        self._last_team = [None] * layout.max_team_size
+        self._last_quests_played = None
+
+    def reset(self):
+        """
+        Should be called after every reset of the game, as the character types change.
+        """
+        teams = list(Team)
+        unknown = teams.index(Team.UNKNOWN)
+        agent_evil = self.agent.team is Team.EVIL
+        self._team_indices = []
+        for player in self.game.players:
+            if agent_evil or player is self.agent:
+                # Evil agent has full visibility about the player's team
+                self._team_indices.append(teams.index(player.team))
+            else:
+                # Good agent has no visibility about the player's team
+                self._team_indices.append(unknown)
+        self._last_quests_played = None
+
+    def update(self, feedback):
+        """
+        Update the buffer as per the feedback (which is expected to be the latest one from the game).
+        """
+        data = self._data
+        changed = False
+        for position, idx in enumerate(self._team):
+            if self._last_team[position] != data[idx]:
+                self._last_team[position] = data[idx]
+                changed = True
+
+        quests_played = self.game.good_team_wins + self.game.evil_team_wins
+        if changed or quests_played != self._last_quests_played:
+            self._last_quests_played = quests_played
+            self._update_visibilities()
+
+        buffer = self.buffer
+        n = self.num_players
+        buffer[n] = feedback.action_type.value
+        buffer[n + 1] = feedback.quest_number
+        buffer[n + 2] = feedback.proposal_number
+        buffer[n + 3] = feedback.leader
+        return buffer
+
+    def _update_visibilities(self):
+        data = self._data
+        in_team = [False] * self.num_players
+        for pid in self._last_team:
+            if pid is None or pid < 0:
+                break
+            in_team[pid] = True
+
+        for pid in range(self.num_players):
+            self.buffer[pid] = self._visibility[self._team_indices[pid]][in_team[pid]][
+                data[self._passed + pid]][data[self._failed + pid]]
@@ -0,0 +1,212 @@
+import numpy as np
+
+from agent import QTableAgent
+from game.enums_and_config import ActionType, CharacterType, Team
+from game.state import ACTION_TYPE, LEADER, PROPOSAL, QUEST
+from observation import VISIBILITY_TABLE
+from q_table import NO_ACTION
+
+"""
+Learned opponents
+-----------------
+Besides the agent at seat 0, an AvalonEnv can have learned_seats, played by learned models (stable-baselines
+policies, QTableAgents) instead of the bots. The game stops on their turns like on the agent's, and an OpponentPool
+plays them for a whole batch of envs at once: it gathers the pending learned seat moves of all the envs, builds
+their observations with NumPy, runs a single inference per model over all the seats and envs it plays, and scatters
+the moves back into the games (AvalonEnv.play_learned_seat). It repeats that until every env waits for its agent,
+so a step of N envs costs a few batched inferences per model, instead of one predict call per seat and move.
+
+A learned seat observes the game the way the agent at seat 0 does, with the seats rotated so that it's at seat 0
+(the leader is rotated the same way, and the team it picks is rotated back). So a model trained as the agent plays
+any seat. The observations and actions follow the options of the envs (canonical_seats, factored_actions), the
+models are expected to have been trained on envs with the same options.
+
+Like for the agent, only a team and an approve / pass are taken from the model, a no-op, a reject or a fail
+leaves the move to the bot policy (see Quest.make_team_approval_move).
+"""
+
+# Index in list(Team) of the team of a good player, as seen by another good player
+_UNKNOWN = list(Team).index(Team.UNKNOWN)
+
+
+class OpponentModel:
+    """
+    Interface of the models playing the learned seats.
+    """
+    def predict_batch(self, observations, char_types):
+        """
+        :param observations: (batch, obs size) observations of the seats, as the agent at seat 0 would observe them.
+        :param char_types: (batch,) CharacterType values of the seats.
+        :return: (batch, len(action nvec)) actions.
+        """
+        raise NotImplementedError
+
+
+class PolicyOpponent(OpponentModel):
+    """
+    A model with a stable-baselines like predict(observations, deterministic) -> (actions, states), e.g. the PPO2
+    model of baseline_trial.py. Recurrent policies aren't supported, the states aren't kept.
+    """
+    def __init__(self, model, deterministic=True):
+        self.model = model
+        self.deterministic = deterministic
+
+    def predict_batch(self, observations, char_types):
+        actions, _ = self.model.predict(observations, deterministic=self.deterministic)
+        return actions
+
+
+class QTableOpponent(OpponentModel):
+    """
+    The greedy actions of a QTableAgent (which isn't updated). With the dense q-tables, the rows of every char type
+    are looked up at once, the states never seen get a random action like in QTableAgent.predict_batch.
+    """
+    def __init__(self, agent):
+        self.agent = agent
+
+    def predict_batch(self, observations, char_types):
+        agent = self.agent
+        if not agent.dense:
+            return agent.predict_batch(observations, [{'char_type': CharacterType(value)}
+                                                      for value in char_types.tolist()])
+
+        action_nvec = agent.env.action_space.nvec
+        actions = np.empty((len(observations), len(action_nvec)), dtype=np.int64)
+        for value in np.unique(char_types).tolist():
+            seats = np.flatnonzero(char_types == value)
+            q_table = agent.get_q_table(CharacterType(value))
+            greedy = q_table.greedy_indices(q_table.state_rows(observations[seats], create=False))
+            known = greedy != NO_ACTION
+            actions[seats[known]] = np.stack(np.unravel_index(greedy[known], action_nvec), axis=1)
+            for position in seats[~known].tolist():
+                actions[position] = agent.env.action_space.sample()
+        return actions
+
+
+def as_opponent_model(model):
+    """
+    The OpponentModel of a model, QTableAgents are wrapped into a QTableOpponent and the other models (with a
+    stable-baselines like predict) into a PolicyOpponent.
+    """
+    if isinstance(model, OpponentModel):
+        return model
+    if isinstance(model, QTableAgent):
+        return QTableOpponent(model)
+    return PolicyOpponent(model)
+
+
+class OpponentPool:
+    """
+    Plays the learned seats of a batch of AvalonEnvs, see the module docs.
+    """
+    def __init__(self, seat_models):
+        """
+        :param seat_models: Learned seat -> model (see as_opponent_model). A model given for several seats plays all
+                            of them, with a single inference per round. The envs have to be created with these seats
+                            as their learned_seats.
+        """
+        assert 0 not in seat_models, "Seat 0 is the agent's"
+        self.seats = tuple(sorted(seat_models))
+        self.models = []
+        # Seat -> index of its model in self.models, -1 for the seats which aren't learned
+        self._seat_model = np.full(max(self.seats) + 1, -1, dtype=np.int64)
+        model_indices = {}
+        for seat in self.seats:
+            model = seat_models[seat]
+            if id(model) not in model_indices:
+                model_indices[id(model)] = len(self.models)
+                self.models.append(as_opponent_model(model))
+            self._seat_model[seat] = model_indices[id(model)]
+        self.num_moves = 0
+        self.num_inferences = 0
+
+    def step(self, envs, actions):
+        """
+        AvalonEnv.step for all the envs, with the learned seats played by the pool.
+
+        :param actions: Action of the agent of every env.
+        :return: List of the (obs, reward, done, info) of every env.
+        """
+        for env, action in zip(envs, actions):
+            env.begin_step(action)
+        self.play(envs)
+        return [env.end_step() for env in envs]
+
+    def play(self, envs):
+        """
+        Plays the pending learned seat moves of the envs (see AvalonEnv.begin_step) until every env waits for its
+        agent, or its game is over.
+        """
+        pending = [env for env in envs if env.pending_seat is not None]
+        while pending:
+            seats = np.array([env.pending_seat for env in pending], dtype=np.int64)
+            observations, char_types, perms = self.observations(pending, seats)
+            actions = np.empty((len(pending), len(pending[0].action_space.nvec)), dtype=np.int64)
+            model_indices = self._seat_model[seats]
+            for model_index in np.unique(model_indices).tolist():
+                positions = np.flatnonzero(model_indices == model_index)
+                actions[positions] = self.models[model_index].predict_batch(observations[positions],
+                                                                            char_types[positions])
+                self.num_inferences += 1
+            self.num_moves += len(pending)
+
+            choices = self.decode(pending, seats, observations, actions, perms)
+            pending = [env for env, choice in zip(pending, choices) if env.play_learned_seat(choice) is not None]
+
+    @staticmethod
+    def observations(envs, seats):
+        """
+        Observations of the seats (one per env), as the agent at seat 0 of the env would observe them if it was
+        sitting at the seat. The envs are expected to have the same number of players and options.
+
+        :return: The observations, the CharacterType values of the seats, and the seat permutations of the
+                 canonical observations (None without canonical_seats).
+        """
+        layout = envs[0].game.state.layout
+        p = layout.num_players
+        states = np.frombuffer(b''.join([env.game.state.data.tobytes() for env in envs]), dtype=np.int8)
+        states = states.reshape(len(envs), layout.size).astype(np.int64)
+        roles = states[:, layout.roles:layout.roles + p]
+        passed = states[:, layout.passed:layout.passed + p]
+        failed = states[:, layout.failed:layout.failed + p]
+        in_team = (states[:, layout.team:layout.scalars, None] == np.arange(p)).any(axis=1)
+        scalars = states[:, layout.scalars:]
+
+        rows = np.arange(len(envs))
+        # The evil seats see the teams of everyone, the good ones only their own
+        sees_all = roles[rows, seats] == CharacterType.MINION.value
+        team_idx = np.where(sees_all[:, None] | (np.arange(p) == seats[:, None]), roles - 1, _UNKNOWN)
+        visibilities = VISIBILITY_TABLE[team_idx, in_team.astype(np.int64), passed, failed]
+
+        # Rotate the seats so that the learned seat is at seat 0
+        order = (np.arange(p) + seats[:, None]) % p
+        observations = np.concatenate([
+            np.take_along_axis(visibilities, order, axis=1),
+            scalars[:, [ACTION_TYPE, QUEST, PROPOSAL]],
+            ((scalars[:, LEADER] - seats) % p)[:, None],
+        ], axis=1)
+
+        perms = None
+        canonicalizer = envs[0].canonicalizer
+        if canonicalizer is not None:
+            observations, perms = canonicalizer.canonicalize(observations)
+        return observations, roles[rows, seats], perms
+
+    @staticmethod
+    def decode(envs, seats, observations, actions, perms):
+        """
+        Values for the game (see AvalonEnv.play_learned_seat) of the actions chosen on the observations of the seats.
+        """
+        p = envs[0].num_players
+        if perms is not None:
+            actions = envs[0].canonicalizer.to_env_actions(actions, perms)
+        action_tables = envs[0].action_tables
+        choices = []
+        for env, seat, action_type, action in zip(envs, seats.tolist(), observations[:, p].tolist(), actions.tolist()):
+            action_type = ActionType(action_type)
+            choice = action_tables.decode(action, action_type, env.game.current_quest.team_size)
+            if action_type is ActionType.TEAM_SELECTION and choice is not None:
+                # Rotate the team back to the seats of the game
+                choice = [(pid + seat) % p for pid in choice]
+            choices.append(choice)
+        return choices
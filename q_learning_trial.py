@@ -1,50 +1,23 @@
 from collections import deque, defaultdict
+import multiprocessing
+import os
+import queue
+import random
 from flatten_dict import flatten
-import pickle
 
 import numpy as np
 
 from environment import AvalonEnv
 from agent import RandomAgent, QTableAgent
+from checkpoint import QTableCheckpointer, write_snapshot
+from evaluation import evaluate
 from game.enums_and_config import CharacterType
+from shared_q_table import SharedQTables
 
 BEST_MEAN_REWARD = -float('inf')
-
-
-def evaluate(agent, env, num_episodes):
-    """
-    Evaluate the agent, on a new envrionment instance.
-    """
-    reward_so_far = []
-    penalties_so_far = []
-    agent_game_results = defaultdict(list)
-
-    for _ in range(num_episodes):
-        obs = env.reset()
-        done, state = False, None
-        episode_reward = 0
-        episode_penalties = 0
-        _info = None
-
-        while not done:
-            action = agent.predict(obs, _info)
-            obs, reward, done, _info = env.step(action)
-
-            if type(_info) is list:
-                info = _info[0]
-            else:
-                info = _info
-
-            episode_reward += reward
-            episode_penalties += info['num_penalties']
-
-            if done:  # game over
-                agent_game_results[info['char_type']].append(info['game_winner'] == info['agent_team'])
-
-        reward_so_far.append(episode_reward)
-        penalties_so_far.append(episode_penalties)
-
-    return reward_so_far, penalties_so_far, agent_game_results
+# The best model is saved apart from the periodic checkpoints, which have their own generations
+BEST_MODEL_PATH = "q_table_best"
+CHECKPOINT_PATH = "q_table_checkpoint"
 
 
 def callback(env, model, save_path, num_eval_episodes=100, target_reward=None):
@@ -52,7 +25,8 @@ def callback(env, model, save_path, num_eval_episodes=100, target_reward=None):
     Callback method that, evaluates performance, prints out metrics, saves the best models, and
     terminates training if target reward is achieved.
     """
-    eval_rewards, eval_penalties, eval_agent_results = evaluate(model, env, num_eval_episodes)
+    # Evaluated on new env instances, with the greedy actions of all the games predicted at once.
+    eval_rewards, eval_penalties, eval_agent_results = evaluate(model.predict_batch, env.get_config(), num_eval_episodes)
     mean_eval_reward, std_eval_reward, mean_eval_penalties = np.mean(eval_rewards), np.std(eval_rewards), np.mean(eval_penalties)
     print()
     print(f"Average reward per episode {np.mean(eval_rewards)}")
@@ -67,30 +41,30 @@ def callback(env, model, save_path, num_eval_episodes=100, target_reward=None):
         print(f'Agent won {win_percent}% games out of {total_games} games while taking {char_type.name} role.')
 
     global BEST_MEAN_REWARD
-    # New best model, you could save the agent here
+    # New best model, saving it
     if mean_eval_reward > BEST_MEAN_REWARD:
         BEST_MEAN_REWARD = mean_eval_reward
         # Saving best model
         print(f"Saving new best model to {save_path}")
-        #TODO: Enable save later on
-        #save(model.q_table, save_path)
+        save(model, save_path)
 
     if target_reward and mean_eval_reward > target_reward:
         print(f"Achieved reward of {mean_eval_reward}, halting training")
         print(f"Saving new best model to {save_path}")
-        save(model.q_table, save_path)
+        save(model, save_path)
         return False  # Signal to terminate training
 
     return win_percent_by_ctype, mean_eval_reward, std_eval_reward, mean_eval_penalties
 
 
-def train(num_episodes, env, agent, target_reward=4, last_n_plot=100, callback_every=5000):
+def train(num_episodes, env, agent, target_reward=4, last_n_plot=100, callback_every=5000, checkpointer=None):
     """
     The method to train the agent.
     :param num_episodes: number of episodes (game instances) to train the agent for
     :param env: The environment in which to train the agent.
     :param agent: The agent instance.
     :param last_n_plot: Number of latest metrics to track as history.
+    :param checkpointer: If passed, a QTableCheckpointer to checkpoint the q-tables with every `callback_every` episodes.
     :return:
     """
     # Store last few metrics here
@@ -100,7 +74,10 @@ def train(num_episodes, env, agent, target_reward=4, last_n_plot=100, callback_e
 
     for curr_episode in range(num_episodes):
         if curr_episode % callback_every == 0:
-            win_percent_map, mean_eval_reward, std_eval_reward, mean_eval_penalty = callback(env, agent, "q_table.pickle", last_n_plot, target_reward)
+            if checkpointer is not None:
+                # Only the entries changed since the previous checkpoint are written (mostly)
+                checkpointer.checkpoint()
+            win_percent_map, mean_eval_reward, std_eval_reward, mean_eval_penalty = callback(env, agent, BEST_MODEL_PATH, last_n_plot, target_reward)
             mean_eval_rewards.append(mean_eval_reward)
             std_eval_rewards.append(std_eval_reward)
             mean_eval_penalties.append(mean_eval_penalty)
@@ -111,32 +88,139 @@ def train(num_episodes, env, agent, target_reward=4, last_n_plot=100, callback_e
                 for ctype, percent in win_percent_map.items():
                     agent_game_results[ctype].append(percent)
 
-        obs, info = env.reset(external=False)
-        info['prev_obs'] = None
-        reward = 0
-        done = False
+        episode_rewards.append(run_episode(env, agent))
 
-        episode_reward = 0
+    return episode_rewards, mean_eval_rewards, std_eval_rewards, mean_eval_penalties, agent_game_results
 
-        while not done:
-            action = agent.get_next_action(obs, reward, info)
-            prev_obs = obs
-            obs, reward, done, info = env.step(action)
-            info['prev_obs'] = prev_obs
-            episode_reward += reward
 
-        episode_rewards.append(episode_reward)
+def run_episode(env, agent):
+    """
+    Play an episode, updating the agent's q-values on every step.
+    :return: The reward of the episode.
+    """
+    obs, info = env.reset(external=False)
+    info['prev_obs'] = None
+    reward = 0
+    done = False
+
+    episode_reward = 0
+
+    while not done:
+        action = agent.get_next_action(obs, reward, info)
+        prev_obs = obs
+        obs, reward, done, info = env.step(action)
+        info['prev_obs'] = prev_obs
+        episode_reward += reward
+
+    return episode_reward
+
+
+def _hogwild_worker(worker_id, num_episodes, env_config, agent_params, tables, seed, started, finished, stop, results):
+    env = AvalonEnv(enable_logs=False, **env_config)
+    # The forked workers would otherwise explore with the same random streams.
+    worker_seed = None if seed is None else seed + worker_id
+    env.seed(worker_seed)
+    random.seed(worker_seed)
+    agent = QTableAgent(env=env, dense=True, **agent_params)
+    agent.q_table = tables.attach()
+
+    episode_rewards = []
+    while not stop.is_set():
+        with started.get_lock():
+            if started.value >= num_episodes:
+                break
+            started.value += 1
+        episode_rewards.append(run_episode(env, agent))
+        with finished.get_lock():
+            finished.value += 1
+    results.put((worker_id, episode_rewards))
+
 
+def train_hogwild(num_episodes, env, agent, num_workers=None, target_reward=4, last_n_plot=100, callback_every=5000,
+                  checkpoint_path=None, lock_free=True, capacity=None, seed=None, start_method=None):
+    """
+    Train the agent with several worker processes, every one of them playing episodes on its own AvalonEnv and
+    updating the same q-tables, which live in shared memory (see shared_q_table.py). This process is the
+    coordinator, it runs the callback (and the checkpoints) every `callback_every` finished episodes, while the
+    workers keep on training.
+
+    :param num_episodes: number of episodes (game instances) to train the agent for, over all the workers
+    :param env: The environment, the workers play games of its config.
+    :param agent: A QTableAgent created with dense=True, its alpha, gamma and epsilon are used by the workers. Its
+                  q-tables are replaced by the trained ones (as regular DenseQTables) in the end.
+    :param num_workers: Number of worker processes, the number of CPUs by default.
+    :param checkpoint_path: If passed, a snapshot of the q-tables is written there on every callback.
+    :param lock_free: Lock-free (Hogwild) updates of the shared q-values, or updates under striped locks.
+    :param capacity: Max number of states per char type in the shared q-tables, derived from the number of players by
+                     default (see SharedQTables).
+    :param seed: Worker i is seeded with seed + i.
+    :param start_method: Multiprocessing start method, the platform's default by default.
+    :return: Same as train, the episode rewards are grouped by worker.
+    """
+    assert agent.dense, "The shared q-tables are dense q-tables"
+    ctx = multiprocessing.get_context(start_method)
+    num_workers = num_workers or os.cpu_count()
+    tables = SharedQTables(env.observation_space.nvec, env.action_space.nvec, capacity=capacity, lock_free=lock_free,
+                           ctx=ctx)
+    agent.q_table = tables.attach()
+    agent_params = dict(alpha=agent.alpha, gamma=agent.gamma, epsilon=agent.epsilon)
+    started, finished = ctx.Value('q', 0), ctx.Value('q', 0)
+    stop = ctx.Event()
+    results = ctx.Queue()
+    processes = [ctx.Process(target=_hogwild_worker, daemon=True,
+                             args=(worker_id, num_episodes, env.get_config(), agent_params, tables, seed, started,
+                                   finished, stop, results))
+                 for worker_id in range(num_workers)]
+
+    mean_eval_rewards, std_eval_rewards, mean_eval_penalties = [], [], []
+    agent_game_results = defaultdict(list)
+    worker_rewards = {}
+    next_callback = 0
+    try:
+        for process in processes:
+            process.start()
+        while len(worker_rewards) < num_workers:
+            if finished.value >= next_callback and not stop.is_set() and next_callback < num_episodes:
+                next_callback += callback_every
+                if checkpoint_path is not None:
+                    write_snapshot(checkpoint_path, agent)
+                win_percent_map, mean_eval_reward, std_eval_reward, mean_eval_penalty = callback(env, agent, BEST_MODEL_PATH, last_n_plot, target_reward)
+                mean_eval_rewards.append(mean_eval_reward)
+                std_eval_rewards.append(std_eval_reward)
+                mean_eval_penalties.append(mean_eval_penalty)
+
+                if win_percent_map is False:
+                    stop.set()
+                else:
+                    for ctype, percent in win_percent_map.items():
+                        agent_game_results[ctype].append(percent)
+            try:
+                worker_id, episode_rewards = results.get(timeout=0.01)
+                worker_rewards[worker_id] = episode_rewards
+            except queue.Empty:
+                if any(process.exitcode not in (None, 0) for process in processes):
+                    raise RuntimeError('A training worker failed')
+        for process in processes:
+            process.join()
+
+        agent.q_table = {char_type: q_table.to_dense() for char_type, q_table in agent.q_table.items()
+                         if len(q_table)}
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        tables.close()
+
+    episode_rewards = [reward for worker_id in sorted(worker_rewards) for reward in worker_rewards[worker_id]]
     return episode_rewards, mean_eval_rewards, std_eval_rewards, mean_eval_penalties, agent_game_results
 
 
 def save(model, save_path):
     """
-    Save the q-table as pickle
+    Save the q-tables of the agent as a checkpoint directory, see checkpoint.py. Load them back
+    with QTableCheckpoint(save_path).load_into(agent).
     """
-    with open(save_path, "wb") as f:
-        d = dict(model)
-        pickle.dump(d, f)
+    write_snapshot(save_path, model)
 
 
 if __name__ == "__main__":
@@ -149,9 +233,10 @@ if __name__ == "__main__":
     """
     env = AvalonEnv(5, enable_logs=False, autoplay=True, enable_penalties=False)
 
-    agent = QTableAgent(env=env)
+    agent = QTableAgent(env=env, track_changes=True)
+    checkpointer = QTableCheckpointer(CHECKPOINT_PATH, agent)
     num_episodes = 150000
-    rewards, mean_eval_rewards, std_eval_rewards, mean_eval_penalties,  agent_game_results = train(num_episodes, env, agent)
+    rewards, mean_eval_rewards, std_eval_rewards, mean_eval_penalties,  agent_game_results = train(num_episodes, env, agent, checkpointer=checkpointer)
 
     # A nice way to get the q-table and sort it by q-values
     # Inspecting the extreme q values (+ve or -ve) help us to see what exactly agent is learning from experiences.
@@ -0,0 +1,313 @@
+import sys
+
+import numpy as np
+
+"""
+Dense Q-table backend for QTableAgent.
+
+The dict backend stores a q-value per (observation tuple, action tuple) in nested dicts, which costs hundreds of bytes
+per entry. DenseQTable instead gives every visited observation a row (assigned lazily, in the order of the visits),
+and stores the q-values of all the actions of the row in float32 arrays. The rows live in fixed size chunks, so
+growing the table never copies the existing values. Actions which were never tried in a state are NaN.
+
+Every entry of the observation fits in a byte (see AvalonEnv.observation_space), so the observations are keyed by
+their bytes, and the actions by their mixed-radix index over action_space.nvec.
+
+A row costs 4 bytes per action of the action space whether the actions were tried or not, see memory_usage. The
+number of actions grows quickly with the number of players (180 at 5 players, 7128 at 11), so the number of rows per
+chunk is derived from it, to keep every chunk around CHUNK_BYTES.
+
+The max q-value and the greedy action of every row are cached, and updated on every write. The row is rescanned
+only when the q-value of its greedy action decreases, so max_value and greedy_action (the TD targets and the
+greedy actions of QTableAgent) don't depend on the number of actions.
+"""
+
+NO_ACTION = -1
+# Target size of a chunk of values
+CHUNK_BYTES = 1 << 20
+MAX_CHUNK_SIZE = 4096
+
+
+def default_chunk_size(num_actions):
+    """
+    The largest power of 2 number of rows (at most MAX_CHUNK_SIZE) whose values fit in CHUNK_BYTES, e.g. 1024 rows
+    at 5 players and 32 at 11.
+    """
+    rows = max(CHUNK_BYTES // (np.dtype(np.float32).itemsize * num_actions), 1)
+    return min(1 << (rows.bit_length() - 1), MAX_CHUNK_SIZE)
+
+
+class QRow:
+    """
+    Dict like view over the q-values of a state, {action tuple: q-value} of the tried actions. Reading a
+    missing action gives 0.0 (like the defaultdicts of the dict backend), but doesn't mark it as tried.
+    """
+    __slots__ = ('table', 'key')
+
+    def __init__(self, table, key):
+        self.table = table
+        self.key = key
+
+    def _values(self):
+        row = self.table._rows.get(self.key)
+        if row is None:
+            return None
+        return self.table._row_values(row)
+
+    def __getitem__(self, action):
+        return self.table.get_value(self.key, action)
+
+    def __setitem__(self, action, value):
+        self.table.set_value(self.key, action, value)
+
+    def get(self, action, default=None):
+        values = self._values()
+        if values is None:
+            return default
+        value = values[self.table.action_index(action)]
+        return default if np.isnan(value) else float(value)
+
+    def keys(self):
+        values = self._values()
+        if values is None:
+            return []
+        return [self.table.action_from_index(idx) for idx in np.flatnonzero(~np.isnan(values))]
+
+    def values(self):
+        values = self._values()
+        if values is None:
+            return []
+        return values[~np.isnan(values)].tolist()
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        values = self._values()
+        return 0 if values is None else int(np.count_nonzero(~np.isnan(values)))
+
+    def __contains__(self, action):
+        return self.get(action) is not None
+
+
+class DenseQTable:
+    """
+    Q-table of a single char_type, see the module docs.
+
+    Supports the same `table[obs][action]` reads and writes as the dict backend (through QRow), and the faster
+    get_value / set_value / max_value / greedy_action methods used by QTableAgent.
+    """
+    def __init__(self, obs_nvec, action_nvec, chunk_size=None):
+        """
+        :param obs_nvec: nvec of the MultiDiscrete observation space.
+        :param action_nvec: nvec of the MultiDiscrete action space.
+        :param chunk_size: Number of states per chunk of values, rounded up to a power of 2. By default derived from
+                           the number of actions, see default_chunk_size.
+        """
+        assert max(obs_nvec) <= 256, "Every entry of the observation has to fit in a byte"
+        self.action_nvec = tuple(int(n) for n in action_nvec)
+        self.num_actions = int(np.prod(self.action_nvec))
+        self._radix = [int(np.prod(self.action_nvec[idx + 1:])) for idx in range(len(self.action_nvec))]
+        chunk_size = chunk_size or default_chunk_size(self.num_actions)
+        self._chunk_shift = max(int(chunk_size - 1).bit_length(), 0)
+        self.chunk_size = 1 << self._chunk_shift
+        self._chunk_mask = self.chunk_size - 1
+        # Observation bytes -> row
+        self._rows = {}
+        self._chunks = []
+        # Max q-value and its action index per row, NaN / NO_ACTION if no action was tried.
+        self._max_chunks = []
+        self._argmax_chunks = []
+
+    @staticmethod
+    def state_key(obs):
+        if isinstance(obs, np.ndarray):
+            obs = obs.tolist()
+        return bytes(obs)
+
+    def action_index(self, action):
+        idx = 0
+        for value, radix in zip(action, self._radix):
+            idx += int(value) * radix
+        return idx
+
+    def action_from_index(self, idx):
+        action = []
+        for radix in self._radix:
+            value, idx = divmod(idx, radix)
+            action.append(value)
+        return tuple(action)
+
+    def _row(self, key, create):
+        row = self._rows.get(key)
+        if row is None and create:
+            row = len(self._rows)
+            if row >> self._chunk_shift == len(self._chunks):
+                self._chunks.append(np.full((self.chunk_size, self.num_actions), np.nan, dtype=np.float32))
+                self._max_chunks.append(np.full(self.chunk_size, np.nan, dtype=np.float32))
+                self._argmax_chunks.append(np.full(self.chunk_size, NO_ACTION, dtype=np.int32))
+            self._rows[key] = row
+        return row
+
+    def _row_values(self, row):
+        return self._chunks[row >> self._chunk_shift][row & self._chunk_mask]
+
+    """
+    Fast access, obs can be a tuple, a list, an array or an already computed state_key.
+    """
+    def get_value(self, obs, action):
+        key = obs if isinstance(obs, bytes) else self.state_key(obs)
+        row = self._rows.get(key)
+        if row is None:
+            return 0.0
+        value = self._row_values(row)[self.action_index(action)]
+        return 0.0 if value != value else float(value)  # NaN (untried action) reads as 0
+
+    def set_value(self, obs, action, value):
+        key = obs if isinstance(obs, bytes) else self.state_key(obs)
+        row = self._row(key, create=True)
+        chunk, offset = row >> self._chunk_shift, row & self._chunk_mask
+        values = self._chunks[chunk][offset]
+        action_idx = self.action_index(action)
+        values[action_idx] = value
+
+        # Keep the max / argmax cache up to date
+        max_values, argmax = self._max_chunks[chunk], self._argmax_chunks[chunk]
+        value = values[action_idx]  # As stored in float32
+        best = argmax[offset]
+        if best == NO_ACTION or value > max_values[offset] or (value == max_values[offset] and action_idx < best):
+            max_values[offset] = value
+            argmax[offset] = action_idx
+        elif action_idx == best and value < max_values[offset]:
+            # The max decreased, some other action might be the greedy one now.
+            best = int(np.nanargmax(values))
+            argmax[offset] = best
+            max_values[offset] = values[best]
+
+    def max_value(self, obs, default=0.0):
+        """
+        Max q-value over the tried actions of the state, default if none was tried.
+        """
+        key = obs if isinstance(obs, bytes) else self.state_key(obs)
+        row = self._rows.get(key)
+        if row is None:
+            return default
+        chunk, offset = row >> self._chunk_shift, row & self._chunk_mask
+        if self._argmax_chunks[chunk][offset] == NO_ACTION:
+            return default
+        return float(self._max_chunks[chunk][offset])
+
+    def greedy_action(self, obs, default=None):
+        """
+        The tried action with the max q-value in the state (the lowest index on ties), default if none was tried.
+        """
+        key = obs if isinstance(obs, bytes) else self.state_key(obs)
+        row = self._rows.get(key)
+        if row is None:
+            return default
+        best = self._argmax_chunks[row >> self._chunk_shift][row & self._chunk_mask]
+        if best == NO_ACTION:
+            return default
+        return list(self.action_from_index(int(best)))
+
+    """
+    Batched access, for many states at once (see BatchedQLearning). The states are given as rows, and the
+    actions as action indices.
+    """
+    def state_rows(self, observations, create=True):
+        """
+        Rows of a (batch, obs size) array of observations, NO_ACTION for the unseen ones if create is False.
+        """
+        observations = np.ascontiguousarray(np.asarray(observations, dtype=np.uint8))
+        keys = observations.view(f'V{observations.shape[1]}').ravel().tolist()
+        if create:
+            return np.array([self._row(key, create=True) for key in keys], dtype=np.int64)
+        return np.array([self._rows.get(key, NO_ACTION) for key in keys], dtype=np.int64)
+
+    def _chunk_groups(self, rows):
+        """
+        (chunk, positions in rows, offsets in the chunk) for the chunks the rows are in.
+        """
+        chunk_ids = rows >> self._chunk_shift
+        for chunk in np.unique(chunk_ids).tolist():
+            positions = np.flatnonzero(chunk_ids == chunk)
+            yield chunk, positions, rows[positions] & self._chunk_mask
+
+    def max_values(self, rows, default=0.0):
+        """
+        Cached max q-value of every row (default for the rows without a tried action, and for NO_ACTION rows).
+        """
+        result = np.full(len(rows), default, dtype=np.float64)
+        known = rows != NO_ACTION
+        for chunk, positions, offsets in self._chunk_groups(rows[known]):
+            result[np.flatnonzero(known)[positions]] = self._max_chunks[chunk][offsets]
+        return np.where(np.isnan(result), default, result)
+
+    def greedy_indices(self, rows):
+        """
+        Cached greedy action index of every row, NO_ACTION for the rows without a tried action.
+        """
+        result = np.full(len(rows), NO_ACTION, dtype=np.int64)
+        known = rows != NO_ACTION
+        for chunk, positions, offsets in self._chunk_groups(rows[known]):
+            result[np.flatnonzero(known)[positions]] = self._argmax_chunks[chunk][offsets]
+        return result
+
+    def td_update(self, rows, action_indices, targets, alpha):
+        """
+        Q(s, a) += alpha * (target - Q(s, a)) for a batch of (row, action index, target), all the TD errors being
+        computed from the values before the batch. When an entry is hit several times in the batch, it moves by
+        the mean of its TD errors, so the result doesn't depend on the order in the batch.
+        """
+        for chunk, positions, offsets in self._chunk_groups(rows):
+            values = self._chunks[chunk]
+            flat = offsets * self.num_actions + action_indices[positions]
+            entries, inverse = np.unique(flat, return_inverse=True)
+            current = values.flat[entries]
+            current = np.where(np.isnan(current), 0.0, current)  # Untried actions read as 0
+            errors = np.zeros(len(entries))
+            np.add.at(errors, inverse, targets[positions] - current[inverse])
+            values.flat[entries] = current + alpha * errors / np.bincount(inverse)
+
+            # Refresh the max / argmax cache of the updated rows
+            updated = np.unique(entries // self.num_actions)
+            best = np.nanargmax(values[updated], axis=1)
+            self._argmax_chunks[chunk][updated] = best
+            self._max_chunks[chunk][updated] = values[updated, best]
+
+    """
+    Dict like access, same as the dict backend.
+    """
+    def __getitem__(self, obs):
+        return QRow(self, self.state_key(obs))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def to_dict(self):
+        """
+        The table in the dict backend layout, {obs tuple: {action tuple: q-value}}.
+        """
+        return {tuple(key): dict(QRow(self, key).items()) for key in self._rows}
+
+    def memory_usage(self):
+        """
+        Bytes allocated for the values and used by the state index, and the bytes per million visited states
+        (a row of values plus the index entry, the last chunk being partially filled doesn't count).
+        """
+        value_bytes = sum(chunk.nbytes for chunks in (self._chunks, self._max_chunks, self._argmax_chunks)
+                          for chunk in chunks)
+        index_bytes = sys.getsizeof(self._rows) + sum(sys.getsizeof(key) + sys.getsizeof(row)
+                                                     for key, row in self._rows.items())
+        states = len(self._rows)
+        per_state = value_bytes / (len(self._chunks) * self.chunk_size) if self._chunks else 0
+        per_state += index_bytes / states if states else 0
+        return {
+            'states': states,
+            'value_bytes': value_bytes,
+            'index_bytes': index_bytes,
+            'bytes_per_million_states': per_state * 1e6,
+        }
@@ -0,0 +1,146 @@
+import os
+
+import gym
+import numpy as np
+
+"""
+Recording of AvalonEnv rollouts into columnar shards, for offline RL and debugging.
+
+Every transition is a row of fixed dtype columns: the observation the action was taken in, the action, the reward,
+done, the agent's char_type, the hidden roles of all the players (player_types) and the episode number. The rows
+are buffered in preallocated arrays and written with a single np.save per column once a shard is full, so a
+dataset is a directory of shards,
+
+    <directory>/shard_000000/obs.npy, action.npy, reward.npy, ...
+
+which load_trajectories memory maps without parsing anything.
+"""
+
+SHARD_PREFIX = 'shard_'
+
+
+def _columns(num_players, obs_size, action_size):
+    """
+    Column name -> (shape of a row, dtype).
+    """
+    return {
+        'obs': ((obs_size,), np.int8),
+        'action': ((action_size,), np.int16),
+        'reward': ((), np.float32),
+        'done': ((), np.bool_),
+        'char_type': ((), np.int8),
+        'player_types': ((num_players,), np.int8),
+        'episode': ((), np.int64),
+    }
+
+
+def _shard_names(directory):
+    return sorted(name for name in os.listdir(directory)
+                  if name.startswith(SHARD_PREFIX) and os.path.isdir(os.path.join(directory, name)))
+
+
+def _last_episode(directory, shard_names):
+    """
+    Largest episode number in the shards, -1 if there's none. The episodes are numbered in the order they were
+    recorded, so it's in the last shard.
+    """
+    if not shard_names:
+        return -1
+    episodes = np.load(os.path.join(directory, shard_names[-1], 'episode.npy'), mmap_mode='r')
+    return int(episodes.max()) if len(episodes) else -1
+
+
+class TrajectoryRecorder(gym.Wrapper):
+    """
+    Wraps an AvalonEnv and records every transition into shards of `shard_size` rows in the directory.
+    Recording into a directory which already has shards appends new shards to it, the episode numbers continuing
+    after the last episode recorded there.
+
+    Call close (or flush) at the end, otherwise the rows of the last, partially filled, shard are lost.
+    """
+    def __init__(self, env, directory, shard_size=1 << 20):
+        super(TrajectoryRecorder, self).__init__(env)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shard_size = shard_size
+
+        columns = _columns(env.num_players, len(env.observation_space.nvec), len(env.action_space.nvec))
+        self._buffers = {name: np.zeros((shard_size,) + shape, dtype=dtype)
+                         for name, (shape, dtype) in columns.items()}
+        self._size = 0
+        shard_names = _shard_names(directory)
+        self._shard_count = len(shard_names)
+        self._episode = _last_episode(directory, shard_names)
+
+    def reset(self, **kwargs):
+        obs = self.env.reset(**kwargs)
+        self._episode += 1
+        self._begin_row(obs)
+        return obs
+
+    def step(self, action):
+        row = self._size
+        self._buffers['action'][row] = action
+        obs, reward, done, info = self.env.step(action)
+        self._buffers['reward'][row] = reward
+        self._buffers['done'][row] = done
+
+        self._size += 1
+        if self._size == self.shard_size:
+            self.flush()
+        if not done:
+            self._begin_row(obs)
+        return obs, reward, done, info
+
+    def _begin_row(self, obs):
+        """
+        Fill the columns known before the action, the observation is copied right away as the env
+        might reuse its buffer (see AvalonEnv's copy_obs).
+        """
+        row = self._size
+        self._buffers['obs'][row] = obs
+        self._buffers['char_type'][row] = self.env.agent.char_type.value
+        self._buffers['player_types'][row] = self.env.player_types
+        self._buffers['episode'][row] = self._episode
+
+    def flush(self):
+        """
+        Write the buffered rows as a new shard. The shard is written into a temporary directory first,
+        so the readers never see a partially written shard.
+        """
+        if self._size == 0:
+            return
+        name = f'{SHARD_PREFIX}{self._shard_count:06d}'
+        tmp_path = os.path.join(self.directory, f'.{name}.tmp')
+        os.makedirs(tmp_path, exist_ok=True)
+        for column, buffer in self._buffers.items():
+            np.save(os.path.join(tmp_path, f'{column}.npy'), buffer[:self._size])
+        os.replace(tmp_path, os.path.join(self.directory, name))
+
+        self._shard_count += 1
+        # The pending row (observation of an unfinished step) moves to the start of the next shard.
+        if self._size < self.shard_size:
+            for buffer in self._buffers.values():
+                buffer[0] = buffer[self._size]
+        self._size = 0
+
+    def close(self):
+        self.flush()
+        return self.env.close()
+
+
+def load_trajectories(directory, mmap_mode='r'):
+    """
+    Load the shards written by a TrajectoryRecorder, memory mapped by default.
+
+    :param directory: Directory the recorder wrote to.
+    :param mmap_mode: Passed to np.load, None to read the shards into memory.
+    :return: List of shards in the order they were written, every shard being a dict of column name -> array.
+             Use np.concatenate on a column across the shards if a single array is needed (that reads it in memory).
+    """
+    shards = []
+    for name in _shard_names(directory):
+        path = os.path.join(directory, name)
+        shards.append({file[:-len('.npy')]: np.load(os.path.join(path, file), mmap_mode=mmap_mode)
+                       for file in sorted(os.listdir(path)) if file.endswith('.npy')})
+    return shards
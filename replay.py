@@ -0,0 +1,161 @@
+from collections import namedtuple
+import json
+from multiprocessing import Pool
+import zlib
+
+import gym
+import numpy as np
+
+from environment import AvalonEnv
+
+"""
+Deterministic replay of AvalonEnv episodes.
+
+All the randomness of an AvalonEnv comes from its BufferedRandom, so an episode is fully defined by the env config,
+the seed of the random stream at the reset, and the agent actions. ReplayRecorder re-seeds the env with a fresh
+episode seed at every reset and keeps these compact EpisodeRecords, along with a checksum of every observation.
+replay re-executes a record (verifying the checksums), and resimulate does that in bulk, e.g. to recompute the
+returns of recorded episodes after a change in AvalonEnv.compute_reward.
+"""
+
+EpisodeRecord = namedtuple('EpisodeRecord', ['config', 'seed', 'actions', 'checksums'])
+
+
+class ReplayMismatch(Exception):
+    def __init__(self, step, expected, actual):
+        super(ReplayMismatch, self).__init__(
+            f'Observation checksum mismatch at step {step}: expected {expected}, got {actual}')
+        self.step = step
+
+
+def make_env(config, env_class=AvalonEnv):
+    return env_class(enable_logs=False, **config)
+
+
+def observation_checksum(obs):
+    return zlib.crc32(np.asarray(obs, dtype=np.int64).tobytes())
+
+
+class ReplayRecorder(gym.Wrapper):
+    """
+    Wraps an AvalonEnv and keeps an EpisodeRecord for every finished episode in `records`.
+
+    :param seed: Seed of the episode seeds. The env is re-seeded at every reset, so seeding the env itself has no
+                 effect on the games (only on action_space.sample).
+    """
+    def __init__(self, env, seed=None):
+        super(ReplayRecorder, self).__init__(env)
+        self.config = env.get_config()
+        self.records = []
+        self._seed_rng = np.random.default_rng(seed)
+        self._seed = None
+        self._actions = []
+        self._checksums = []
+
+    def reset(self, **kwargs):
+        self._seed = int(self._seed_rng.integers(2 ** 63))
+        self.env.rng.seed(self._seed)
+        obs = self.env.reset(**kwargs)
+        self._actions = []
+        self._checksums = [observation_checksum(obs)]
+        return obs
+
+    def step(self, action):
+        self._actions.append(action)
+        obs, reward, done, info = self.env.step(action)
+        self._checksums.append(observation_checksum(obs))
+        if done:
+            self.records.append(EpisodeRecord(self.config, self._seed,
+                                              np.array(self._actions, dtype=np.int16).reshape(-1, 3),
+                                              np.array(self._checksums, dtype=np.uint32)))
+        return obs, reward, done, info
+
+
+def replay(record, env=None, verify=True):
+    """
+    Re-execute a recorded episode.
+
+    :param record: EpisodeRecord to replay.
+    :param env: Env to replay in, it should have the config of the record. A new one is created if not passed.
+    :param verify: Check the checksum of every observation, raises ReplayMismatch on the first difference.
+    :return: The rewards of every step (as per the current compute_reward), and the info of the last step.
+    """
+    env = env if env is not None else make_env(record.config)
+    env.rng.seed(record.seed)
+    obs = env.reset()
+    if verify:
+        _verify(record, 0, obs)
+
+    rewards = np.zeros(len(record.actions))
+    info = None
+    for step, action in enumerate(record.actions):
+        obs, rewards[step], done, info = env.step(action)
+        if verify:
+            _verify(record, step + 1, obs)
+    return rewards, info
+
+
+def _verify(record, step, obs):
+    checksum = observation_checksum(obs)
+    if checksum != record.checksums[step]:
+        raise ReplayMismatch(step, int(record.checksums[step]), checksum)
+
+
+def _resimulate_chunk(args):
+    records, env_class, verify = args
+    envs = {}
+    returns = []
+    for record in records:
+        key = tuple(sorted(record.config.items()))
+        if key not in envs:
+            envs[key] = make_env(record.config, env_class)
+        rewards, _ = replay(record, envs[key], verify=verify)
+        returns.append(rewards.sum())
+    return returns
+
+
+def resimulate(records, env_class=AvalonEnv, processes=1, verify=False, chunk_size=1000):
+    """
+    Replay many episodes, reusing one env per config.
+
+    :param records: EpisodeRecords to replay.
+    :param env_class: AvalonEnv (sub)class to replay with, e.g. one with a different compute_reward.
+    :param processes: Number of worker processes, the records are replayed in chunks of chunk_size.
+    :param verify: Verify the observation checksums as well.
+    :return: Array with the return of every episode.
+    """
+    chunks = [(records[start:start + chunk_size], env_class, verify) for start in range(0, len(records), chunk_size)]
+    if processes == 1:
+        results = map(_resimulate_chunk, chunks)
+    else:
+        with Pool(processes) as pool:
+            results = pool.map(_resimulate_chunk, chunks)
+    return np.array([episode_return for chunk in results for episode_return in chunk])
+
+
+def save_records(path, records):
+    """
+    Save records sharing a single config into a compact .npz file, see load_records. The config is saved as JSON,
+    so the records of an env with a bot_policy (an object) can't be saved, only replayed in memory.
+    """
+    config = records[0].config
+    assert all(record.config == config for record in records)
+    if 'bot_policy' in config:
+        raise ValueError("The records of an env with a bot_policy can't be saved, the policy isn't JSON serializable")
+    np.savez(path,
+             config=np.array(json.dumps(config)),
+             seeds=np.array([record.seed for record in records], dtype=np.uint64),
+             lengths=np.array([len(record.actions) for record in records], dtype=np.int32),
+             actions=np.concatenate([record.actions for record in records]),
+             checksums=np.concatenate([record.checksums for record in records]))
+
+
+def load_records(path):
+    with np.load(path) as data:
+        config = json.loads(str(data['config']))
+        lengths = data['lengths']
+        action_splits = np.cumsum(lengths)[:-1]
+        actions = np.split(data['actions'], action_splits)
+        checksums = np.split(data['checksums'], action_splits + np.arange(1, len(lengths)))
+        return [EpisodeRecord(config, int(seed), episode_actions, episode_checksums)
+                for seed, episode_actions, episode_checksums in zip(data['seeds'], actions, checksums)]
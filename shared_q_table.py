@@ -0,0 +1,235 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import zlib
+
+import numpy as np
+
+from game.enums_and_config import CharacterType
+from q_table import DenseQTable, NO_ACTION, default_chunk_size
+
+"""
+Q-tables shared by several processes.
+
+SharedDenseQTable is a DenseQTable whose chunks of values (and max / argmax caches) are views of one memory mapped
+file per char type, so all the processes mapping the files read and update the same q-values. The files are sparse
+(in /dev/shm when available), a chunk only takes memory once one of its rows is assigned, when it gets filled with
+NaN like a new chunk of DenseQTable.
+
+The observation -> row index is an open addressing hash table in the same files (keyed by the crc32 of the
+observation bytes, linear probing). Rows are only ever added, under a per table lock, and a row's key is written
+before its slot is published, so lookups don't lock. Every process also keeps the rows it has seen in a local dict.
+
+Updates of the q-values are lock-free (Hogwild style) by default. With lock_free=False every set_value holds one of
+`num_stripes` locks (picked by the row) while writing the value and updating the max / argmax cache of the row,
+so the cache of a row stays consistent with its values. The read-modify-write of a TD update isn't atomic in
+either mode, a concurrent update of the same entry can be lost.
+"""
+
+SHARED_MEMORY_DIR = '/dev/shm'
+# Size of the (sparse) values file of a char type with the default capacity
+VALUES_BYTES = 1 << 28
+MAX_CAPACITY = 1 << 19
+
+
+def default_capacity(num_actions):
+    """
+    Max number of states per char type whose values fit in VALUES_BYTES. The rows get larger with the number of
+    players, so it goes from ~370k states at 5 players to ~9k at 11.
+    """
+    return min(VALUES_BYTES // (np.dtype(np.float32).itemsize * num_actions), MAX_CAPACITY)
+
+
+class SharedStateIndex:
+    """
+    Observation bytes -> row mapping of a SharedDenseQTable, supports the dict methods DenseQTable uses.
+    """
+    def __init__(self, keys, slots, header):
+        self._keys = keys
+        self._slots = slots
+        self._header = header
+        self._mask = len(slots) - 1
+        self._local = {}
+
+    def _probe(self, key):
+        """
+        (row, slot) of the key, row is None if the key isn't in the index (and slot is where it would go).
+        """
+        slot = zlib.crc32(key) & self._mask
+        while True:
+            row = int(self._slots[slot])
+            if row == NO_ACTION:
+                return None, slot
+            if self._keys[row].tobytes() == key:
+                return row, slot
+            slot = (slot + 1) & self._mask
+
+    def get(self, key, default=None):
+        row = self._local.get(key)
+        if row is None:
+            row, _ = self._probe(key)
+            if row is None:
+                return default
+            self._local[key] = row
+        return row
+
+    def insert(self, key):
+        """
+        Row of the key, adding it to the index if it's not in there. The caller holds the insert lock.
+        """
+        row, slot = self._probe(key)
+        if row is None:
+            row = int(self._header[0])
+            self._keys[row] = np.frombuffer(key, dtype=np.uint8)
+            self._slots[slot] = row  # Published after the key is written
+            self._header[0] = row + 1
+        self._local[key] = row
+        return row
+
+    def __getitem__(self, key):
+        row = self.get(key)
+        if row is None:
+            raise KeyError(key)
+        return row
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return int(self._header[0])
+
+    def __iter__(self):
+        return (key for key, _ in self.items())
+
+    def items(self):
+        return [(self._keys[row].tobytes(), row) for row in range(len(self))]
+
+
+class SharedDenseQTable(DenseQTable):
+    """
+    DenseQTable over the memory mapped files of a char type of SharedQTables, see the module docs.
+    """
+    def __init__(self, obs_nvec, action_nvec, path, capacity, chunk_size, insert_lock, stripe_locks=None):
+        super(SharedDenseQTable, self).__init__(obs_nvec, action_nvec, chunk_size=chunk_size)
+        self.obs_nvec = obs_nvec
+        self.capacity = capacity
+        self._insert_lock = insert_lock
+        self._stripe_locks = stripe_locks
+
+        files = _open_files(path, capacity, len(obs_nvec), self.num_actions, mode='r+')
+        self._rows = SharedStateIndex(files['keys'], files['slots'], files['header'])
+        num_chunks = capacity // self.chunk_size
+        self._chunks = np.split(files['values'], num_chunks)
+        self._max_chunks = np.split(files['max'], num_chunks)
+        self._argmax_chunks = np.split(files['argmax'], num_chunks)
+
+    def _row(self, key, create):
+        row = self._rows.get(key)
+        if row is None and create:
+            with self._insert_lock:
+                row = self._rows.get(key)
+                if row is None:
+                    new_row = len(self._rows)
+                    if new_row == self.capacity:
+                        raise RuntimeError(f'The shared q-table is full ({self.capacity} states), '
+                                           f'increase the capacity')
+                    if new_row & self._chunk_mask == 0:
+                        # First row of a chunk, which still holds the zeros of the sparse file.
+                        chunk = new_row >> self._chunk_shift
+                        self._chunks[chunk][:] = np.nan
+                        self._max_chunks[chunk][:] = np.nan
+                        self._argmax_chunks[chunk][:] = NO_ACTION
+                    row = self._rows.insert(key)
+        return row
+
+    def set_value(self, obs, action, value):
+        if self._stripe_locks is None:
+            return super(SharedDenseQTable, self).set_value(obs, action, value)
+        key = obs if isinstance(obs, bytes) else self.state_key(obs)
+        row = self._row(key, create=True)
+        with self._stripe_locks[row % len(self._stripe_locks)]:
+            super(SharedDenseQTable, self).set_value(key, action, value)
+
+    def to_dense(self):
+        """
+        Copy of the table as a regular (process local) DenseQTable.
+        """
+        table = DenseQTable(self.obs_nvec, self.action_nvec, chunk_size=self.chunk_size)
+        num_rows = len(self._rows)
+        for key, _ in self._rows.items():
+            table._row(key, create=True)  # Same rows, in the same order
+        for chunk in range((num_rows + self.chunk_size - 1) // self.chunk_size):
+            table._chunks[chunk][:] = self._chunks[chunk]
+            table._max_chunks[chunk][:] = self._max_chunks[chunk]
+            table._argmax_chunks[chunk][:] = self._argmax_chunks[chunk]
+        return table
+
+
+def _open_files(path, capacity, obs_size, num_actions, mode):
+    shapes = {
+        'values': ((capacity, num_actions), np.float32),
+        'max': ((capacity,), np.float32),
+        'argmax': ((capacity,), np.int32),
+        'keys': ((capacity, obs_size), np.uint8),
+        # Open addressing slots, at most half full
+        'slots': ((1 << (2 * capacity - 1).bit_length(),), np.int32),
+        # Number of rows
+        'header': ((1,), np.int64),
+    }
+    # Plain ndarray views, the memmap subclass makes every indexing slower.
+    return {name: np.memmap(f'{path}.{name}', dtype=dtype, mode=mode, shape=shape).view(np.ndarray)
+            for name, (shape, dtype) in shapes.items()}
+
+
+class SharedQTables:
+    """
+    The shared q-tables of all the char types, for the q_table of QTableAgents in several processes.
+
+    Created by the parent process (which should close it in the end to remove the files), and passed to the worker
+    processes when they are started, where attach() maps the tables.
+    """
+    def __init__(self, obs_nvec, action_nvec, capacity=None, chunk_size=None, lock_free=True, num_stripes=64,
+                 directory=None, ctx=None):
+        """
+        :param obs_nvec: nvec of the MultiDiscrete observation space.
+        :param action_nvec: nvec of the MultiDiscrete action space.
+        :param capacity: Max number of states per char type, rounded up to a multiple of chunk_size. Only the
+                         chunks in use take memory. By default derived from the number of actions (and so from the
+                         number of players), see default_capacity.
+        :param chunk_size: Number of states per chunk, see DenseQTable.
+        :param lock_free: Lock-free (Hogwild) updates, or updates under striped locks.
+        :param num_stripes: Number of locks when lock_free is False.
+        :param directory: Directory of the files, a new temporary one (in /dev/shm if possible) by default.
+        :param ctx: Multiprocessing context of the worker processes (for the locks).
+        """
+        ctx = ctx or multiprocessing
+        self.obs_nvec = [int(n) for n in obs_nvec]
+        self.action_nvec = [int(n) for n in action_nvec]
+        num_actions = int(np.prod(self.action_nvec))
+        chunk_size = 1 << max(int((chunk_size or default_chunk_size(num_actions)) - 1).bit_length(), 0)
+        self.chunk_size = chunk_size
+        capacity = capacity or default_capacity(num_actions)
+        self.capacity = -(-capacity // chunk_size) * chunk_size
+        self.directory = directory or tempfile.mkdtemp(
+            prefix='avalon_q_table_', dir=SHARED_MEMORY_DIR if os.path.isdir(SHARED_MEMORY_DIR) else None)
+        self.insert_locks = {char_type: ctx.Lock() for char_type in CharacterType}
+        self.stripe_locks = None if lock_free else [ctx.Lock() for _ in range(num_stripes)]
+
+        for char_type in CharacterType:
+            files = _open_files(self._path(char_type), self.capacity, len(self.obs_nvec), num_actions, mode='w+')
+            files['slots'][:] = NO_ACTION
+
+    def _path(self, char_type):
+        return os.path.join(self.directory, char_type.name)
+
+    def attach(self):
+        """
+        {char_type: SharedDenseQTable}, to be used as the q_table of a QTableAgent (created with dense=True).
+        """
+        return {char_type: SharedDenseQTable(self.obs_nvec, self.action_nvec, self._path(char_type), self.capacity,
+                                             self.chunk_size, self.insert_locks[char_type], self.stripe_locks)
+                for char_type in CharacterType}
+
+    def close(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,218 @@
+from collections import defaultdict
+import csv
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from environment import AvalonEnv
+from game.enums_and_config import ActionType, CharacterType, Team
+from shm_worker import INFO_FIELDS, NO_VALUE, buffer_view, shared_array, worker
+from vec_env import VecEnv  # The stable-baselines VecEnv, or its stand-in without stable-baselines
+
+"""
+Multiprocess AvalonEnv
+----------------------
+SharedMemoryVecEnv runs AvalonEnvs in worker processes (every worker steps a contiguous slice of the envs). The
+actions, observations, rewards, dones and the info fields are exchanged through shared memory NumPy buffers, the
+pipes only carry the commands and the stats of the finished episodes. So nothing proportional to the number of
+envs gets pickled on a step.
+
+Every worker tracks the reward, length and result of its episodes, and the parent merges them into a single
+Monitor compatible log (monitor.csv, readable with stable_baselines.results_plotter.load_results), with the
+agent's char_type and whether it won as extra columns.
+"""
+
+MONITOR_FILE = 'monitor.csv'
+MONITOR_COLUMNS = ('r', 'l', 't', 'char_type', 'win')
+
+
+class SharedMemoryVecEnv(VecEnv):
+    """
+    Steps `num_envs` AvalonEnvs in `num_workers` processes, exchanging the data through shared memory.
+
+    Compatible with the stable-baselines VecEnv interface. Finished games are reset automatically and the last
+    observation of the finished game is available in info['terminal_observation'] (same as DummyVecEnv).
+    """
+    def __init__(self, num_envs, env_kwargs, num_workers=None, seed=None, monitor_dir=None, start_method=None):
+        """
+        :param num_envs: Number of envs.
+        :param env_kwargs: Kwargs of the AvalonEnvs.
+        :param num_workers: Number of worker processes, the number of CPUs by default.
+        :param seed: Env i is seeded with seed + i.
+        :param monitor_dir: If passed, the episodes of all the envs are logged into monitor_dir/monitor.csv.
+        :param start_method: Multiprocessing start method, forkserver (if available) by default like SubprocVecEnv.
+        """
+        self.env_kwargs = env_kwargs
+        num_workers = min(num_envs, num_workers or os.cpu_count())
+        template = AvalonEnv(**env_kwargs)
+        obs_size = len(template.observation_space.nvec)
+        super(SharedMemoryVecEnv, self).__init__(num_envs, template.observation_space, template.action_space)
+
+        specs = {
+            'obs': shared_array((num_envs, obs_size), np.int64),
+            'terminal_obs': shared_array((num_envs, obs_size), np.int64),
+            'actions': shared_array((num_envs, len(self.action_space.nvec)), np.int64),
+            'rewards': shared_array((num_envs,), np.float64),
+            'dones': shared_array((num_envs,), np.bool_),
+            'infos': shared_array((num_envs, len(INFO_FIELDS)), np.int64),
+        }
+        self._buffers = {name: buffer_view(spec) for name, spec in specs.items()}
+
+        # Contiguous slices of envs per worker
+        bounds = np.linspace(0, num_envs, num_workers + 1).astype(int)
+        self._slices = [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+        seeds = self._seeds(seed)
+
+        if start_method is None:
+            start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        ctx = multiprocessing.get_context(start_method)
+        self.remotes, self.processes = [], []
+        for start, stop in self._slices:
+            remote, work_remote = ctx.Pipe()
+            process = ctx.Process(target=worker, args=(work_remote, remote, env_kwargs, start, seeds[start:stop], specs),
+                                  daemon=True)
+            process.start()
+            work_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+        self.closed = False
+
+        self.t_start = time.time()
+        self.episode_rewards = []
+        self.episode_lengths = []
+        # CharacterType -> [games, wins]
+        self.win_stats = defaultdict(lambda: [0, 0])
+        self._monitor_file = None
+        self._monitor = None
+        if monitor_dir is not None:
+            os.makedirs(monitor_dir, exist_ok=True)
+            self._monitor_file = open(os.path.join(monitor_dir, MONITOR_FILE), 'wt')
+            self._monitor_file.write('#%s\n' % json.dumps({'t_start': self.t_start, 'env_id': 'AvalonEnv'}))
+            self._monitor = csv.writer(self._monitor_file)
+            self._monitor.writerow(MONITOR_COLUMNS)
+            self._monitor_file.flush()
+
+    def _seeds(self, seed):
+        return [None if seed is None else seed + idx for idx in range(self.num_envs)]
+
+    def seed(self, seed=None):
+        seeds = self._seeds(seed)
+        for remote, (start, stop) in zip(self.remotes, self._slices):
+            remote.send(('seed', seeds[start:stop]))
+        return [s for remote in self.remotes for s in remote.recv()]
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        for remote in self.remotes:
+            remote.recv()
+        return self._buffers['obs'].copy()
+
+    def step_async(self, actions):
+        self._buffers['actions'][:] = np.asarray(actions).reshape(self._buffers['actions'].shape)
+        for remote in self.remotes:
+            remote.send(('step', None))
+
+    def step_wait(self):
+        finished = []
+        for remote in self.remotes:
+            finished += remote.recv()
+        if finished:
+            self._log_episodes(finished)
+
+        dones = self._buffers['dones'].copy()
+        infos = self._decode_infos()
+        for idx in np.flatnonzero(dones):
+            infos[idx]['terminal_observation'] = self._buffers['terminal_obs'][idx].copy()
+        return self._buffers['obs'].copy(), self._buffers['rewards'].copy(), dones, infos
+
+    def _decode_infos(self):
+        action_types = list(ActionType)
+        char_types = {c.value: c for c in CharacterType}
+        teams = {t.value: t for t in Team}
+        teams[NO_VALUE] = None
+        num_players = self.env_kwargs['num_players']
+
+        infos = []
+        for (next_action, char_type, team_size, winner, agent_team, penalties), action in zip(
+                self._buffers['infos'].tolist(), self._buffers['actions'].copy()):
+            infos.append({
+                'next_action': action_types[next_action],
+                'char_type': char_types[char_type],
+                'prev_action': action,
+                'num_players': num_players,
+                'quest_team_size': team_size,
+                'game_winner': teams[winner],
+                'agent_team': teams[agent_team],
+                'num_penalties': penalties,
+            })
+        return infos
+
+    def _log_episodes(self, finished):
+        for reward, length, end_time, char_type, win in finished:
+            self.episode_rewards.append(reward)
+            self.episode_lengths.append(length)
+            stats = self.win_stats[CharacterType(char_type)]
+            stats[0] += 1
+            stats[1] += win
+            if self._monitor is not None:
+                self._monitor.writerow((round(reward, 6), length, round(end_time - self.t_start, 6),
+                                        CharacterType(char_type).name, int(win)))
+        if self._monitor is not None:
+            self._monitor_file.flush()
+
+    def win_percentages(self):
+        """
+        Win percentage of the agent per char_type, over all the finished episodes.
+        """
+        return {char_type: 100 * wins / games for char_type, (games, wins) in self.win_stats.items()}
+
+    def close(self):
+        if self.closed:
+            return
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for process in self.processes:
+            process.join()
+        if self._monitor_file is not None:
+            self._monitor_file.close()
+        self.closed = True
+
+    def _remote_calls(self, cmd, make_data, indices):
+        """
+        Send the command to the workers owning the indices, and collect the results in the order of the indices
+        (like DummyVecEnv, an index given twice is called twice).
+        """
+        indices = self._get_indices(indices)
+        calls = []
+        for remote, (start, stop) in zip(self.remotes, self._slices):
+            positions = [position for position, idx in enumerate(indices) if start <= idx < stop]
+            if positions:
+                remote.send((cmd, make_data([indices[position] - start for position in positions])))
+                calls.append((remote, positions))
+        results = [None] * len(indices)
+        for remote, positions in calls:
+            result = remote.recv()
+            if result is not None:
+                for position, value in zip(positions, result):
+                    results[position] = value
+        return results
+
+    def get_attr(self, attr_name, indices=None):
+        return self._remote_calls('get_attr', lambda local: (attr_name, local), indices)
+
+    def set_attr(self, attr_name, value, indices=None):
+        self._remote_calls('set_attr', lambda local: (attr_name, value, local), indices)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self._remote_calls('env_method', lambda local: (method_name, method_args, method_kwargs, local), indices)
+
+    def _get_indices(self, indices):
+        if indices is None:
+            return range(self.num_envs)
+        if isinstance(indices, int):
+            return [indices]
+        return list(indices)
@@ -0,0 +1,93 @@
+from multiprocessing.sharedctypes import RawArray
+import time
+
+import numpy as np
+
+from environment import AvalonEnv
+
+"""
+Worker side of SharedMemoryVecEnv.
+
+Kept apart from shm_vec_env, which imports stable-baselines (and so TensorFlow) for the VecEnv base class, so the
+spawned worker processes only import the environment.
+"""
+
+# Info fields exchanged through the shared buffer, see encode_info / SharedMemoryVecEnv._decode_infos
+INFO_FIELDS = ('next_action', 'char_type', 'quest_team_size', 'game_winner', 'agent_team', 'num_penalties')
+NO_VALUE = 0
+
+
+def shared_array(shape, dtype):
+    dtype = np.dtype(dtype)
+    raw = RawArray('b', int(np.prod(shape)) * dtype.itemsize)
+    return raw, shape, dtype.str
+
+
+def buffer_view(spec):
+    raw, shape, dtype = spec
+    return np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+
+def encode_info(info):
+    return [info['next_action'].value, info['char_type'].value, info['quest_team_size'],
+            NO_VALUE if info['game_winner'] is None else info['game_winner'].value, info['agent_team'].value,
+            info['num_penalties']]
+
+
+def worker(remote, parent_remote, env_kwargs, start, seeds, specs):
+    parent_remote.close()
+    buffers = {name: buffer_view(spec) for name, spec in specs.items()}
+    envs = [AvalonEnv(**env_kwargs) for _ in seeds]
+    for env, seed in zip(envs, seeds):
+        env.seed(seed)
+    stop = start + len(envs)
+    obs, terminal_obs = buffers['obs'][start:stop], buffers['terminal_obs'][start:stop]
+    actions, rewards, dones = buffers['actions'][start:stop], buffers['rewards'][start:stop], buffers['dones'][start:stop]
+    infos = buffers['infos'][start:stop]
+    episode_rewards = [0.0] * len(envs)
+    episode_lengths = [0] * len(envs)
+
+    while True:
+        cmd, data = remote.recv()
+        if cmd == 'step':
+            finished = []
+            for idx, env in enumerate(envs):
+                ob, reward, done, info = env.step(actions[idx])
+                rewards[idx] = reward
+                dones[idx] = done
+                infos[idx] = encode_info(info)
+                episode_rewards[idx] += reward
+                episode_lengths[idx] += 1
+                if done:
+                    finished.append((episode_rewards[idx], episode_lengths[idx], time.time(), info['char_type'].value,
+                                     info['game_winner'] == info['agent_team']))
+                    episode_rewards[idx], episode_lengths[idx] = 0.0, 0
+                    terminal_obs[idx] = ob
+                    ob = env.reset()
+                obs[idx] = ob
+            remote.send(finished)
+        elif cmd == 'reset':
+            for idx, env in enumerate(envs):
+                obs[idx] = env.reset()
+                episode_rewards[idx], episode_lengths[idx] = 0.0, 0
+            remote.send(None)
+        elif cmd == 'seed':
+            remote.send([env.seed(seed)[0] for env, seed in zip(envs, data)])
+        elif cmd == 'get_attr':
+            name, indices = data
+            remote.send([getattr(envs[idx], name) for idx in indices])
+        elif cmd == 'set_attr':
+            name, value, indices = data
+            for idx in indices:
+                setattr(envs[idx], name, value)
+            remote.send(None)
+        elif cmd == 'env_method':
+            name, args, kwargs, indices = data
+            remote.send([getattr(envs[idx], name)(*args, **kwargs) for idx in indices])
+        elif cmd == 'close':
+            for env in envs:
+                env.close()
+            remote.close()
+            break
+        else:
+            raise NotImplementedError(f'Unknown command {cmd}')
@@ -0,0 +1,78 @@
+import numpy as np
+
+from game.sampler import get_team_sampler
+
+"""
+Seat symmetry of the observations.
+
+The observation lists the visibility of every player in seat order, and the leader as a seat. The agent is always
+at seat 0, and the other seats only differ by what the agent sees of them (their visibility) and by which one of
+them leads. So observations which are the same up to a relabeling of the other seats are, for the agent, the same
+state. SeatCanonicalizer maps all of them to a single canonical observation, with the other seats sorted by
+(visibility, leader or not), which makes the q-tables up to (num_players - 1)! times smaller and every canonical
+state visited that many times more.
+
+The canonical seat i is the seat perm[i] of the game. The team selection entry of the actions is mapped through the
+same permutation, the approval and vote entries don't depend on the seats. What is lost is the seat order itself,
+i.e. who leads after the current leader. That's deliberate: the observations are already relative to the agent's
+seat, so rotating them (keeping the cyclic order) instead of sorting the seats wouldn't merge any states.
+"""
+
+
+class SeatCanonicalizer:
+    """
+    Canonical observations and the actions mapping for a player count, for batches of observations.
+    """
+    def __init__(self, num_players):
+        self.num_players = num_players
+        sampler = get_team_sampler(num_players)
+        self._team_masks = sampler.team_masks
+        self._mask_to_index = sampler.mask_to_index
+        self._seats = np.arange(num_players)
+
+    def canonicalize(self, observations):
+        """
+        :param observations: (batch, obs size) array of observations.
+        :return: The canonical observations, and the (batch, num_players) permutations of the seats (canonical
+                 seat -> seat of the game).
+        """
+        observations = np.asarray(observations)
+        p = self.num_players
+        visibilities = observations[:, :p]
+        leader = observations[:, -1]
+        keys = 2 * visibilities + (self._seats == leader[:, None])
+        perms = np.empty((len(observations), p), dtype=np.int64)
+        perms[:, 0] = 0  # The agent stays at seat 0
+        perms[:, 1:] = 1 + np.argsort(keys[:, 1:], axis=1, kind='stable')
+
+        canonical = observations.copy()
+        canonical[:, :p] = np.take_along_axis(visibilities, perms, axis=1)
+        canonical[:, -1] = np.argmax(perms == leader[:, None], axis=1)
+        return canonical, perms
+
+    def _map_teams(self, team_indices, perms, inverse):
+        """
+        Team selection entries mapped through the permutations (or their inverse).
+        """
+        in_team = (self._team_masks[team_indices][:, None] >> self._seats) & 1
+        if inverse:
+            # Seat of the game -> canonical seat
+            in_team = np.take_along_axis(in_team, perms, axis=1)
+            return self._mask_to_index[(in_team << self._seats).sum(axis=1)]
+        return self._mask_to_index[(in_team << perms).sum(axis=1)]
+
+    def to_env_actions(self, actions, perms):
+        """
+        Actions chosen on canonical observations -> actions for the game.
+        """
+        actions = np.array(actions, dtype=np.int64)
+        actions[:, 0] = self._map_teams(actions[:, 0], perms, inverse=False)
+        return actions
+
+    def to_canonical_actions(self, actions, perms):
+        """
+        Actions for the game -> the same actions on the canonical observations.
+        """
+        actions = np.array(actions, dtype=np.int64)
+        actions[:, 0] = self._map_teams(actions[:, 0], perms, inverse=True)
+        return actions
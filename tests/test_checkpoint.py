@@ -0,0 +1,102 @@
+"""
+Round-trip of the q-tables through the checkpoints, and the generations of the snapshots.
+"""
+import os
+import random
+
+import numpy as np
+import pytest
+
+import checkpoint
+from agent import QTableAgent
+from checkpoint import QTableCheckpoint, QTableCheckpointer, write_snapshot
+from environment import AvalonEnv
+from game.enums_and_config import CharacterType
+from q_learning_trial import run_episode
+
+
+def train(agent, num_episodes, seed):
+    """
+    A few episodes of q-learning on the agent's env.
+    """
+    random.seed(seed)
+    agent.env.seed(seed)
+    for _ in range(num_episodes):
+        run_episode(agent.env, agent)
+
+
+def entries(agent):
+    """
+    {char_type: {(state bytes, action index): q-value}} of the agent's q-tables.
+    """
+    nvec = [int(n) for n in agent.env.action_space.nvec]
+    return {char_type: {(key, action_idx): value
+                        for key, action_idx, value in checkpoint._table_entries(table, nvec)}
+            for char_type, table in agent.q_table.items()}
+
+
+def assert_same_entries(agent, checkpoint_entries):
+    for char_type, expected in entries(agent).items():
+        actual = checkpoint_entries[char_type]
+        assert actual.keys() == expected.keys()
+        np.testing.assert_allclose([actual[key] for key in expected], list(expected.values()), rtol=1e-6)
+
+
+@pytest.mark.parametrize('dense', [True, False])
+def test_snapshots_and_deltas(tmp_path, dense):
+    agent = QTableAgent(env=AvalonEnv(5, enable_logs=False), dense=dense, track_changes=True)
+    checkpointer = QTableCheckpointer(str(tmp_path), agent, snapshot_every=3)
+    for seed in range(5):
+        train(agent, 20, seed)
+        checkpointer.checkpoint()
+        loaded = QTableCheckpoint(str(tmp_path))
+        assert_same_entries(agent, {char_type: loaded.entries(char_type) for char_type in CharacterType})
+    assert loaded.generation == 1
+
+
+@pytest.mark.parametrize('dense', [True, False])
+def test_load_into(tmp_path, dense):
+    agent = QTableAgent(env=AvalonEnv(5, enable_logs=False), dense=dense)
+    train(agent, 50, 0)
+    write_snapshot(str(tmp_path), agent)
+
+    loaded = QTableAgent(env=AvalonEnv(5, enable_logs=False), dense=dense)
+    QTableCheckpoint(str(tmp_path)).load_into(loaded)
+    assert_same_entries(agent, entries(loaded))
+
+    reader = QTableCheckpoint(str(tmp_path))
+    for char_type, table_entries in entries(agent).items():
+        for (key, action_idx), value in list(table_entries.items())[:100]:
+            action = np.unravel_index(action_idx, reader.action_nvec)
+            assert reader.get(char_type, tuple(key), action) == pytest.approx(value, rel=1e-6)
+    assert reader.get(CharacterType.SERVANT, (0,) * reader.obs_size, (0, 0, 0)) is None
+
+
+def test_old_generations_are_removed(tmp_path):
+    agent = QTableAgent(env=AvalonEnv(5, enable_logs=False), dense=True)
+    for seed in range(3):
+        train(agent, 10, seed)
+        write_snapshot(str(tmp_path), agent)
+    generations = {checkpoint._file_generation(name) for name in os.listdir(tmp_path)}
+    assert generations == {2, None}
+
+
+def test_crash_before_the_flip_keeps_the_previous_generation(tmp_path, monkeypatch):
+    agent = QTableAgent(env=AvalonEnv(5, enable_logs=False), dense=True)
+    train(agent, 20, 0)
+    write_snapshot(str(tmp_path), agent)
+    before = QTableCheckpoint(str(tmp_path))
+    snapshot = {char_type: before.entries(char_type) for char_type in CharacterType}
+
+    def crash(src, dst):
+        raise OSError('crash')
+
+    train(agent, 20, 1)
+    monkeypatch.setattr(checkpoint.os, 'replace', crash)
+    with pytest.raises(OSError):
+        write_snapshot(str(tmp_path), agent)
+    monkeypatch.undo()
+
+    after = QTableCheckpoint(str(tmp_path))
+    assert after.generation == 0
+    assert {char_type: after.entries(char_type) for char_type in CharacterType} == snapshot
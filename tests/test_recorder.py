@@ -0,0 +1,59 @@
+"""
+The shards of the TrajectoryRecorder, and the numbering of their episodes.
+"""
+import numpy as np
+
+from environment import AvalonEnv
+from recorder import TrajectoryRecorder, load_trajectories
+
+
+def record(directory, num_episodes, shard_size, seed=0):
+    env = TrajectoryRecorder(AvalonEnv(5, enable_logs=False), directory, shard_size=shard_size)
+    env.seed(seed)
+    env.action_space.seed(seed)
+    num_steps = 0
+    for _ in range(num_episodes):
+        env.reset()
+        done = False
+        while not done:
+            _, _, done, _ = env.step(env.action_space.sample())
+            num_steps += 1
+    env.close()
+    return num_steps
+
+
+def column(shards, name):
+    return np.concatenate([shard[name] for shard in shards])
+
+
+def test_shards(tmp_path):
+    num_steps = record(str(tmp_path), 10, shard_size=16)
+    shards = load_trajectories(str(tmp_path))
+    assert [len(shard['done']) for shard in shards[:-1]] == [16] * (len(shards) - 1)
+    assert len(column(shards, 'done')) == num_steps
+    assert column(shards, 'done').sum() == 10
+
+    # The episodes are numbered in order, and end with their done row
+    episodes, dones = column(shards, 'episode'), column(shards, 'done')
+    assert (np.diff(episodes) >= 0).all()
+    np.testing.assert_array_equal(np.unique(episodes), np.arange(10))
+    ends = np.flatnonzero(dones)
+    np.testing.assert_array_equal(episodes[ends], np.arange(10))
+    np.testing.assert_array_equal(np.flatnonzero(np.diff(episodes)), ends[:-1])
+
+
+def test_episode_numbers_continue_in_a_new_session(tmp_path):
+    record(str(tmp_path), 4, shard_size=16)
+    record(str(tmp_path), 3, shard_size=1000, seed=1)
+    shards = load_trajectories(str(tmp_path))
+    episodes, dones = column(shards, 'episode'), column(shards, 'done')
+    np.testing.assert_array_equal(episodes[np.flatnonzero(dones)], np.arange(7))
+    assert (np.diff(episodes) >= 0).all()
+
+
+def test_empty_session_keeps_the_numbering(tmp_path):
+    record(str(tmp_path), 2, shard_size=16)
+    record(str(tmp_path), 0, shard_size=16)
+    record(str(tmp_path), 2, shard_size=16, seed=1)
+    episodes = column(load_trajectories(str(tmp_path)), 'episode')
+    np.testing.assert_array_equal(np.unique(episodes), np.arange(4))
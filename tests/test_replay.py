@@ -0,0 +1,66 @@
+"""
+Replay of the recorded episodes, and the checksums of their observations.
+"""
+import numpy as np
+import pytest
+
+from environment import AvalonEnv
+from replay import ReplayMismatch, ReplayRecorder, load_records, replay, resimulate, save_records
+
+
+def record_episodes(num_episodes, num_players=5, seed=0, **env_kwargs):
+    env = ReplayRecorder(AvalonEnv(num_players, enable_logs=False, **env_kwargs), seed=seed)
+    env.action_space.seed(seed)
+    returns = []
+    for _ in range(num_episodes):
+        env.reset()
+        done, episode_return = False, 0.0
+        while not done:
+            _, reward, done, _ = env.step(env.action_space.sample())
+            episode_return += reward
+        returns.append(episode_return)
+    return env.records, returns
+
+
+@pytest.mark.parametrize('env_kwargs', [dict(num_players=5), dict(num_players=8, fast_forward=True),
+                                        dict(num_players=7, majority_rule=False, enable_penalties=False)])
+def test_replay_matches_the_checksums(env_kwargs):
+    records, returns = record_episodes(20, **env_kwargs)
+    for record, episode_return in zip(records, returns):
+        rewards, info = replay(record)
+        assert rewards.sum() == pytest.approx(episode_return)
+        assert info['game_winner'] is not None
+    np.testing.assert_allclose(resimulate(records, verify=True), returns)
+
+
+def test_mismatch_is_reported_at_its_step():
+    records, _ = record_episodes(1)
+    record = records[0]
+    checksums = record.checksums.copy()
+    checksums[3] ^= 1
+    with pytest.raises(ReplayMismatch) as error:
+        replay(record._replace(checksums=checksums))
+    assert error.value.step == 3
+
+
+def test_changed_action_is_detected():
+    records, _ = record_episodes(5)
+    record = max(records, key=lambda record: len(record.actions))
+    actions = record.actions.copy()
+    actions[:, 0] = (actions[:, 0] + 1) % AvalonEnv(enable_logs=False, **record.config).action_space.nvec[0]
+    with pytest.raises(ReplayMismatch):
+        replay(record._replace(actions=actions))
+
+
+def test_save_and_load(tmp_path):
+    records, returns = record_episodes(10)
+    path = str(tmp_path / 'records.npz')
+    save_records(path, records)
+    loaded = load_records(path)
+    assert len(loaded) == len(records)
+    for record, loaded_record in zip(records, loaded):
+        assert loaded_record.config == record.config
+        assert loaded_record.seed == record.seed
+        np.testing.assert_array_equal(loaded_record.actions, record.actions)
+        np.testing.assert_array_equal(loaded_record.checksums, record.checksums)
+    np.testing.assert_allclose(resimulate(loaded, verify=True), returns)
@@ -0,0 +1,98 @@
+"""
+Goodness-of-fit of the TeamSampler against the team picking of the bots, one player at a time proportional to the
+weights of the players not picked yet (np.random.choice without replacement, before the sampler).
+"""
+from collections import Counter
+import itertools
+import math
+
+import numpy as np
+import pytest
+
+from benchmarks.team_sampler import CASES
+from game.rng import BufferedRandom
+from game.sampler import MIN_WEIGHT, get_team_sampler
+
+NUM_DRAWS = 20000
+ALPHA = 1e-3
+MIN_EXPECTED = 5  # The outcomes expected less often than that are pooled into a single bin
+
+
+def chi2_sf(statistic, dof):
+    """
+    Survival function of the chi-square distribution, Wilson-Hilferty approximation.
+    """
+    if dof <= 0:
+        return 1.0
+    z = ((statistic / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def pick_probabilities(weights, team_size):
+    """
+    Exact probability of every ordered pick of team_size players.
+    """
+    weights = [w if w > 0 else MIN_WEIGHT for w in weights]
+    probabilities = {}
+    for picks in itertools.permutations(range(len(weights)), team_size):
+        probability, remaining = 1.0, sum(weights)
+        for pid in picks:
+            probability *= weights[pid] / remaining
+            remaining -= weights[pid]
+        probabilities[picks] = probability
+    return probabilities
+
+
+def goodness_of_fit(counts, probabilities):
+    """
+    Chi-square goodness-of-fit test of a Counter of ordered picks. Returns the p-value.
+    """
+    num_draws = sum(counts.values())
+    assert set(counts) <= set(probabilities), "Picks which can't happen"
+    statistic, num_bins = 0.0, 0
+    pooled_observed, pooled_expected = 0, 0.0
+    for picks, probability in probabilities.items():
+        expected = probability * num_draws
+        if expected < MIN_EXPECTED:
+            pooled_observed += counts[picks]
+            pooled_expected += expected
+        else:
+            statistic += (counts[picks] - expected) ** 2 / expected
+            num_bins += 1
+    if pooled_expected > 0:
+        statistic += (pooled_observed - pooled_expected) ** 2 / pooled_expected
+        num_bins += 1
+    return chi2_sf(statistic, num_bins - 1)
+
+
+@pytest.mark.parametrize('weights, team_size', CASES)
+def test_sample(weights, team_size):
+    sampler = get_team_sampler(len(weights))
+    rng = BufferedRandom(0)
+    counts = Counter(tuple(sampler.sample(weights, team_size, rng)[0]) for _ in range(NUM_DRAWS))
+    assert goodness_of_fit(counts, pick_probabilities(weights, team_size)) > ALPHA
+
+
+@pytest.mark.parametrize('weights, team_size', CASES)
+def test_sample_batch(weights, team_size):
+    sampler = get_team_sampler(len(weights))
+    rng = np.random.default_rng(1)
+    batch_weights = np.tile(np.array(weights, dtype=np.float64), (NUM_DRAWS, 1))
+    picks, _ = sampler.sample_batch(batch_weights, np.full(NUM_DRAWS, team_size), rng.random(batch_weights.shape))
+    counts = Counter(tuple(row[:team_size]) for row in picks.tolist())
+    assert goodness_of_fit(counts, pick_probabilities(weights, team_size)) > ALPHA
+
+
+def test_goodness_of_fit_rejects_unweighted_picks():
+    weights, team_size = CASES[0]
+    rng = np.random.default_rng(0)
+    counts = Counter(tuple(rng.permutation(len(weights))[:team_size].tolist()) for _ in range(NUM_DRAWS))
+    assert goodness_of_fit(counts, pick_probabilities(weights, team_size)) < ALPHA
+
+
+def test_team_index():
+    sampler = get_team_sampler(7)
+    rng = BufferedRandom(0)
+    for _ in range(100):
+        picks, index = sampler.sample([100] * 7, 3, rng)
+        assert sorted(picks) == sampler.teams[index][:3].tolist()
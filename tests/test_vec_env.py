@@ -0,0 +1,100 @@
+"""
+The game rules and rewards of AvalonVecEnv, checked on random games of every player count.
+"""
+import numpy as np
+import pytest
+
+from game.enums_and_config import ActionType, MAX_QUESTS, Team, game_player_configs
+from vec_env import AvalonVecEnv
+
+NUM_ENVS = 64
+NUM_STEPS = 100
+
+
+def random_actions(env, rng):
+    return np.stack([rng.integers(n, size=env.num_envs) for n in env.action_space.nvec], axis=1)
+
+
+def legal_actions(env, rng):
+    """
+    Random actions among the ones allowed by the legal action mask.
+    """
+    mask = env.legal_action_mask()
+    actions = []
+    start = 0
+    for n in env.action_space.nvec:
+        allowed = mask[:, start:start + n]
+        actions.append([rng.choice(np.flatnonzero(row)) for row in allowed])
+        start += n
+    return np.array(actions).T
+
+
+@pytest.mark.parametrize('num_players', sorted(game_player_configs))
+@pytest.mark.parametrize('majority_rule', [True, False])
+def test_observations_and_rewards(num_players, majority_rule):
+    env = AvalonVecEnv(NUM_ENVS, num_players, majority_rule=majority_rule, seed=0)
+    rng = np.random.default_rng(0)
+    obs = env.reset()
+    num_done = 0
+    for _ in range(NUM_STEPS):
+        # The proposal count goes up to max_proposals_allowed + 1, past its nvec at 5 and 6 players (as in AvalonEnv)
+        proposal = num_players + 2
+        assert (obs[:, proposal] <= env.max_proposals_allowed + 1).all()
+        obs[:, proposal] = 0
+        assert ((obs >= 0) & (obs < env.observation_space.nvec)).all()
+        selection = obs[:, num_players] == ActionType.TEAM_SELECTION.value
+        assert (obs[selection, -1] == 0).all(), "The games only stop on the team selections of the agent"
+        obs, rewards, dones, infos = env.step(random_actions(env, rng))
+
+        # Every entry of the action gets +0.1, or -0.5 when it's penalized
+        action_rewards = 0.3 - 0.6 * np.array([info['num_penalties'] for info in infos])
+        outcome_rewards = rewards - action_rewards
+        for done, reward, info in zip(dones, outcome_rewards, infos):
+            if done:
+                assert info['game_winner'] in (Team.GOOD, Team.EVIL)
+                assert reward == pytest.approx(2 if info['game_winner'] is info['agent_team'] else -2)
+                assert 'terminal_observation' in info
+            else:
+                # The quests concluded by the step, +1 for the ones won by the agent's team
+                assert info['game_winner'] is None
+                assert reward == pytest.approx(round(reward)) and abs(reward) < MAX_QUESTS
+        num_done += dones.sum()
+    assert num_done > 0
+
+
+@pytest.mark.parametrize('num_players', [5, 8, 11])
+def test_legal_actions_are_not_penalized(num_players):
+    env = AvalonVecEnv(NUM_ENVS, num_players, seed=0)
+    rng = np.random.default_rng(0)
+    env.reset()
+    for _ in range(50):
+        _, _, _, penalties = env.step_arrays(legal_actions(env, rng))
+        assert (penalties == 0).all()
+
+
+@pytest.mark.parametrize('num_players', [5, 8, 11])
+def test_team_selection_sizes(num_players):
+    env = AvalonVecEnv(NUM_ENVS, num_players, seed=0)
+    rng = np.random.default_rng(0)
+    env.reset()
+    quest_sizes = np.array(game_player_configs[num_players].quest_size)
+    for _ in range(50):
+        env.step_arrays(random_actions(env, rng))
+        voting = env.action_type == ActionType.QUEST_VOTE.value
+        assert (env.team_size == quest_sizes[env.quest]).all()
+        assert ((env.team != -1).sum(axis=1)[voting] == env.team_size[voting]).all()
+        assert (env.good_wins < env.win_target).all() and (env.evil_wins < env.win_target).all()
+
+
+def test_seeded_games_are_reproducible():
+    trajectories = []
+    for _ in range(2):
+        env = AvalonVecEnv(NUM_ENVS, 7, seed=3)
+        rng = np.random.default_rng(1)
+        steps = [env.reset()]
+        for _ in range(50):
+            obs, rewards, dones, _ = env.step_arrays(random_actions(env, rng))
+            steps += [obs, rewards, dones]
+        trajectories.append(steps)
+    for first, second in zip(*trajectories):
+        np.testing.assert_array_equal(first, second)
@@ -0,0 +1,512 @@
+from gym.spaces import MultiDiscrete
+import numpy as np
+
+from game.enums_and_config import ActionType, CharacterType, PlayerVisibility, Team, MAX_QUESTS, \
+    game_player_configs
+from actions import get_action_tables
+from game.policy import HeuristicPolicy
+from game.sampler import get_team_sampler
+from observation import VISIBILITY_TABLE
+
+"""
+Vectorized Avalon
+-----------------
+AvalonEnv walks the AvalonGame -> Quest -> Player objects one bot move at a time, which makes it slow
+to collect a lot of experience. AvalonVecEnv plays `num_envs` games at the same time and keeps their
+state as struct-of-arrays NumPy buffers (one row per game). Every transition (team selection, team approval,
+quest voting) is applied to all the games that need it in a single vectorized operation.
+
+The rules, bot heuristics, rewards and the observation layout mirror AvalonGame / AvalonEnv, with the
+agent always sitting at seat 0. So the models trained on one can be evaluated on the other.
+"""
+
+try:
+    from stable_baselines.common.vec_env import VecEnv
+except ImportError:
+    # The tabular trainers (see vec_q_learning.py) don't need stable-baselines, nor TensorFlow.
+    class VecEnv:
+        """
+        Minimal stand-in for the stable-baselines VecEnv base class, when stable-baselines isn't installed.
+        """
+        def __init__(self, num_envs, observation_space, action_space):
+            self.num_envs = num_envs
+            self.observation_space = observation_space
+            self.action_space = action_space
+
+        def step(self, actions):
+            self.step_async(actions)
+            return self.step_wait()
+
+
+# Constants used to encode the state arrays
+NO_PLAYER = -1
+NO_WINNER = 0
+GOOD = Team.GOOD.value
+EVIL = Team.EVIL.value
+SERVANT = CharacterType.SERVANT.value
+MINION = CharacterType.MINION.value
+TEAM_SELECTION = ActionType.TEAM_SELECTION.value
+TEAM_APPROVAL = ActionType.TEAM_APPROVAL.value
+QUEST_VOTE = ActionType.QUEST_VOTE.value
+
+
+class AvalonVecEnv(VecEnv):
+    """
+    Steps `num_envs` Avalon games in one call.
+
+    Compatible with the stable-baselines VecEnv interface, so it can be passed directly to the models
+    instead of a DummyVecEnv of AvalonEnvs. Finished games are reset automatically and the last observation
+    of the finished game is available in info['terminal_observation'] (same as DummyVecEnv).
+    """
+    def __init__(self, num_envs, num_players, autoplay=False, enable_penalties=True, majority_rule=True,
+                 max_quests=MAX_QUESTS, max_proposals_allowed=5, seed=None, action_mask_in_info=False, bot_policy=None):
+        """
+        :param num_envs: Number of games to play in parallel.
+        :param num_players: Number of players in every game.
+        :param autoplay: When autoplay is true, all the agent actions are nullified and the agent plays as per the heuristics.
+        :param enable_penalties: Same as in AvalonEnv.
+        :param majority_rule: If False, a single fail is enough to sabotage the quest.
+        :param seed: Seed for the random number generator.
+        :param action_mask_in_info: Add the legal action mask for the next step to the infos as 'action_mask'.
+        :param bot_policy: BotPolicy of the bots (see game.policy), the HeuristicPolicy by default. It decides for
+                           all the games at once.
+        """
+        self.num_players = num_players
+        self.autoplay = autoplay
+        self.enable_penalties = enable_penalties
+        self.majority_rule = majority_rule
+        self.max_quests = max_quests
+        self.max_proposals_allowed = max_proposals_allowed
+        self.action_mask_in_info = action_mask_in_info
+        self.win_target = max_quests // 2 + 1
+        self.bot_policy = bot_policy if bot_policy is not None else HeuristicPolicy()
+
+        config = game_player_configs[num_players]
+        self.good_count = config.team_split[0]
+        self.quest_sizes = np.array(config.quest_size, dtype=np.int8)
+        self.max_team_size = int(self.quest_sizes.max())
+
+        # Team selection actions as a padded (num_options, max_team_size) array
+        self.team_sampler = get_team_sampler(num_players)
+        self.team_options = self.team_sampler.teams
+        self.team_option_sizes = self.team_sampler.team_sizes
+        self._player_bits = 1 << np.arange(num_players, dtype=np.int64)
+        self.action_tables = get_action_tables(num_players)
+
+        action_space = MultiDiscrete(self.action_tables.nvec)
+        obs_space = [len(PlayerVisibility)] * num_players
+        obs_space += [len(ActionType), max_quests, num_players, num_players]
+        observation_space = MultiDiscrete(obs_space)
+        super(AvalonVecEnv, self).__init__(num_envs, observation_space, action_space)
+
+        self._rng = None
+        self.seed(seed)
+        self._allocate_buffers()
+        self._actions = None
+
+    def _allocate_buffers(self):
+        """
+        Struct-of-arrays state of all the games.
+        """
+        n, p = self.num_envs, self.num_players
+        # Per player state
+        self.roles = np.zeros((n, p), dtype=np.int8)  # CharacterType values
+        self.passed = np.zeros((n, p), dtype=np.int8)  # Passed missions the player was a part of
+        self.failed = np.zeros((n, p), dtype=np.int8)  # Failed missions the player was a part of
+        self.in_team = np.zeros((n, p), dtype=bool)
+        self.team_masks = np.zeros(n, dtype=np.int64)  # Bit masks of in_team
+        # Current team in the order it was picked (this is also the quest voting order)
+        self.team = np.full((n, self.max_team_size), NO_PLAYER, dtype=np.int8)
+        # Per game state
+        self.quest = np.zeros(n, dtype=np.int8)
+        self.team_size = np.zeros(n, dtype=np.int8)
+        self.leader = np.zeros(n, dtype=np.int8)
+        self.proposal = np.zeros(n, dtype=np.int8)
+        self.action_type = np.zeros(n, dtype=np.int8)
+        # Position of the next pending turn in the current round (seat for approval, team position for voting)
+        self.cursor = np.zeros(n, dtype=np.int8)
+        self.approvals = np.zeros(n, dtype=np.int8)
+        self.mission_fails = np.zeros(n, dtype=np.int8)
+        self.good_wins = np.zeros(n, dtype=np.int8)
+        self.evil_wins = np.zeros(n, dtype=np.int8)
+        self.winner = np.zeros(n, dtype=np.int8)
+        # Reward for the quests concluded since the last step (see AvalonEnv.compute_reward)
+        self.quest_rewards = np.zeros(n, dtype=np.int8)
+
+    def seed(self, seed=None):
+        self._rng = np.random.default_rng(seed)
+        return [seed] * self.num_envs
+
+    """
+    VecEnv interface
+    """
+    def reset(self):
+        self._reset_games(np.ones(self.num_envs, dtype=bool))
+        return self._observations()
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions, dtype=np.int64).reshape(self.num_envs, len(self.action_space.nvec))
+
+    def step_wait(self):
+        return self._step(self._actions, make_infos=True)
+
+    def step_arrays(self, actions):
+        """
+        Same as step, without building the infos (which is a good part of the cost of a step with many games).
+
+        :return: obs, rewards, dones and the number of penalties of every game.
+        """
+        return self._step(np.asarray(actions, dtype=np.int64), make_infos=False)
+
+    def _step(self, actions, make_infos):
+        action_type = self.action_type.copy()
+        team_size = self.team_size.copy()
+
+        self._take_agent_actions(actions, action_type)
+        self._run_bots()
+        rewards, penalties = self._compute_rewards(actions, action_type, team_size)
+
+        dones = self.winner != NO_WINNER
+        obs = self._observations()
+        if not make_infos:
+            if dones.any():
+                self._reset_games(dones)
+                obs[dones] = self._observations()[dones]
+            return obs, rewards, dones, penalties
+
+        infos = self._infos(actions, penalties)
+
+        if dones.any():
+            for idx in np.flatnonzero(dones):
+                infos[idx]['terminal_observation'] = obs[idx].copy()
+            self._reset_games(dones)
+            obs[dones] = self._observations()[dones]
+
+        if self.action_mask_in_info:
+            for info, mask in zip(infos, self.legal_action_mask()):
+                info['action_mask'] = mask
+
+        return obs, rewards, dones, infos
+
+    def legal_action_mask(self):
+        """
+        (num_envs, sum of action_space.nvec) boolean array of the actions that won't be penalized in the next step.
+        """
+        return self.action_tables.legal_action_masks(self.action_type, self.team_size)
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        # Config is shared by all the games.
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        method = getattr(self, method_name)
+        return [method(*method_args, **method_kwargs) for _ in self._get_indices(indices)]
+
+    def _get_indices(self, indices):
+        if indices is None:
+            return range(self.num_envs)
+        if isinstance(indices, int):
+            return [indices]
+        return indices
+
+    """
+    Game logic
+    """
+    def _reset_games(self, mask):
+        """
+        Start new games in the envs selected by the boolean mask.
+        """
+        count = int(mask.sum())
+        # Random assignment of the character types, `good_count` random players are servants.
+        order = np.argsort(self._rng.random((count, self.num_players)), axis=1)
+        self.roles[mask] = np.where(order < self.good_count, SERVANT, MINION)
+
+        self.passed[mask] = 0
+        self.failed[mask] = 0
+        self.good_wins[mask] = 0
+        self.evil_wins[mask] = 0
+        self.winner[mask] = NO_WINNER
+        self.quest_rewards[mask] = 0
+        self.quest[mask] = 0
+        self.leader[mask] = 0
+        self._initialize_quest(mask)
+        self._run_bots()
+
+    def _initialize_quest(self, mask):
+        self.team_size[mask] = self.quest_sizes[self.quest[mask]]
+        self.proposal[mask] = 0
+        self.mission_fails[mask] = 0
+        self._initialize_team_selection_round(mask)
+
+    def _initialize_team_selection_round(self, mask):
+        self.team[mask] = NO_PLAYER
+        self.in_team[mask] = False
+        self.team_masks[mask] = 0
+        self.action_type[mask] = TEAM_SELECTION
+        self.cursor[mask] = 0
+
+    def _agent_turn(self):
+        """
+        Boolean mask of the games waiting for an action from the agent (seat 0).
+        """
+        selection = (self.action_type == TEAM_SELECTION) & (self.leader == 0)
+        approval = (self.action_type == TEAM_APPROVAL) & (self.cursor == 0)
+        voting = self.action_type == QUEST_VOTE
+        position = np.minimum(self.cursor, self.max_team_size - 1).astype(np.int64)
+        next_voter = np.take_along_axis(self.team, position[:, None], axis=1)[:, 0]
+        voting &= (self.cursor < self.team_size) & (next_voter == 0)
+        return selection | approval | voting
+
+    def _run_bots(self):
+        """
+        Keep playing the bot moves until every game is either waiting for the agent, or is over.
+        """
+        while True:
+            active = (self.winner == NO_WINNER) & ~self._agent_turn()
+            if not active.any():
+                break
+            selection = active & (self.action_type == TEAM_SELECTION)
+            approval = active & (self.action_type == TEAM_APPROVAL)
+            voting = active & (self.action_type == QUEST_VOTE)
+            if selection.any():
+                self._team_selection_move(np.flatnonzero(selection), None)
+            if approval.any():
+                self._bot_team_approval_moves(np.flatnonzero(approval))
+            if voting.any():
+                self._quest_vote_moves(np.flatnonzero(voting), None)
+
+    def _take_agent_actions(self, actions, action_type):
+        """
+        Apply the agent actions. Invalid (or nullified by autoplay) actions are replaced by the heuristics,
+        same as in AvalonEnv._take_action.
+        """
+        active = self.winner == NO_WINNER
+        selection = np.flatnonzero(active & (action_type == TEAM_SELECTION))
+        approval = np.flatnonzero(active & (action_type == TEAM_APPROVAL))
+        voting = np.flatnonzero(active & (action_type == QUEST_VOTE))
+
+        if len(selection):
+            choice = None
+            if not self.autoplay:
+                option = actions[selection, TEAM_SELECTION]
+                valid = self.team_option_sizes[option] == self.team_size[selection]
+                choice = np.where(valid[:, None], self.team_options[option], NO_PLAYER)
+            self._team_selection_move(selection, choice)
+
+        if len(approval):
+            # Like Quest.make_team_approval_move, only an explicit approval overrides the heuristics.
+            response = self._approval_draws(approval)[:, 0]
+            if not self.autoplay:
+                response |= actions[approval, TEAM_APPROVAL] == 1
+            self.approvals[approval] += response
+            self.cursor[approval] = 1
+
+        if len(voting):
+            votes = np.zeros((len(voting), self.max_team_size), dtype=np.int8)
+            if not self.autoplay:
+                votes[:] = actions[voting, QUEST_VOTE][:, None] == 1
+            self._quest_vote_moves(voting, votes)
+
+    def _team_selection_move(self, games, choice):
+        """
+        Team selection by the current leader of `games`. Rows of `choice` filled with NO_PLAYER
+        (or choice=None) use the heuristics.
+        """
+        limit_reached = self.proposal[games] - 1 == self.max_proposals_allowed
+        self.winner[games[limit_reached]] = EVIL
+        if choice is not None:
+            choice = choice[~limit_reached]
+        games = games[~limit_reached]
+        if not len(games):
+            return
+
+        picks = self._pick_quest_teams(games)
+        if choice is not None:
+            overridden = choice[:, 0] != NO_PLAYER
+            picks[overridden] = choice[overridden]
+
+        self.team[games] = picks
+        masks = np.where(picks != NO_PLAYER, self._player_bits[picks], 0).sum(axis=1)
+        self.team_masks[games] = masks
+        self.in_team[games] = (masks[:, None] & self._player_bits) != 0
+        self.leader[games] = (self.leader[games] + 1) % self.num_players
+        self.proposal[games] += 1
+        self.action_type[games] = TEAM_APPROVAL
+        self.approvals[games] = 0
+        self.cursor[games] = 0
+
+    def _bot_team_approval_moves(self, games):
+        """
+        Approval moves of all the bots (every seat after the agent) at once, followed by the approval result.
+        """
+        draws = self._approval_draws(games)
+        self.approvals[games] += draws[:, 1:].sum(axis=1, dtype=np.int8)
+
+        approved = 2 * self.approvals[games] > self.num_players
+        voting = games[approved]
+        self.action_type[voting] = QUEST_VOTE
+        self.cursor[voting] = 0
+        self.mission_fails[voting] = 0
+
+        rejected = np.zeros(self.num_envs, dtype=bool)
+        rejected[games[~approved]] = True
+        self._initialize_team_selection_round(rejected)
+
+    def _quest_vote_moves(self, games, agent_votes):
+        """
+        Quest votes of the team members starting from the current cursor. When `agent_votes` is None only bot
+        votes are made, stopping at the agent's turn. Otherwise the agent (whose turn it is) votes first.
+        """
+        positions = np.arange(self.max_team_size)
+        team = self.team[games]
+        cursor = self.cursor[games][:, None]
+        team_size = self.team_size[games][:, None]
+
+        pass_p = self.bot_policy.pass_probabilities(self.roles[games] == MINION, self.passed[games], self.failed[games],
+                                                    self.team_masks[games], self.team_size[games])
+        pass_p = np.take_along_axis(pass_p, np.maximum(team, 0).astype(np.int64), axis=1)
+        fails = self._rng.random(team.shape) < 1 - pass_p
+        if agent_votes is not None:
+            # Explicit pass by the agent overrides the heuristics
+            at_cursor = positions == cursor
+            fails[at_cursor & (agent_votes == 1)] = False
+            start = cursor + 1
+        else:
+            start = cursor
+
+        # Bots vote until it's agent's turn (or the voting is over)
+        agent_ahead = (team == 0) & (positions >= start) & (positions < team_size)
+        stop = np.where(agent_ahead.any(axis=1), agent_ahead.argmax(axis=1), team_size[:, 0])[:, None]
+        voted = (positions >= cursor) & (positions < stop)
+        fails &= voted
+
+        if not self.majority_rule:
+            # A single fail concludes the quest right away
+            sabotaged = fails.any(axis=1)
+            self._conclude_quests(games[sabotaged], False)
+            games, fails, stop, team_size = games[~sabotaged], fails[~sabotaged], stop[~sabotaged], team_size[~sabotaged]
+
+        self.mission_fails[games] += fails.sum(axis=1, dtype=np.int8)
+        self.cursor[games] = stop[:, 0]
+
+        concluded = stop[:, 0] == team_size[:, 0]
+        games = games[concluded]
+        if self.majority_rule:
+            success = 2 * self.mission_fails[games] < self.team_size[games]
+        else:
+            success = np.ones(len(games), dtype=bool)
+        self._conclude_quests(games, success)
+
+    def _conclude_quests(self, games, success):
+        """
+        Update the histories and scores after the quest. Games that aren't over move to the next quest.
+        """
+        success = np.broadcast_to(success, games.shape)
+        members = self.in_team[games]
+        self.passed[games] += members & success[:, None]
+        self.failed[games] += members & ~success[:, None]
+        self.good_wins[games] += success
+        self.evil_wins[games] += ~success
+
+        winner = np.where(self.good_wins[games] == self.win_target, GOOD,
+                          np.where(self.evil_wins[games] == self.win_target, EVIL, NO_WINNER))
+        self.winner[games] = winner
+
+        # Same as AvalonEnv, the quest reward is given only if the game goes on.
+        ongoing = games[winner == NO_WINNER]
+        agent_good = self.roles[ongoing, 0] == SERVANT
+        self.quest_rewards[ongoing] += np.where(agent_good == success[winner == NO_WINNER], 1, -1).astype(np.int8)
+
+        new_quest = np.zeros(self.num_envs, dtype=bool)
+        new_quest[ongoing] = True
+        self.quest[new_quest] += 1
+        self._initialize_quest(new_quest)
+
+    """
+    Bot decisions, by the bot policy
+    """
+    def _approval_draws(self, games):
+        """
+        Approve (True) or reject (False) decision of every seat in `games`.
+        """
+        p = self.bot_policy.approval_probabilities(self.roles[games] == MINION, self.passed[games], self.failed[games],
+                                                   self.team_masks[games], self.team_size[games], self.majority_rule)
+        return self._rng.random(p.shape) < p
+
+    def _pick_quest_teams(self, games):
+        """
+        Weighted team picks by the leaders of `games`, padded with NO_PLAYER.
+        """
+        weights = self.bot_policy.team_weights(self.roles[games] == MINION, self.passed[games], self.failed[games],
+                                               self.leader[games])
+        picks, _ = self.team_sampler.sample_batch(weights, self.team_size[games], self._rng.random(weights.shape))
+        return picks
+
+    """
+    Rewards and observations, same as AvalonEnv.compute_reward and AvalonEnv._convert_game_feedback_to_observation
+    """
+    def _compute_rewards(self, actions, action_type, team_size):
+        rewards = np.zeros(self.num_envs, dtype=np.float64)
+        penalties = np.zeros(self.num_envs, dtype=np.int64)
+
+        # Reward for winning / losing the quests
+        rewards += self.quest_rewards
+        self.quest_rewards[:] = 0
+
+        # Reward for winning / losing the game
+        agent_team = np.where(self.roles[:, 0] == SERVANT, GOOD, EVIL)
+        over = self.winner != NO_WINNER
+        rewards += np.where(over, np.where(self.winner == agent_team, 2, -2), 0)
+
+        option = actions[:, TEAM_SELECTION]
+        relevant = np.where(action_type == TEAM_SELECTION, self.team_option_sizes[option] == team_size,
+                            actions[np.arange(self.num_envs), action_type] != 0)
+        penalized = ~relevant & self.enable_penalties
+        rewards += np.where(penalized, -0.5, 0.1)
+        penalties += penalized
+
+        for at in (TEAM_APPROVAL, QUEST_VOTE):
+            penalized = (at != action_type) & (actions[:, at] != 0) & self.enable_penalties
+            rewards += np.where(penalized, -0.5, 0.1)
+            penalties += penalized
+
+        return rewards, penalties
+
+    def _observations(self):
+        agent_evil = self.roles[:, :1] == MINION
+        # Index of the team in list(Team) as visible to the agent
+        team_idx = np.where(agent_evil, self.roles - 1, list(Team).index(Team.UNKNOWN))
+        team_idx[:, 0] = self.roles[:, 0] - 1
+        visibilities = VISIBILITY_TABLE[team_idx, self.in_team.astype(np.int64), self.passed, self.failed]
+
+        return np.concatenate([
+            visibilities,
+            np.stack([self.action_type, self.quest, self.proposal, self.leader], axis=1).astype(np.int64)
+        ], axis=1)
+
+    def _infos(self, actions, penalties):
+        action_types = list(ActionType)
+        char_types = {c.value: c for c in CharacterType}
+        teams = {t.value: t for t in Team}
+        teams[NO_WINNER] = None
+
+        infos = []
+        for idx in range(self.num_envs):
+            char_type = char_types[self.roles[idx, 0]]
+            infos.append({
+                'next_action': action_types[self.action_type[idx]],
+                'char_type': char_type,
+                'prev_action': actions[idx],
+                'num_players': self.num_players,
+                'quest_team_size': int(self.team_size[idx]),
+                'game_winner': teams[self.winner[idx]],
+                'agent_team': Team.GOOD if char_type is CharacterType.SERVANT else Team.EVIL,
+                'num_penalties': int(penalties[idx]),
+            })
+        return infos
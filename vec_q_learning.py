@@ -0,0 +1,129 @@
+import numpy as np
+
+from game.enums_and_config import CharacterType
+from q_table import NO_ACTION
+from symmetry import SeatCanonicalizer
+from vec_env import AvalonVecEnv
+
+"""
+Batched Q-learning
+------------------
+BatchedQLearning trains the dense q-tables of a QTableAgent on an AvalonVecEnv. On every step the observations of
+all the games are looked up at once (grouped by the agent's char_type, as every char type has its own q-table),
+the epsilon-greedy actions come from the cached greedy actions of the rows, and the (s, a, r, s') transitions of
+all the games are applied with a single DenseQTable.td_update per char type, which scatters the TD errors with
+np.add.at. So the cost of an update is mostly NumPy work amortized over the batch, instead of the Python dict
+accesses of QTableAgent.get_next_action.
+
+Differences with the per-step loop of q_learning_trial.train,
+
+- All the TD errors of a batch are computed from the q-values before the batch. When several games hit the same
+  (state, action) in a batch, the entry moves by the mean of their TD errors, whatever the order of the games.
+- The transition into the end of a game is learned as well (target = reward, without bootstrapping), the
+  per-step loop never sees it since the agent isn't called after the last step.
+
+The resulting q-tables are plain DenseQTables, so the agent predicts, evaluates and checkpoints as usual. If the
+agent's env has canonical_seats, the q-tables are learned on the canonical observations as well.
+"""
+
+
+class BatchedQLearning:
+    """
+    Q-learning of a QTableAgent (created with dense=True) over `num_envs` games at the same time.
+    The agent's alpha, gamma and epsilon are used, and the games are the ones of the agent's env.
+    """
+    def __init__(self, agent, num_envs=1024, seed=None):
+        """
+        :param agent: QTableAgent with dense q-tables, trained in place.
+        :param num_envs: Number of games played at the same time, i.e. number of transitions per batch.
+        :param seed: Seed of the games and of the exploration.
+        """
+        assert agent.dense, "Batched updates need the dense q-tables"
+        self.agent = agent
+        config = agent.env.get_config()
+        assert not config.get('factored_actions'), "AvalonVecEnv has the unfactored team actions only"
+        self.env = AvalonVecEnv(num_envs, config['num_players'], autoplay=config['autoplay'],
+                                enable_penalties=config['enable_penalties'], majority_rule=config['majority_rule'],
+                                seed=seed, bot_policy=config.get('bot_policy'))
+        self.action_nvec = self.env.action_space.nvec
+        self.num_actions = int(np.prod(self.action_nvec))
+        self._rng = np.random.default_rng(None if seed is None else seed + 1)
+        self.canonicalizer = SeatCanonicalizer(config['num_players']) if config.get('canonical_seats') else None
+        self._seat_perms = None
+        self._obs = self._canonicalize(self.env.reset())
+        self._episode_rewards = np.zeros(num_envs)
+        self.num_updates = 0
+
+    def _char_type_groups(self):
+        """
+        (char_type, q-table, indices of the games) for the agent's char types of the current games.
+        """
+        char_types = self.env.roles[:, 0]
+        for value in np.unique(char_types).tolist():
+            char_type = CharacterType(value)
+            yield char_type, self.agent.get_q_table(char_type), np.flatnonzero(char_types == value)
+
+    def _select_actions(self, groups):
+        """
+        Epsilon-greedy action indices of all the games, and the q-table rows of their observations.
+        """
+        num_envs = self.env.num_envs
+        rows = np.empty(num_envs, dtype=np.int64)
+        greedy = np.empty(num_envs, dtype=np.int64)
+        for char_type, q_table, games in groups:
+            rows[games] = q_table.state_rows(self._obs[games])
+            greedy[games] = q_table.greedy_indices(rows[games])
+
+        explore = (self._rng.random(num_envs) < self.agent.epsilon) | (greedy == NO_ACTION)
+        action_indices = np.where(explore, self._rng.integers(self.num_actions, size=num_envs), greedy)
+        return action_indices, rows
+
+    def step(self):
+        """
+        Play a step of all the games and apply their TD updates.
+
+        :return: Rewards of the episodes which ended on this step.
+        """
+        groups = list(self._char_type_groups())
+        action_indices, rows = self._select_actions(groups)
+        actions = np.stack(np.unravel_index(action_indices, self.action_nvec), axis=1)
+        obs = self._obs
+        env_actions = actions
+        if self.canonicalizer is not None:
+            env_actions = self.canonicalizer.to_env_actions(actions, self._seat_perms)
+        new_obs, rewards, dones, _ = self.env.step_arrays(env_actions)
+        new_obs = self._canonicalize(new_obs)
+
+        gamma = self.agent.gamma
+        for char_type, q_table, games in groups:
+            # The games which are done were reset already, and are not bootstrapped anyway.
+            next_max = q_table.max_values(q_table.state_rows(new_obs[games], create=False))
+            targets = rewards[games] + gamma * np.where(dones[games], 0.0, next_max)
+            q_table.td_update(rows[games], action_indices[games], targets, self.agent.alpha)
+            if self.agent.changed_entries is not None:
+                for game in games.tolist():
+                    self.agent.changed_entries.add((char_type, tuple(obs[game].tolist()),
+                                                    tuple(actions[game].tolist())))
+
+        self.num_updates += self.env.num_envs
+        self._obs = new_obs
+        self._episode_rewards += rewards
+        finished = self._episode_rewards[dones].tolist()
+        self._episode_rewards[dones] = 0
+        return finished
+
+    def _canonicalize(self, observations):
+        if self.canonicalizer is None:
+            return observations
+        observations, self._seat_perms = self.canonicalizer.canonicalize(observations)
+        return observations
+
+    def learn(self, num_steps):
+        """
+        :param num_steps: Number of batched steps, num_steps * num_envs transitions in total.
+        :return: Rewards of the episodes which ended during the training.
+        """
+        episode_rewards = []
+        for _ in range(num_steps):
+            episode_rewards += self.step()
+        return episode_rewards